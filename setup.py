@@ -4,7 +4,10 @@ from setuptools import setup, find_packages
 setup(
     name='ship_it',
     version='0.11.0',
-    install_requires=['invoke', 'PyYaml', 'six', 'virtualenv', 'click'],
+    install_requires=['PyYaml', 'six', 'virtualenv', 'click'],
+    extras_require={'zstd': ['zstandard']},
+    # precompile needs compileall's -o, -s and -p
+    python_requires='>=3.9',
     packages=['ship_it'],
     url='https://github.com/robdennis/ship_it',
     license='MIT',
@@ -14,5 +17,14 @@ setup(
                 'practices for creating deb/rpm packages for python applications',
     entry_points={
         'console_scripts': ['ship_it=ship_it.scripts:main']
-        }
+        },
+    classifiers=[
+        'License :: OSI Approved :: MIT License',
+        'Programming Language :: Python :: 3',
+        'Programming Language :: Python :: 3 :: Only',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
+        'Programming Language :: Python :: 3.12',
+    ]
 )
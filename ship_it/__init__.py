@@ -1,12 +1,36 @@
 # coding=utf-8
 from __future__ import unicode_literals
+import importlib
+import logging
 import sys
-import subprocess
 from os import path
 
 from ship_it.manifest import Manifest, get_manifest_from_path
 from ship_it import cli
-from ship_it.virtualenv import VirtualEnvPackager
+from ship_it.timing import stage
+
+logger = logging.getLogger(__name__)
+
+
+def __getattr__(name):
+    """
+    Build-only modules are imported by the functions that need them, rather
+    than slowing down every run of the command line tool. This keeps
+    ``ship_it.VirtualEnvPackager`` and submodules like ``ship_it.virtualenv``
+    working as if they'd been imported here.
+    """
+    if name == 'VirtualEnvPackager':
+        from ship_it.virtualenv import VirtualEnvPackager
+        return VirtualEnvPackager
+    if not name.startswith('_'):
+        module_name = '{}.{}'.format(__name__, name)
+        try:
+            return importlib.import_module(module_name)
+        except ImportError as exc:
+            if exc.name != module_name:
+                raise
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__,
+                                                                     name))
 
 
 def validate_path(path_to_check):
@@ -14,13 +38,50 @@ def validate_path(path_to_check):
 
 
 def get_version_from_setup_py(setup_py_path):
+    import subprocess
+    from ship_it.version import read_version
+
+    version = read_version(setup_py_path)
+    if version is not None:
+        return version
     out = subprocess.check_output([sys.executable, setup_py_path, '--version'])
     return out.decode('utf-8').rstrip()
 
 
 def fpm(manifest_path, requirements_file_path=None, setup_py_path=None,
-        **overrides):
-    manifest = get_manifest_from_path(manifest_path)
+        cache_dir=None, wheelhouse=None, skip_unchanged=False, isolated=False,
+        document=None, **overrides):
+    """
+    Build the packages for a manifest. If the manifest file has several
+    documents and `document` isn't given, every one of them is built in turn.
+    An `isolated` build works in its own directory, so it can run alongside
+    other builds of the same manifest (see `ship_it.workspace`).
+    """
+    with stage('build', manifest=manifest_path):
+        return _fpm(manifest_path, requirements_file_path, setup_py_path,
+                    cache_dir, wheelhouse, skip_unchanged, isolated,
+                    document, overrides)
+
+
+def _fpm(manifest_path, requirements_file_path, setup_py_path, cache_dir,
+         wheelhouse, skip_unchanged, isolated, document, overrides):
+    with stage('load manifest'):
+        manifest = get_manifest_from_path(manifest_path, document=document)
+
+    if document is None and manifest.document_count > 1:
+        artifacts = []
+        for index in range(manifest.document_count):
+            artifacts.extend(_fpm(manifest_path, requirements_file_path,
+                                  setup_py_path, cache_dir, wheelhouse,
+                                  skip_unchanged, isolated, index, overrides))
+        return artifacts
+
+    if cache_dir is not None:
+        manifest.contents['cache_dir'] = cache_dir
+    if wheelhouse is not None:
+        manifest.contents['wheelhouse'] = wheelhouse
+    if isolated:
+        manifest.contents['isolated'] = 'true'
     if requirements_file_path is None:
         requirements_file_path = path.join(manifest.manifest_dir,
                                            'requirements.txt')
@@ -29,21 +90,135 @@ def fpm(manifest_path, requirements_file_path=None, setup_py_path=None,
 
     validate_path(manifest.path)
 
-    packager = _package_virtualenv_with_manifest(manifest,
-                                                 requirements_file_path,
-                                                 setup_py_path)
+    from ship_it import runner
+    from ship_it.workspace import BuildWorkspace
+    with BuildWorkspace(manifest, manifest.isolated) as workspace, \
+            runner.logging_to(manifest.local_log_path):
+        artifacts = _build(manifest, requirements_file_path, setup_py_path,
+                           skip_unchanged, overrides)
+        workspace.promote()
+    return artifacts
+
+
+def _build(manifest, requirements_file_path, setup_py_path, skip_unchanged,
+           overrides):
+    """
+    Build the packages for a loaded manifest, with the output of every
+    command going to the manifest's log directory
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from ship_it.analyze import analyze_package
+    from ship_it.fingerprint import BuildRecord, get_build_fingerprint
+    from ship_it.slim import (SlimReport, get_slim_patterns,
+                              hardlink_duplicates, prune_tree)
+    from ship_it.staging import assemble_staging_root
+
+    # the native backend reads files from where they are, so it never needs
+    # them gathered together
+    staging_root = None
+    if manifest.use_staging_root and manifest.backend == 'fpm':
+        staging_root = manifest.local_staging_path
+
+    # The virtualenv is only built once, however many package types we make
+    # from it.
+    command_lines = []
+    flags_by_target = {}
+    version = None
+    for target in manifest.targets:
+        man_args, man_flags = manifest.get_args_and_flags(
+            target, staging_root=staging_root)
+        man_flags.extend(overrides.items())
+
+        if not any(flag[0] == 'version' for flag in man_flags):
+            if version is None:
+                with stage('version probe'):
+                    version = get_version_from_setup_py(setup_py_path)
+            man_flags.extend([('version', version)])
+
+        command_lines.append((cli.get_command_line(man_args, man_flags),
+                              target))
+        flags_by_target[target] = man_flags
+
+    record = fingerprint = None
+    if skip_unchanged:
+        with stage('fingerprint'):
+            record = BuildRecord(manifest)
+            fingerprint = get_build_fingerprint(manifest, command_lines,
+                                                requirements_file_path,
+                                                setup_py_path)
+            up_to_date = record.is_up_to_date(fingerprint)
+        if up_to_date:
+            logger.info('%s is unchanged since the last build, skipping it',
+                        manifest.path)
+            return []
+
+    with stage('virtualenv'):
+        packager = _package_virtualenv_with_manifest(manifest,
+                                                     requirements_file_path,
+                                                     setup_py_path)
+
+    # pruned before compiling, so nothing's compiled for nothing, and
+    # deduplicated after relocating, which replaces the files it rewrites
+    slim_report = SlimReport()
+    if manifest.slim_profiles:
+        with stage('slim'):
+            prune_tree(manifest.local_virtualenv_path,
+                       get_slim_patterns(manifest), slim_report,
+                       keep_packages=True)
+
+    if manifest.precompile:
+        packager.precompile(manifest.remote_virtualenv_path,
+                            manifest.precompile_optimize,
+                            manifest.precompile_invalidation)
 
     packager.patch_virtualenv(manifest.remote_virtualenv_path)
 
-    man_args, man_flags = manifest.get_args_and_flags()
-    man_flags.extend(overrides.items())
+    if manifest.dedupe:
+        with stage('dedupe'):
+            hardlink_duplicates(manifest.local_virtualenv_path, slim_report)
+    if manifest.slim_profiles or manifest.dedupe:
+        logger.info('slimmed %s: %s', manifest.local_virtualenv_path,
+                    slim_report)
 
-    if not any(flag[0] == 'version' for flag in man_flags):
-        man_flags.extend([('version', get_version_from_setup_py(setup_py_path))])
+    if manifest.analyze:
+        with stage('analyze'):
+            analysis = analyze_package(manifest)
+        logger.info('%s', analysis.format())
+        analysis.check_budgets(manifest.max_size, manifest.max_files)
 
-    command_line = cli.get_command_line(man_args, man_flags)
+    if staging_root is not None:
+        with stage('assemble staging root'):
+            assemble_staging_root(manifest, staging_root)
+
+    if len(command_lines) == 1:
+        artifacts = _make_package(manifest, command_lines[0][0],
+                                  command_lines[0][1], flags_by_target)
+    else:
+        with ThreadPoolExecutor(max_workers=len(command_lines)) as executor:
+            futures = [executor.submit(_make_package, manifest, command_line,
+                                       target, flags_by_target)
+                       for command_line, target in command_lines]
+            artifacts = [artifact for future in futures
+                         for artifact in future.result()]
 
-    cli.invoke_fpm(command_line)
+    if record is not None:
+        record.save(fingerprint, artifacts)
+    return artifacts
+
+
+def _make_package(manifest, command_line, target, flags_by_target):
+    if manifest.backend == 'native':
+        from ship_it import native
+        with stage('native {}'.format(target)):
+            return native.build_package(manifest, flags_by_target[target],
+                                        target)
+    return _invoke_fpm(command_line, target)
+
+
+def _invoke_fpm(command_line, target):
+    with stage('fpm {}'.format(target)):
+        result = cli.invoke_fpm(command_line, target)
+    return cli.get_created_packages(getattr(result, 'stdout', None))
 
 
 def _package_virtualenv_with_manifest(manifest, requirements_file_path,
@@ -57,17 +232,50 @@ def _package_virtualenv_with_manifest(manifest, requirements_file_path,
         - useful if requirements_file contains '.'
     * pip: run ``pip install .``
     * install (default): run ``python setup.py install``
+
+    If the manifest has a cache directory, a virtualenv built from the same
+    inputs before is restored from it instead of being rebuilt. If it has a
+    lock file, requirements are installed from that (for every method but
+    install, which leaves them to setup.py).
     """
+    from ship_it.cache import VirtualEnvCache, get_cache_key
+    from ship_it.lock import check_lock_file
+    from ship_it.template import VirtualEnvTemplates
+    from ship_it.virtualenv import VirtualEnvPackager
+    from ship_it.wheelhouse import Wheelhouse
 
     venv = manifest.local_virtualenv_path
     install_method = manifest.contents.get('method')
 
+    lock_file = None
+    if manifest.locked and install_method in ('copy', 'requirements', 'pip'):
+        check_lock_file(manifest.lock_file_path, requirements_file_path)
+        lock_file = manifest.lock_file_path
+
+    cache = cache_key = None
+    if manifest.cache_dir:
+        cache = VirtualEnvCache(manifest.cache_dir)
+        with stage('cache lookup'):
+            cache_key = get_cache_key(manifest, requirements_file_path,
+                                      setup_py_path)
+            hit = cache.restore(cache_key, venv)
+        if hit:
+            return VirtualEnvPackager(venv, build=False)
+
     # Buld virtualenv and optionally upgrade pip
-    packager = VirtualEnvPackager(venv, manifest.upgrade_pip, manifest.upgrade_wheel)
+    wheelhouse = Wheelhouse(manifest.wheelhouse) if manifest.wheelhouse else None
+    template = (VirtualEnvTemplates(manifest.template_dir)
+                if manifest.template_dir else None)
+    packager = VirtualEnvPackager(venv, manifest.upgrade_pip, manifest.upgrade_wheel,
+                                  incremental=manifest.incremental,
+                                  wheelhouse=wheelhouse, template=template,
+                                  lock_file=lock_file,
+                                  require_hashes=manifest.require_hashes)
 
     if install_method == 'copy':
         packager.copy_package(requirements_file_path,
-                                manifest.local_package_path)
+                              manifest.local_package_path,
+                              exclude=manifest.contents.get('exclude', []))
 
     elif install_method == 'requirements':
         packager.install_requirements(requirements_file_path)
@@ -78,5 +286,9 @@ def _package_virtualenv_with_manifest(manifest, requirements_file_path,
     else:
         packager.install_package(setup_py_path)
 
+    if cache is not None:
+        with stage('cache store'):
+            cache.store(cache_key, venv)
+
     return packager
 
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import csv
+import glob
+import io
+import logging
+import stat
+from concurrent.futures import ThreadPoolExecutor
+from os import path
+
+from ship_it.payload import get_hardlinks, get_payload_entries
+from ship_it.slim import format_size
+
+logger = logging.getLogger(__name__)
+
+# where files that no distribution owns are counted
+CONFIG_FILES = '(config files)'
+EXTRA_FILES = '(extra files)'
+OTHER_FILES = '(other virtualenv files)'
+
+# threads to walk the virtualenv with, it's mostly waiting on the filesystem
+WALK_WORKERS = 8
+
+
+class BudgetExceeded(Exception):
+    """
+    A package is bigger, or has more files, than its manifest allows
+    """
+
+
+def _get_owner_name(metadata_dir):
+    name = path.basename(metadata_dir)
+    return name[:name.rindex('.')]
+
+
+def _read_owned_paths(metadata_dir):
+    """
+    The paths a distribution installed, from its ``.dist-info`` RECORD or
+    ``.egg-info`` installed-files.txt, as they are in the virtualenv
+    """
+    record = path.join(metadata_dir, 'RECORD')
+    if path.isfile(record):
+        base_dir = path.dirname(metadata_dir)
+        with io.open(record, encoding='utf-8', newline='') as fobj:
+            relative_paths = [row[0] for row in csv.reader(fobj) if row]
+    else:
+        installed_files = path.join(metadata_dir, 'installed-files.txt')
+        if not path.isfile(installed_files):
+            return []
+        base_dir = metadata_dir
+        with io.open(installed_files, encoding='utf-8') as fobj:
+            relative_paths = [line.strip() for line in fobj if line.strip()]
+    return [path.normpath(path.join(base_dir, relative_path))
+            for relative_path in relative_paths]
+
+
+def get_owners(manifest, workers=None):
+    """
+    Which distribution installed each file in the virtualenv of `manifest`,
+    as a ``{installed path: distribution}`` dict. Metadata directories are
+    read in parallel.
+
+    :param manifest: the manifest, with its virtualenv built
+    :param workers: the number of threads to read metadata with
+    """
+    local_venv = manifest.local_virtualenv_path
+    remote_venv = manifest.remote_virtualenv_path
+    # lib64 is often a symlink to lib
+    metadata_dirs = sorted(set(
+        path.realpath(metadata_dir)
+        for pattern in ('*.dist-info', '*.egg-info')
+        for metadata_dir in glob.glob(path.join(
+            local_venv, 'lib*', 'python*', 'site-packages', pattern))
+        if path.isdir(metadata_dir)))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        owned_paths = list(executor.map(_read_owned_paths, metadata_dirs))
+
+    real_venv = path.realpath(local_venv)
+    owners = {}
+    for metadata_dir, paths in zip(metadata_dirs, owned_paths):
+        owner = _get_owner_name(metadata_dir)
+        for owned_path in paths:
+            # relocated RECORD files already point at the installed path
+            if not owned_path.startswith(remote_venv + '/'):
+                owned_path = path.join(remote_venv,
+                                       path.relpath(owned_path, real_venv))
+            owners[owned_path] = owner
+    return owners
+
+
+def _get_source_path(compiled_path):
+    """
+    The source a ``__pycache__`` file was compiled from
+    """
+    cache_dir, name = path.split(compiled_path)
+    return path.join(path.dirname(cache_dir),
+                     '{}.py'.format(name.split('.')[0]))
+
+
+class PackageAnalysis(object):
+    """
+    How many bytes and files a package installs, and where they come from
+    """
+    def __init__(self, name):
+        self.name = name
+        self.total_bytes = 0
+        self.total_files = 0
+        # {owner: [bytes, files]}
+        self.by_owner = {}
+
+    def add(self, owner, size):
+        totals = self.by_owner.setdefault(owner, [0, 0])
+        totals[0] += size
+        totals[1] += 1
+        self.total_bytes += size
+        self.total_files += 1
+
+    def top(self, count=10):
+        """
+        The `count` biggest contributors, as ``(owner, bytes, files)``
+        """
+        return sorted(((owner, size, files) for owner, (size, files)
+                       in self.by_owner.items()),
+                      key=lambda item: (-item[1], item[0]))[:count]
+
+    def format(self, count=10):
+        width = max([len(owner) for owner, _, _ in self.top(count)] + [10])
+        lines = ['{}: {} in {} files'.format(
+            self.name, format_size(self.total_bytes), self.total_files)]
+        lines.extend('  {:<{width}}  {:>9}  {:>6} files'.format(
+            owner, format_size(size), files, width=width)
+            for owner, size, files in self.top(count))
+        return '\n'.join(lines)
+
+    def check_budgets(self, max_size=None, max_files=None):
+        """
+        Raise `BudgetExceeded` if the package is over either budget
+
+        :param max_size: the most bytes it may install
+        :param max_files: the most files it may install
+        """
+        problems = []
+        if max_size is not None and self.total_bytes > max_size:
+            problems.append('{} is over its size budget: {} of {}'.format(
+                self.name, format_size(self.total_bytes),
+                format_size(max_size)))
+        if max_files is not None and self.total_files > max_files:
+            problems.append('{} is over its file budget: {} files of '
+                            '{}'.format(self.name, self.total_files,
+                                        max_files))
+        if problems:
+            biggest = ', '.join('{} ({})'.format(owner, format_size(size))
+                                for owner, size, _ in self.top(5))
+            raise BudgetExceeded('{}. The biggest contributors are '
+                                 '{}'.format('; '.join(problems), biggest))
+
+
+def analyze_package(manifest, workers=WALK_WORKERS):
+    """
+    Attribute every byte and file a package of `manifest` would install to
+    the distribution that installed it, or to the config or extra files.
+    Hardlinked files only count once, as that's how they're packaged.
+
+    :param manifest: the manifest, with its virtualenv built
+    :param workers: the number of threads to walk and read metadata with
+    """
+    entries = get_payload_entries(manifest, workers=workers)
+    owners = get_owners(manifest, workers)
+    links = get_hardlinks(entries)
+    local_venv = manifest.local_virtualenv_path.rstrip('/') + '/'
+
+    analysis = PackageAnalysis(manifest.virtualenv_name)
+    for index, entry in enumerate(entries):
+        if stat.S_ISDIR(entry.mode):
+            continue
+        if entry.config:
+            owner = CONFIG_FILES
+        elif not entry.source.startswith(local_venv):
+            owner = EXTRA_FILES
+        else:
+            owner = owners.get(entry.path)
+            parent = path.basename(path.dirname(entry.path))
+            if owner is None and parent.endswith(('.dist-info', '.egg-info')):
+                owner = _get_owner_name(parent)
+            elif owner is None and parent == '__pycache__':
+                owner = owners.get(_get_source_path(entry.path))
+            owner = owner or OTHER_FILES
+        size = entry.size
+        if links[index] is not None and links[index][0] != index:
+            size = 0
+        analysis.add(owner, size)
+    return analysis
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import collections
+import io
+import os
+import sys
+import tempfile
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from os import path
+
+from ship_it.cache import SKIPPED_DIRS
+from ship_it.manifest import Manifest
+from ship_it.timing import recorder
+
+MANIFEST_NAMES = ('manifest.yaml', 'manifest.yml')
+
+BuildResult = collections.namedtuple(
+    'BuildResult', ['manifest_path', 'success', 'error', 'log_path', 'elapsed',
+                    'timings', 'document'])
+
+
+def find_manifests(paths):
+    """
+    Expand a list of manifest files and directories into manifest paths.
+    Directories are searched recursively for ``manifest.yaml``.
+
+    :param paths: manifest files and directories to search
+    """
+    found = []
+    for manifest_path in paths:
+        manifest_path = path.abspath(path.expanduser(manifest_path))
+        if not path.isdir(manifest_path):
+            found.append(manifest_path)
+            continue
+
+        for dirpath, dirnames, filenames in os.walk(manifest_path):
+            dirnames[:] = sorted(name for name in dirnames
+                                 if name not in SKIPPED_DIRS
+                                 and not name.startswith('.'))
+            found.extend(path.join(dirpath, name) for name in MANIFEST_NAMES
+                         if name in filenames)
+
+    # keep the order we were given, but build everything once
+    return list(collections.OrderedDict.fromkeys(found))
+
+
+def expand_documents(manifest_paths):
+    """
+    ``(manifest path, document)`` for every package the manifests define.
+    Multi-document manifest files give one entry per document, other files
+    a single entry with a document of None. All the manifests are parsed here
+    once, so worker processes forked afterwards start with them cached.
+
+    :param manifest_paths: paths to manifest files
+    """
+    builds = []
+    for manifest_path in manifest_paths:
+        try:
+            count = len(Manifest.get_manifest_documents_from_path(
+                manifest_path))
+        except Exception:
+            # let the build itself fail and report why
+            count = 1
+        if count > 1:
+            builds.extend((manifest_path, index) for index in range(count))
+        else:
+            builds.append((manifest_path, None))
+    return builds
+
+
+def _describe(manifest_path, document):
+    if document is None:
+        return manifest_path
+    return '{}[{}]'.format(manifest_path, document)
+
+
+def _build_one(manifest_path, document, log_path, options):
+    """
+    Build one manifest with all of its output going to `log_path`. This runs
+    in a worker process, which goes on to build other manifests, so stdout
+    and stderr are put back afterwards.
+    """
+    # imported here so the worker picks up the same module as the caller
+    from ship_it import fpm
+
+    start = time.time()
+    # a worker process builds many manifests, only report this one's stages
+    recorder.reset()
+    with io.open(log_path, 'a', encoding='utf-8') as log:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        # subprocesses write to the file descriptors, python code to sys.*
+        real_fds = os.dup(1), os.dup(2)
+        os.dup2(log.fileno(), 1)
+        os.dup2(log.fileno(), 2)
+        real_stdout, real_stderr = sys.stdout, sys.stderr
+        sys.stdout = sys.stderr = log
+        try:
+            if document is None:
+                fpm(manifest_path, **options)
+            else:
+                fpm(manifest_path, document=document, **options)
+        except Exception as exc:
+            traceback.print_exc()
+            error = '{}: {}'.format(type(exc).__name__, exc)
+            success = False
+        else:
+            error = None
+            success = True
+        finally:
+            log.flush()
+            sys.stdout, sys.stderr = real_stdout, real_stderr
+            for fd, real_fd in zip((1, 2), real_fds):
+                os.dup2(real_fd, fd)
+                os.close(real_fd)
+
+    return BuildResult(manifest_path, success, error, log_path,
+                       time.time() - start, recorder.events, document)
+
+
+def _log_path_for(log_dir, index, manifest_path, document):
+    name = path.basename(path.dirname(manifest_path)) or 'manifest'
+    if document is not None:
+        name = '{}-{}'.format(name, document)
+    return path.join(log_dir, '{:03d}-{}.log'.format(index, name))
+
+
+def build_many(manifest_paths, jobs=None, log_dir=None, output=None,
+               **options):
+    """
+    Build several manifests in a pool of worker processes. Each build's
+    output goes to its own log file and is written to `output` in one piece
+    when the build finishes, so output from parallel builds never interleaves.
+    Every document of a multi-document manifest is built separately.
+    Returns a `BuildResult` for each package, in the order given. Stage
+    timings from the workers are added to `ship_it.timing.recorder`.
+
+    :param manifest_paths: the manifests to build
+    :param jobs: the number of builds to run at once, defaults to the number
+        of cpus
+    :param log_dir: where to keep the per-manifest logs, defaults to a new
+        temporary directory
+    :param output: where to write build output, defaults to stdout
+    :param options: keyword arguments for every `ship_it.fpm` call
+    """
+    output = output or sys.stdout
+    log_dir = log_dir or tempfile.mkdtemp(prefix='ship_it-')
+    if not path.isdir(log_dir):
+        os.makedirs(log_dir)
+
+    builds = expand_documents(manifest_paths)
+    results = {}
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {
+            executor.submit(_build_one, manifest_path, document,
+                            _log_path_for(log_dir, index, manifest_path,
+                                          document),
+                            options): (manifest_path, document)
+            for index, (manifest_path, document) in enumerate(builds)
+        }
+        for future in as_completed(futures):
+            manifest_path, document = futures[future]
+            try:
+                result = future.result()
+            except Exception as exc:
+                # the worker itself died
+                result = BuildResult(manifest_path, False,
+                                     '{}: {}'.format(type(exc).__name__, exc),
+                                     None, 0.0, [], document)
+            results[manifest_path, document] = result
+            recorder.extend(result.timings)
+            _write_result(result, output)
+
+    ordered = [results[build] for build in builds]
+    write_summary(ordered, output)
+    return ordered
+
+
+def _write_result(result, output):
+    output.write('==> {} ({}, {:.1f}s)\n'.format(
+        _describe(result.manifest_path, result.document), 'ok' if result.success else 'FAILED',
+        result.elapsed))
+    if result.log_path and path.isfile(result.log_path):
+        with io.open(result.log_path, encoding='utf-8',
+                     errors='replace') as log:
+            for line in log:
+                output.write(line)
+    output.flush()
+
+
+def write_summary(results, output):
+    """
+    Write a one line per manifest summary of `results`
+
+    :param results: `BuildResult` objects from `build_many`
+    :param output: the file object to write to
+    """
+    failed = [result for result in results if not result.success]
+    output.write('\n{} built, {} failed\n'.format(len(results) - len(failed),
+                                                    len(failed)))
+    for result in results:
+        name = _describe(result.manifest_path, result.document)
+        if result.success:
+            output.write('  ok      {}\n'.format(name))
+        else:
+            output.write('  FAILED  {} ({}) log: {}\n'.format(
+                name, result.error, result.log_path))
+    output.flush()
+
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import hashlib
+import io
+import logging
+import os
+import shutil
+import sys
+import uuid
+from os import path
+
+logger = logging.getLogger(__name__)
+
+# directories that never contribute to what ends up in a virtualenv
+SKIPPED_DIRS = frozenset(['build', 'dist', '.git', '.hg', '.svn', '.tox',
+                          '__pycache__'])
+
+_CHUNK_SIZE = 1024 * 1024
+
+# kept in each cache entry: the path the virtualenv was built at, which is
+# baked into its scripts
+PREFIX_FILE = '.ship_it-prefix'
+
+
+def hash_file(file_path, digest=None):
+    """
+    Feed the contents of `file_path` into `digest` (a new sha256 if not
+    given) and return it. Missing files hash to a fixed marker so that a
+    file appearing or disappearing still changes the result.
+
+    :param file_path: path to the file to hash
+    :param digest: an existing hashlib object to update
+    """
+    digest = digest or hashlib.sha256()
+    if not path.isfile(file_path):
+        digest.update(b'<missing>')
+        return digest
+    with open(file_path, 'rb') as fobj:
+        for chunk in iter(lambda: fobj.read(_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest
+
+
+def hash_tree(root, digest=None, skipped_dirs=SKIPPED_DIRS, skipped_paths=(),
+              skipped_suffixes=('.pyc', '.pyo')):
+    """
+    Feed the relative paths and contents of every file below `root` into
+    `digest` in a stable order, skipping build output, VCS metadata and
+    compiled bytecode.
+
+    :param root: the directory to hash
+    :param digest: an existing hashlib object to update
+    :param skipped_dirs: directory names that are never descended into
+    :param skipped_paths: absolute directory paths that are never descended
+        into
+    :param skipped_suffixes: file name endings to leave out
+    """
+    digest = digest or hashlib.sha256()
+    skipped_paths = set(skipped_paths)
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(
+            name for name in dirnames
+            if name not in skipped_dirs and not name.endswith('.egg-info')
+            and path.join(dirpath, name) not in skipped_paths)
+        for filename in sorted(filenames):
+            if filename.endswith(skipped_suffixes):
+                continue
+            file_path = path.join(dirpath, filename)
+            digest.update(path.relpath(file_path, root).encode('utf-8'))
+            digest.update(b'\0')
+            hash_file(file_path, digest)
+    return digest
+
+
+def get_cache_key(manifest, requirements_file_path, setup_py_path,
+                  python=None):
+    """
+    Compute the key for the virtualenv `manifest` would build from the given
+    requirements and setup.py.
+
+    :param manifest: the manifest being built
+    :param requirements_file_path: the path to the requirements.txt file
+    :param setup_py_path: the path to setup.py
+    :param python: the interpreter building the virtualenv, defaults to
+        `sys.executable`
+    """
+    python = python or sys.executable
+    digest = hashlib.sha256()
+    # Where the virtualenv is built, but not the private directory of an
+    # isolated build: a restored virtualenv is relocated there anyway.
+    virtualenv_path = path.join(manifest.shared_build_dir,
+                                manifest.virtualenv_name)
+    for value in (python, sys.version, virtualenv_path,
+                  manifest.contents.get('method', 'install'),
+                  str(manifest.upgrade_pip), str(manifest.upgrade_wheel)):
+        digest.update(value.encode('utf-8'))
+        digest.update(b'\0')
+
+    hash_file(requirements_file_path, digest)
+    # what the requirements resolved to, if they're locked
+    hash_file(manifest.lock_file_path, digest)
+    hash_file(setup_py_path, digest)
+
+    # The package itself ends up in the virtualenv, so its source counts too
+    skipped_paths = [manifest.cache_dir] if manifest.cache_dir else []
+    if manifest.contents.get('method') == 'copy':
+        # and what's excluded from the copy
+        for pattern in sorted(manifest.contents.get('exclude', [])):
+            digest.update(pattern.encode('utf-8'))
+            digest.update(b'\0')
+        hash_tree(manifest.local_package_path, digest,
+                  skipped_paths=skipped_paths)
+    else:
+        hash_tree(path.dirname(setup_py_path), digest,
+                  skipped_paths=skipped_paths)
+
+    return digest.hexdigest()
+
+
+class VirtualEnvCache(object):
+    """
+    Content-addressed store of finished (not yet relocated) virtualenvs
+    """
+    def __init__(self, cache_dir):
+        """
+        :param cache_dir: the directory cached virtualenvs are kept in
+        """
+        assert path.isabs(cache_dir)
+        self.cache_dir = cache_dir
+
+    def entry_path(self, key):
+        return path.join(self.cache_dir, 'virtualenvs', key)
+
+
+    def restore(self, key, virtualenv_path):
+        """
+        Replace `virtualenv_path` with the cached virtualenv for `key`.
+        Return whether there was one.
+
+        :param key: the cache key from `get_cache_key`
+        :param virtualenv_path: where the virtualenv should end up
+        """
+        entry = self.entry_path(key)
+        if not path.isdir(entry):
+            logger.info('virtualenv cache miss for %s', key)
+            return False
+
+        logger.info('virtualenv cache hit for %s', key)
+        if path.lexists(virtualenv_path):
+            shutil.rmtree(virtualenv_path)
+        shutil.copytree(entry, virtualenv_path, symlinks=True)
+
+        prefix = None
+        prefix_file = path.join(virtualenv_path, PREFIX_FILE)
+        if path.isfile(prefix_file):
+            with io.open(prefix_file, encoding='utf-8') as fobj:
+                prefix = fobj.read().strip()
+            os.unlink(prefix_file)
+        if prefix and prefix != virtualenv_path.rstrip('/'):
+            # built somewhere else, e.g. by an isolated build
+            from ship_it.relocate import relocate_virtualenv
+            relocate_virtualenv(virtualenv_path, virtualenv_path,
+                                source_prefix=prefix)
+        return True
+
+    def store(self, key, virtualenv_path):
+        """
+        Save a copy of the virtualenv at `virtualenv_path` under `key`.
+
+        :param key: the cache key from `get_cache_key`
+        :param virtualenv_path: the virtualenv to save
+        """
+        entry = self.entry_path(key)
+        if path.isdir(entry):
+            return
+
+        # copy next to the final location and rename it into place so that
+        # concurrent builds never see a partial entry
+        staging = '{}.{}.tmp'.format(entry, uuid.uuid4().hex)
+        shutil.copytree(virtualenv_path, staging, symlinks=True)
+        with io.open(path.join(staging, PREFIX_FILE), 'w',
+                     encoding='utf-8') as fobj:
+            fobj.write(virtualenv_path.rstrip('/'))
+        try:
+            os.rename(staging, entry)
+        except OSError:
+            # somebody else stored the same key first
+            shutil.rmtree(staging, ignore_errors=True)
+        else:
+            logger.info('stored virtualenv in cache as %s', key)
@@ -1,15 +1,31 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 import pipes
+import re
 from os import path
 
-# imported this way to more easily mock
-import invoke
+import six
 
-def invoke_fpm(command_line):
-    # TODO: this should one be able to support deb
-    cmd = 'fpm -f -s dir -t rpm {}'.format(command_line)
-    invoke.run(cmd)
+# fpm reports what it made as e.g. {:message=>"Created package", :path=>"..."}
+CREATED_PACKAGE_RE = re.compile(r':path=>"([^"]+)"')
+
+
+def invoke_fpm(command_line, pkg_type='rpm'):
+    # imported only when needed, to keep startup fast
+    from ship_it import runner
+
+    cmd = 'fpm -f -s dir -t {} {}'.format(pkg_type, command_line)
+    return runner.run(cmd)
+
+
+def get_created_packages(fpm_output):
+    """
+    Get the paths of the packages fpm says it created from its output.
+    """
+    if not isinstance(fpm_output, six.string_types):
+        return []
+    return [path.abspath(created)
+            for created in CREATED_PACKAGE_RE.findall(fpm_output)]
 
 
 def format_flags(flags):
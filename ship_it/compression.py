@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import collections
+import gzip
+import os
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import lzma
+except ImportError:  # python 2
+    lzma = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CODECS = ('gzip', 'xz', 'zstd')
+DEFAULT_LEVELS = {'gzip': 9, 'xz': 6, 'zstd': 19}
+LEVEL_RANGES = {'gzip': (1, 9), 'xz': (0, 9), 'zstd': (1, 22)}
+EXTENSIONS = {'gzip': '.gz', 'xz': '.xz', 'zstd': '.zst'}
+
+# Big enough that splitting costs next to nothing in compression ratio:
+# deflate only looks back 32KiB, and an xz block holds the whole dictionary
+# at the default level.
+BLOCK_SIZES = {'gzip': 1024 * 1024, 'xz': 8 * 1024 * 1024}
+
+_XZ_MAGIC = b'\xfd7zXZ\x00'
+_XZ_FOOTER_MAGIC = b'YZ'
+_XZ_CHECK_CRC32 = 1
+_XZ_FILTER_LZMA2 = 0x21
+# the dictionary size of each xz preset
+_XZ_DICT_SIZES = [2 ** 18, 2 ** 20, 2 ** 21, 2 ** 22, 2 ** 22, 2 ** 23,
+                  2 ** 23, 2 ** 24, 2 ** 25, 2 ** 26]
+
+
+def _crc32(data):
+    return struct.pack('<I', zlib.crc32(data) & 0xffffffff)
+
+
+def _xz_varint(number):
+    encoded = bytearray()
+    while number >= 0x80:
+        encoded.append((number & 0x7f) | 0x80)
+        number >>= 7
+    encoded.append(number)
+    return bytes(encoded)
+
+
+def _xz_stream_flags():
+    return struct.pack('BB', 0, _XZ_CHECK_CRC32)
+
+
+def _lzma2_dict_property(dict_size):
+    """
+    The one byte property LZMA2 stores its dictionary size as
+    """
+    for prop in range(40):
+        if (2 | (prop & 1)) << (prop // 2 + 11) >= dict_size:
+            return prop
+    return 40
+
+
+def _compress_gzip(data, level):
+    return gzip.compress(data, compresslevel=level, mtime=0), None
+
+
+def _compress_xz(data, level):
+    """
+    One xz block of raw LZMA2, with its header, padding and check. Also
+    returns the block's index record.
+    """
+    dict_size = max(4096, min(_XZ_DICT_SIZES[level], len(data)))
+    compressed = lzma.compress(data, format=lzma.FORMAT_RAW, filters=[
+        {'id': lzma.FILTER_LZMA2, 'preset': level, 'dict_size': dict_size}])
+
+    filter_flags = (_xz_varint(_XZ_FILTER_LZMA2) + _xz_varint(1) +
+                    struct.pack('B', _lzma2_dict_property(dict_size)))
+    header_size = 2 + len(filter_flags)
+    header_size += -(header_size + 4) % 4 + 4
+    # one filter, with the sizes left to the index
+    header = struct.pack('BB', header_size // 4 - 1, 0) + filter_flags
+    header += b'\0' * (header_size - 4 - len(header))
+    header += _crc32(header)
+
+    block = (header + compressed + b'\0' * (-len(compressed) % 4) +
+             _crc32(data))
+    return block, (len(header) + len(compressed) + 4, len(data))
+
+
+_COMPRESSORS = {'gzip': _compress_gzip, 'xz': _compress_xz}
+
+
+def validate_level(codec, level):
+    low, high = LEVEL_RANGES[codec]
+    if not low <= level <= high:
+        raise ValueError('{} compression levels go from {} to {}, got '
+                         '{}'.format(codec, low, high, level))
+    return level
+
+
+class BlockCompressor(object):
+    """
+    A file object that compresses whatever's written to it into `fobj`,
+    splitting it into blocks that are compressed independently on every
+    core and written out in order. The result is one ordinary stream of the
+    codec's format:
+
+    * gzip: one gzip member per block, which every gzip reader concatenates
+    * xz: one xz stream with a block per block, as ``xz -T`` writes
+    * zstd: one zstd frame, from zstd's own worker threads as ``zstd -T``
+      writes. Readers such as dpkg stop at the end of the first frame, so
+      it can't be split into frames like gzip.
+
+    At most a couple of blocks per worker are held in memory at once,
+    however much is written.
+    """
+    def __init__(self, fobj, codec='gzip', level=None, workers=None,
+                 block_size=None):
+        """
+        :param fobj: the file object to write the compressed stream to,
+            left open when this is closed
+        :param codec: gzip, xz or zstd. zstd needs the zstandard package.
+        :param level: the compression level, see `DEFAULT_LEVELS`
+        :param workers: the number of blocks to compress at once, defaults
+            to the number of cpus
+        :param block_size: how much to compress in each block, see
+            `BLOCK_SIZES`. zstd picks its own.
+        """
+        if codec not in CODECS:
+            raise ValueError('unsupported compression {!r}, expected one of '
+                             '{}'.format(codec, ', '.join(CODECS)))
+        if codec == 'xz' and lzma is None:
+            raise ValueError('xz compression needs the lzma module')
+        if codec == 'zstd' and zstandard is None:
+            raise ValueError('zstd compression needs the zstandard package')
+
+        self.fobj = fobj
+        self.codec = codec
+        self.level = validate_level(
+            codec, DEFAULT_LEVELS[codec] if level is None else level)
+        self.workers = workers or os.cpu_count() or 1
+        self.block_size = block_size or BLOCK_SIZES.get(codec)
+        self.closed = False
+        self._buffer = bytearray()
+        self._pending = collections.deque()
+        self._block_count = 0
+        self._index_records = []
+        self._executor = self._zstd_writer = None
+
+        if codec == 'zstd':
+            self._zstd_writer = zstandard.ZstdCompressor(
+                level=self.level, threads=self.workers).stream_writer(
+                    fobj, closefd=False)
+            return
+        self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        if codec == 'xz':
+            self.fobj.write(_XZ_MAGIC + _xz_stream_flags() +
+                            _crc32(_xz_stream_flags()))
+
+    def write(self, data):
+        if self._zstd_writer is not None:
+            self._zstd_writer.write(data)
+            return len(data)
+        self._buffer.extend(data)
+        while len(self._buffer) >= self.block_size:
+            block = bytes(self._buffer[:self.block_size])
+            del self._buffer[:self.block_size]
+            self._submit(block)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def _submit(self, block):
+        self._pending.append(self._executor.submit(
+            _COMPRESSORS[self.codec], block, self.level))
+        self._block_count += 1
+        while len(self._pending) > 2 * self.workers:
+            self._write_next()
+
+    def _write_next(self):
+        compressed, index_record = self._pending.popleft().result()
+        self.fobj.write(compressed)
+        if index_record is not None:
+            self._index_records.append(index_record)
+
+    def _write_xz_index(self):
+        index = b'\0' + _xz_varint(len(self._index_records))
+        for unpadded_size, uncompressed_size in self._index_records:
+            index += _xz_varint(unpadded_size) + \
+                _xz_varint(uncompressed_size)
+        index += b'\0' * (-len(index) % 4)
+        index += _crc32(index)
+        footer = struct.pack('<I', len(index) // 4 - 1) + _xz_stream_flags()
+        self.fobj.write(index + _crc32(footer) + footer + _XZ_FOOTER_MAGIC)
+
+    def close(self):
+        """
+        Compress what's left and finish the stream
+        """
+        if self.closed:
+            return
+        if self._zstd_writer is not None:
+            self._zstd_writer.close()
+            self.closed = True
+            return
+        try:
+            # an empty gzip stream still needs a member
+            if self._buffer or (not self._block_count and
+                                self.codec == 'gzip'):
+                self._submit(bytes(self._buffer))
+                del self._buffer[:]
+            while self._pending:
+                self._write_next()
+            if self.codec == 'xz':
+                self._write_xz_index()
+        finally:
+            self._executor.shutdown()
+            self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_compressor(fobj, codec='gzip', level=None, workers=None):
+    """
+    A file object that compresses whatever's written to it into `fobj`, in
+    parallel. Closing it finishes the compressed stream but leaves `fobj`
+    open. See `BlockCompressor`.
+    """
+    return BlockCompressor(fobj, codec, level, workers)
@@ -0,0 +1,379 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import contextlib
+import errno
+import io
+import json
+import logging
+import os
+import socket
+import stat
+import struct
+import sys
+import tempfile
+import threading
+import traceback
+from os import path
+
+from six.moves import socketserver
+
+from ship_it.timing import recorder
+
+logger = logging.getLogger(__name__)
+
+
+# the client's environment variables a build uses: where to find fpm and
+# friends, ship_it's and pip's settings, proxies, locale and temporary files.
+# Everything else (tokens, credentials, ...) stays with the client.
+ENVIRONMENT_NAMES = frozenset([
+    'PATH', 'HOME', 'USER', 'TMPDIR', 'LANG', 'SOURCE_DATE_EPOCH',
+    'HTTP_PROXY', 'HTTPS_PROXY', 'NO_PROXY',
+    'http_proxy', 'https_proxy', 'no_proxy',
+])
+ENVIRONMENT_PREFIXES = ('SHIP_IT_', 'PIP_', 'LC_')
+
+
+class DaemonNotRunning(Exception):
+    pass
+
+
+class InsecureSocket(RuntimeError):
+    """
+    The daemon's socket is somewhere other users can get at, or there's
+    another user on the other end of it
+    """
+
+
+def get_socket_path(socket_path=None):
+    """
+    The socket the build daemon listens on: `socket_path`, then
+    ``$SHIP_IT_SOCKET``, then ``ship_it.sock`` in a directory only this user
+    can use, see `_socket_dir`.
+    """
+    if socket_path:
+        return socket_path
+    return os.environ.get('SHIP_IT_SOCKET') or path.join(_socket_dir(),
+                                                         'ship_it.sock')
+
+
+def _socket_dir():
+    """
+    ``$XDG_RUNTIME_DIR/ship_it``, or ``ship_it-<uid>`` in the temporary
+    directory, created if needed. It has to be a directory (not a link)
+    owned by this user that no one else can use, otherwise anyone could
+    listen on the socket before the daemon does.
+    """
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir:
+        dir_path = path.join(runtime_dir, 'ship_it')
+    else:
+        dir_path = path.join(tempfile.gettempdir(),
+                             'ship_it-{}'.format(os.getuid()))
+    try:
+        os.mkdir(dir_path, 0o700)
+    except FileExistsError:
+        pass
+    info = os.lstat(dir_path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or \
+            stat.S_IMODE(info.st_mode) & 0o077:
+        raise InsecureSocket(
+            '{} has to be a directory only you can use (mode 0700), remove '
+            'it or set $SHIP_IT_SOCKET'.format(dir_path))
+    return dir_path
+
+
+def _peer_uid(sock):
+    """
+    The uid of the process on the other end of a Unix socket, None where the
+    platform can't tell
+    """
+    if not hasattr(socket, 'SO_PEERCRED'):
+        return None
+    credentials = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED,
+                                  struct.calcsize('3i'))
+    pid, uid, gid = struct.unpack('3i', credentials)
+    return uid
+
+
+def _is_forwarded(name):
+    return name in ENVIRONMENT_NAMES or name.startswith(ENVIRONMENT_PREFIXES)
+
+
+def _build_environment(environment):
+    """
+    The variables of `environment` a build uses, see `ENVIRONMENT_NAMES`
+    """
+    return dict((name, value) for name, value in environment.items()
+                if _is_forwarded(name))
+
+
+@contextlib.contextmanager
+def _environment(environment):
+    """
+    Use the client's `environment` for the variables a build uses (see
+    `ENVIRONMENT_NAMES`) until the block ends, unsetting the ones the client
+    doesn't have. The rest of `os.environ` is the daemon's own. Builds run
+    one at a time, so no other build sees it.
+    """
+    if environment is None:
+        yield
+        return
+    original = dict(os.environ)
+    for name in list(os.environ):
+        if _is_forwarded(name):
+            del os.environ[name]
+    os.environ.update(_build_environment(environment))
+    try:
+        yield
+    finally:
+        os.environ.clear()
+        os.environ.update(original)
+
+
+def _encode(message):
+    return (json.dumps(message, default=str) + '\n').encode('utf-8')
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """
+    Reads one JSON request line and writes one JSON response line
+    """
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+        try:
+            request = json.loads(line.decode('utf-8'))
+            response = self.server.handle_request_message(request)
+        except Exception as exc:
+            logger.exception('bad request %r', line)
+            response = {'ok': False,
+                        'error': '{}: {}'.format(type(exc).__name__, exc)}
+        self.wfile.write(_encode(response))
+
+
+class BuildServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    A long running build process. Everything a build caches in memory
+    (imported modules, parsed manifests, project versions, ...) stays warm
+    between builds. Requests are handled on their own threads, but builds run
+    one at a time as they share the working directory and the command
+    runner's log directory.
+    """
+    daemon_threads = True
+
+    def __init__(self, socket_path=None):
+        """
+        :param socket_path: the Unix socket to listen on, see
+            `get_socket_path`
+        """
+        self.socket_path = get_socket_path(socket_path)
+        self.build_lock = threading.Lock()
+        _remove_stale_socket(self.socket_path)
+        socketserver.UnixStreamServer.__init__(self, self.socket_path,
+                                               _RequestHandler)
+
+    def verify_request(self, request, client_address):
+        """
+        Only take requests from processes run by the daemon's own user
+        """
+        uid = _peer_uid(request)
+        if uid is not None and uid != os.getuid():
+            logger.warning('refusing a request from uid %d', uid)
+            return False
+        return True
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        if path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    def warm_up(self):
+        """
+        Import everything a build needs, so the first build doesn't pay for
+        it
+        """
+        import concurrent.futures  # noqa
+        from ship_it import (analyze, batch, cache, fingerprint, lock,  # noqa
+                             runner, slim, staging, template, version,
+                             virtualenv, wheelhouse, workspace)
+
+    def handle_request_message(self, request):
+        command = request.get('command')
+        if command == 'ping':
+            return {'ok': True, 'pid': os.getpid()}
+        if command == 'stop':
+            # shutdown() waits for serve_forever to return, so it can't be
+            # called from a request thread directly
+            threading.Thread(target=self.shutdown).start()
+            return {'ok': True}
+        if command == 'build':
+            with self.build_lock:
+                return self.build(request)
+        raise ValueError('unknown command {!r}'.format(command))
+
+    def build(self, request):
+        """
+        Build `request['manifests']` from the client's working directory and
+        with its environment (``PATH``, ``SHIP_IT_CACHE_DIR``, ...), in the
+        same way as the command line tool would. The client has to be
+        running the same interpreter, as that's what virtualenvs are made
+        with.
+        """
+        import ship_it
+        from ship_it.batch import find_manifests, build_many
+
+        python = request.get('python')
+        if python and path.realpath(python) != path.realpath(sys.executable):
+            raise ValueError(
+                'this daemon builds with {}, not {}, start one with that '
+                'interpreter instead'.format(sys.executable, python))
+
+        manifests = request['manifests']
+        options = dict(request.get('options') or {})
+        requirements = options.pop('requirements', None)
+        setup = options.pop('setup', None)
+        jobs = options.pop('jobs', None)
+        log_dir = options.pop('log_dir', None)
+
+        original_dir = os.getcwd()
+        os.chdir(request.get('cwd') or original_dir)
+        recorder.reset()
+        try:
+            with _environment(request.get('environment')):
+                if len(manifests) == 1 and not path.isdir(manifests[0]):
+                    results = [_build_in_process(ship_it.fpm, manifests[0],
+                                                 requirements, setup, options)]
+                    output = ''
+                else:
+                    if requirements or setup:
+                        raise ValueError('requirements and setup only make '
+                                         'sense for a single manifest')
+                    manifest_paths = find_manifests(manifests)
+                    if not manifest_paths:
+                        raise ValueError('no manifests found in {}'.format(
+                            ', '.join(manifests)))
+                    output_buffer = io.StringIO()
+                    results = [
+                        {'manifest': result.manifest_path,
+                         'document': result.document,
+                         'ok': result.success,
+                         'error': result.error,
+                         'log_path': result.log_path}
+                        for result in build_many(manifest_paths, jobs=jobs,
+                                                 log_dir=log_dir,
+                                                 output=output_buffer,
+                                                 **options)]
+                    output = output_buffer.getvalue()
+        finally:
+            os.chdir(original_dir)
+
+        return {'ok': all(result['ok'] for result in results),
+                'results': results,
+                'output': output,
+                'timings': list(recorder.events)}
+
+
+def _build_in_process(fpm, manifest_path, requirements, setup, options):
+    try:
+        artifacts = fpm(manifest_path, requirements, setup, **options)
+    except Exception as exc:
+        logger.exception('building %s failed', manifest_path)
+        return {'manifest': manifest_path, 'ok': False,
+                'error': '{}: {}'.format(type(exc).__name__, exc),
+                'traceback': traceback.format_exc()}
+    return {'manifest': manifest_path, 'ok': True, 'artifacts': artifacts}
+
+
+def _remove_stale_socket(socket_path):
+    """
+    Remove a socket left behind by a daemon that's gone, refusing to if
+    there's still one listening on it.
+    """
+    if not path.exists(socket_path):
+        return
+    try:
+        send_request({'command': 'ping'}, socket_path)
+    except DaemonNotRunning:
+        os.unlink(socket_path)
+    else:
+        raise RuntimeError('a ship_it daemon is already listening on '
+                           '{}'.format(socket_path))
+
+
+def serve(socket_path=None):
+    """
+    Run a build daemon until it's told to stop or interrupted
+
+    :param socket_path: the Unix socket to listen on, see `get_socket_path`
+    """
+    server = BuildServer(socket_path)
+    server.warm_up()
+    logger.info('ship_it daemon %d listening on %s', os.getpid(),
+                server.socket_path)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def send_request(message, socket_path=None):
+    """
+    Send one request to the daemon and wait for its response
+
+    :param message: the request, a JSON serializable dict with a `command`
+    :param socket_path: the daemon's socket, see `get_socket_path`
+    """
+    socket_path = get_socket_path(socket_path)
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            client.connect(socket_path)
+        except (IOError, OSError) as exc:
+            if exc.errno in (errno.ENOENT, errno.ECONNREFUSED):
+                raise DaemonNotRunning(
+                    'no ship_it daemon is listening on {}, start one with '
+                    '`ship_it serve`'.format(socket_path))
+            raise
+        uid = _peer_uid(client)
+        if uid is not None and uid != os.getuid():
+            raise InsecureSocket('{} belongs to uid {}, not to you'.format(
+                socket_path, uid))
+        client.sendall(_encode(message))
+        with client.makefile('rb') as response:
+            line = response.readline()
+    finally:
+        client.close()
+
+    if not line:
+        raise DaemonNotRunning('the ship_it daemon on {} closed the '
+                               'connection'.format(socket_path))
+    return json.loads(line.decode('utf-8'))
+
+
+def build(manifests, socket_path=None, **options):
+    """
+    Have the daemon build `manifests`. Relative paths are resolved here, and
+    the build runs in this process's working directory and with the parts of
+    its environment a build uses, see `ENVIRONMENT_NAMES`.
+
+    :param manifests: manifest files and directories, as for the command line
+    :param socket_path: the daemon's socket, see `get_socket_path`
+    :param options: the command line options, e.g. `cache_dir`
+    """
+    return send_request({
+        'command': 'build',
+        'manifests': [path.abspath(path.expanduser(manifest))
+                      for manifest in manifests],
+        'options': dict((key, value) for key, value in options.items()
+                        if value not in (None, False)),
+        'cwd': os.getcwd(),
+        'environment': _build_environment(os.environ),
+        'python': sys.executable,
+    }, socket_path)
+
+
+def stop(socket_path=None):
+    return send_request({'command': 'stop'}, socket_path)
@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import io
+import logging
+import stat
+import tarfile
+from os import path
+
+from ship_it.compression import EXTENSIONS, open_compressor
+from ship_it.payload import get_hardlinks, hash_entries
+
+logger = logging.getLogger(__name__)
+
+AR_MAGIC = b'!<arch>\n'
+DEBIAN_BINARY = b'2.0\n'
+
+# what debian calls the architectures `platform.machine` names
+ARCHITECTURES = {
+    'x86_64': 'amd64',
+    'aarch64': 'arm64',
+    'i386': 'i386',
+    'i686': 'i386',
+    'noarch': 'all',
+}
+
+# fpm's dependency operators, as debian writes them
+DEPENDENCY_OPERATORS = {
+    '<': '<<',
+    '<=': '<=',
+    '=': '=',
+    '==': '=',
+    '>=': '>=',
+    '>': '>>',
+}
+
+
+def get_architecture(spec):
+    return ARCHITECTURES.get(spec.architecture, spec.architecture)
+
+
+def get_package_name(spec):
+    """
+    Debian package names can't have capitals or underscores, fpm replaces
+    them in the same way
+    """
+    return spec.name.lower().replace('_', '-')
+
+
+def get_version(spec):
+    version = spec.version
+    if spec.iteration is not None:
+        version = '{}-{}'.format(version, spec.iteration)
+    if spec.epoch is not None:
+        version = '{}:{}'.format(spec.epoch, version)
+    return version
+
+
+def format_dependency(dependency):
+    """
+    Turn an fpm style dependency, e.g. ``'python >= 2.7'``, into a debian
+    one, e.g. ``'python (>= 2.7)'``
+    """
+    parts = dependency.split()
+    if len(parts) == 1:
+        return parts[0]
+    if len(parts) != 3 or parts[1] not in DEPENDENCY_OPERATORS:
+        raise ValueError('unsupported dependency {!r}, expected "name" or '
+                         '"name <op> version"'.format(dependency))
+    return '{} ({} {})'.format(parts[0], DEPENDENCY_OPERATORS[parts[1]],
+                               parts[2])
+
+
+def get_control(spec, entries):
+    """
+    The contents of the control file
+    """
+    installed_size = sum(entry.size for entry in entries)
+    fields = [
+        ('Package', get_package_name(spec)),
+        ('Version', get_version(spec)),
+        ('License', spec.license),
+        ('Vendor', spec.vendor),
+        ('Architecture', get_architecture(spec)),
+        ('Maintainer', spec.maintainer),
+        ('Installed-Size', str((installed_size + 1023) // 1024)),
+    ]
+    if spec.depends:
+        fields.append(('Depends', ', '.join(format_dependency(dependency)
+                                            for dependency in spec.depends)))
+    fields.extend([('Section', 'default'), ('Priority', 'extra'),
+                   ('Homepage', spec.url)])
+
+    lines = ['{}: {}'.format(name, value) for name, value in fields]
+    description = spec.description.splitlines() or ['']
+    lines.append('Description: {}'.format(description[0]))
+    lines.extend(' {}'.format(line) if line.strip() else ' .'
+                 for line in description[1:])
+    return '\n'.join(lines) + '\n'
+
+
+def _script(script):
+    if not script.startswith('#!'):
+        script = '#!/bin/sh\n' + script
+    return script
+
+
+def _directory_info(name, mtime):
+    info = tarfile.TarInfo(name)
+    info.type = tarfile.DIRTYPE
+    info.mode = 0o755
+    info.mtime = mtime
+    info.uname = info.gname = 'root'
+    return info
+
+
+def _add_bytes(tar, name, data, mode, mtime):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mode = mode
+    info.mtime = mtime
+    info.uname = info.gname = 'root'
+    tar.addfile(info, io.BytesIO(data))
+
+
+def build_control_tar(spec, entries, md5sums, compression='gzip',
+                      level=None):
+    """
+    The compressed control archive: the control file, the md5sums of every
+    file, the conffiles and the maintainer scripts.
+    """
+    members = [('control', get_control(spec, entries), 0o644)]
+    members.append(('md5sums', ''.join(
+        '{}  {}\n'.format(digest, entry.path.lstrip('/'))
+        for entry, digest in zip(entries, md5sums) if digest), 0o644))
+    conffiles = [entry.path for entry in entries
+                 if entry.config and stat.S_ISREG(entry.mode)]
+    if conffiles:
+        members.append(('conffiles', ''.join(
+            '{}\n'.format(conffile) for conffile in conffiles), 0o644))
+    for name, script in (('preinst', spec.before_install),
+                         ('postinst', spec.after_install)):
+        if script is not None:
+            members.append((name, _script(script), 0o755))
+
+    output = io.BytesIO()
+    with open_compressor(output, compression, level, workers=1) as compressor:
+        with tarfile.open(fileobj=compressor, mode='w|',
+                          format=tarfile.GNU_FORMAT) as tar:
+            tar.addfile(_directory_info('./', spec.build_time))
+            for name, content, mode in members:
+                _add_bytes(tar, './{}'.format(name), content.encode('utf-8'),
+                           mode, spec.build_time)
+    return output.getvalue()
+
+
+def _get_parent_directories(entries):
+    """
+    Directories above the entries that aren't entries themselves, which
+    dpkg needs in the archive all the same
+    """
+    entry_paths = set(entry.path for entry in entries)
+    parents = set()
+    for entry in entries:
+        parent = path.dirname(entry.path)
+        while parent != '/' and parent not in entry_paths:
+            parents.add(parent)
+            parent = path.dirname(parent)
+    return sorted(parents)
+
+
+def write_data_tar(fobj, spec, entries):
+    """
+    Stream the tar of every entry into `fobj`, reading files straight from
+    where they are. Hardlinked files are only stored once.
+    """
+    # the later links of a hardlinked file point at its first one, which
+    # is the one with the data
+    link_names = {}
+    for index, group in enumerate(get_hardlinks(entries)):
+        if group is not None and index != group[0]:
+            link_names[entries[index].path] = '.{}'.format(
+                entries[group[0]].path)
+
+    with tarfile.open(fileobj=fobj, mode='w|',
+                      format=tarfile.GNU_FORMAT) as tar:
+        items = [(parent, _directory_info('.{}/'.format(parent),
+                                          spec.build_time))
+                 for parent in _get_parent_directories(entries)]
+        items.extend((entry.path, entry) for entry in entries)
+        # parents come before their children
+        items.sort(key=lambda item: item[0])
+
+        tar.addfile(_directory_info('./', spec.build_time))
+        for item_path, item in items:
+            if isinstance(item, tarfile.TarInfo):
+                tar.addfile(item)
+                continue
+            info = tarfile.TarInfo('.{}'.format(item_path))
+            info.mode = stat.S_IMODE(item.mode)
+            info.mtime = item.mtime
+            info.uname = spec.user
+            info.gname = spec.group
+            if item.link_target is not None:
+                info.type = tarfile.SYMTYPE
+                info.linkname = item.link_target
+                tar.addfile(info)
+            elif stat.S_ISDIR(item.mode):
+                info.type = tarfile.DIRTYPE
+                tar.addfile(info)
+            elif item_path in link_names:
+                info.type = tarfile.LNKTYPE
+                info.linkname = link_names[item_path]
+                tar.addfile(info)
+            else:
+                info.size = item.size
+                with open(item.source, 'rb') as source:
+                    tar.addfile(info, source)
+
+
+def _ar_header(name, size, mtime, mode=0o100644):
+    header = '{:<16}{:<12}{:<6}{:<6}{:<8o}{:<10}`\n'.format(
+        name, mtime, 0, 0, mode, size)
+    return header.encode('ascii')
+
+
+def write_deb(output_path, spec, entries, compression='gzip', level=None,
+              workers=None):
+    """
+    Write a deb of `entries` to `output_path`: an ar archive of
+    ``debian-binary``, ``control.tar`` and ``data.tar``, with ``data.tar``
+    streamed from the files themselves rather than from a copy of them.
+
+    The control archive lists every file's md5sum, so files are hashed (in
+    parallel) before the data archive is written. The data archive's size
+    isn't known until then either, so its ar header is filled in at the end.
+
+    :param output_path: the deb to write
+    :param spec: the package's `ship_it.native.PackageSpec`
+    :param entries: the `ship_it.payload.PayloadEntry` tuples to package,
+        sorted by path
+    :param compression: how to compress both archives, see
+        `ship_it.compression.open_compressor`
+    :param level: the compression level
+    :param workers: the number of threads to hash and compress with
+    """
+    md5sums = hash_entries(entries, workers, algorithm='md5')
+    control = build_control_tar(spec, entries, md5sums, compression, level)
+    extension = EXTENSIONS[compression]
+
+    with open(output_path, 'wb') as fobj:
+        fobj.write(AR_MAGIC)
+        for name, data in (('debian-binary', DEBIAN_BINARY),
+                           ('control.tar{}'.format(extension), control)):
+            fobj.write(_ar_header(name, len(data), spec.build_time))
+            fobj.write(data)
+            fobj.write(b'\n' * (len(data) % 2))
+
+        data_name = 'data.tar{}'.format(extension)
+        header_offset = fobj.tell()
+        fobj.write(_ar_header(data_name, 0, spec.build_time))
+        data_offset = fobj.tell()
+        with open_compressor(fobj, compression, level,
+                             workers) as compressor:
+            write_data_tar(compressor, spec, entries)
+        data_size = fobj.tell() - data_offset
+        fobj.write(b'\n' * (data_size % 2))
+
+        fobj.seek(header_offset)
+        fobj.write(_ar_header(data_name, data_size, spec.build_time))
+
+    logger.debug('wrote %s: %d files, %d bytes of data', output_path,
+                 len(entries), data_size)
+    return output_path
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import hashlib
+import io
+import json
+import logging
+import os
+import sys
+import tempfile
+from os import path
+
+from ship_it.cache import hash_file, hash_tree
+
+logger = logging.getLogger(__name__)
+
+PACKAGE_SUFFIXES = ('.rpm', '.deb')
+
+
+def _update(digest, value):
+    digest.update(json.dumps(value, sort_keys=True, default=str)
+                  .encode('utf-8'))
+    digest.update(b'\0')
+
+
+def get_build_fingerprint(manifest, command_lines, requirements_file_path,
+                          setup_py_path, python=None):
+    """
+    Fingerprint everything that goes into a build: the manifest, the fpm
+    command lines, every local file they refer to, the lock file, the
+    package source and the interpreter.
+
+    :param manifest: the manifest being built
+    :param command_lines: ``(command line, package type)`` for every target
+    :param requirements_file_path: the path to the requirements.txt file
+    :param setup_py_path: the path to setup.py
+    :param python: the interpreter building the virtualenv, defaults to
+        `sys.executable`
+    """
+    digest = hashlib.sha256()
+    _update(digest, [python or sys.executable, sys.version])
+    _update(digest, manifest.contents)
+    # an isolated build's private directory is different every time
+    _update(digest, [(command_line.replace(manifest.build_dir, '{build_dir}'),
+                      target) for command_line, target in command_lines])
+
+    local_files = [local for local, _ in (manifest.get_config_file_mappings() +
+                                          manifest.get_extra_file_mappings())]
+    local_files.extend(script for flag, script in manifest.get_single_flags()
+                       if flag in ('before-install', 'after-install'))
+    local_files.extend([requirements_file_path, manifest.lock_file_path,
+                        setup_py_path])
+    for local_file in local_files:
+        _update(digest, local_file)
+        if path.isdir(local_file):
+            hash_tree(local_file, digest)
+        else:
+            hash_file(local_file, digest)
+
+    # fpm writes packages to the working directory, which is usually the
+    # source tree, so they mustn't count
+    skipped_paths = [manifest.cache_dir] if manifest.cache_dir else []
+    source = (manifest.local_package_path
+              if manifest.contents.get('method') == 'copy'
+              else path.dirname(setup_py_path))
+    hash_tree(source, digest, skipped_paths=skipped_paths,
+              skipped_suffixes=PACKAGE_SUFFIXES + ('.pyc', '.pyo'))
+
+    return digest.hexdigest()
+
+
+def _stat(file_path):
+    stat = os.stat(file_path)
+    return [stat.st_size, int(stat.st_mtime)]
+
+
+class BuildRecord(object):
+    """
+    Remembers the fingerprint of the last successful build of a manifest and
+    the packages it made, so an unchanged build can be skipped.
+    """
+    def __init__(self, manifest):
+        """
+        :param manifest: the manifest being built
+        """
+        self.path = path.join(manifest.shared_build_dir,
+                              '.{}.build.json'.format(manifest.virtualenv_name))
+
+    def load(self):
+        if not path.isfile(self.path):
+            return {}
+        try:
+            with io.open(self.path, encoding='utf-8') as fobj:
+                return json.load(fobj)
+        except ValueError:
+            logger.debug('ignoring unreadable build record %s', self.path,
+                         exc_info=True)
+            return {}
+
+    def is_up_to_date(self, fingerprint):
+        """
+        Was the last build made from `fingerprint`, with every package it
+        made still there and unchanged?
+
+        :param fingerprint: from `get_build_fingerprint`
+        """
+        record = self.load()
+        if record.get('fingerprint') != fingerprint or not record.get(
+                'artifacts'):
+            return False
+        for artifact, stat in record['artifacts'].items():
+            if not path.isfile(artifact) or _stat(artifact) != stat:
+                return False
+        return True
+
+    def save(self, fingerprint, artifacts):
+        """
+        :param fingerprint: from `get_build_fingerprint`
+        :param artifacts: paths to the packages the build made
+        """
+        os.makedirs(path.dirname(self.path), exist_ok=True)
+        record = {
+            'fingerprint': fingerprint,
+            'artifacts': dict((path.abspath(artifact), _stat(artifact))
+                              for artifact in artifacts),
+        }
+        # a temporary file of its own, as isolated builds of the same
+        # manifest can save at the same time
+        fd, temp_path = tempfile.mkstemp(dir=path.dirname(self.path),
+                                         suffix='.tmp')
+        try:
+            with io.open(fd, 'w', encoding='utf-8') as fobj:
+                fobj.write(json.dumps(record, indent=2, sort_keys=True))
+            os.rename(temp_path, self.path)
+        except Exception:
+            os.unlink(temp_path)
+            raise
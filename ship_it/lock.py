@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import io
+import json
+import logging
+import os
+import re
+import sys
+import tempfile
+from os import path
+from pipes import quote
+
+from ship_it import runner
+from ship_it.cache import hash_file
+from ship_it.requirements import read_requirement_lines, split_local
+
+logger = logging.getLogger(__name__)
+
+HEADER_RE = re.compile(r'^# generated by ship_it lock from (.+) '
+                       r'\(sha256 ([0-9a-f]{64})\)')
+HEADER = ('# generated by ship_it lock from {} (sha256 {}), run it again '
+          'after changing that file\n')
+
+
+class StaleLockFile(Exception):
+    """
+    A lock file was made from a different requirements file than the one
+    being installed, or from an older version of it
+    """
+
+
+def _get_lock_line(item):
+    """
+    The lock file line for one distribution in pip's installation report:
+    ``name==version`` with its hash for anything downloaded, the exact
+    commit for version control checkouts and None for local directories,
+    which the lock file lists as they were in the requirements file.
+    """
+    metadata = item['metadata']
+    download_info = item['download_info']
+    if 'dir_info' in download_info:
+        return None
+    if 'vcs_info' in download_info:
+        vcs_info = download_info['vcs_info']
+        return '{} @ {}+{}@{}'.format(metadata['name'], vcs_info['vcs'],
+                                      download_info['url'],
+                                      vcs_info['commit_id'])
+
+    line = '{}=={}'.format(metadata['name'], metadata['version'])
+    archive_info = download_info.get('archive_info', {})
+    hashes = archive_info.get('hashes')
+    if hashes is None and archive_info.get('hash'):
+        # pip before 23 only reports the one hash
+        hashes = dict([archive_info['hash'].split('=', 1)])
+    if hashes and 'sha256' in hashes:
+        line += ' \\\n    --hash=sha256:{}'.format(hashes['sha256'])
+    else:
+        logger.warning('pip reported no sha256 for %s, it will be locked '
+                       'without one', line)
+    return line
+
+
+def get_lock_lines(report, requirements_file_path):
+    """
+    Turn pip's installation report into the lines of a lock file: every
+    distribution pinned, sorted by name, followed by the local requirements
+    (``.``, paths, ``-e``) of the requirements file, which can't be pinned.
+
+    :param report: the parsed ``pip install --report`` output
+    :param requirements_file_path: the requirements file that was resolved
+    """
+    pinned = []
+    for item in sorted(report['install'],
+                       key=lambda item: item['metadata']['name'].lower()):
+        line = _get_lock_line(item)
+        if line is not None:
+            pinned.append(line)
+    _, local = split_local(read_requirement_lines(requirements_file_path),
+                           path.dirname(requirements_file_path))
+    return pinned + local
+
+
+def resolve(requirements_file_path, python=None, extra_args=(),
+            projects=()):
+    """
+    Have pip resolve a requirements file without installing anything, and
+    return its installation report. Needs pip 22.2 or newer.
+
+    :param requirements_file_path: the path to the requirements.txt file
+    :param python: the interpreter to resolve for, defaults to
+        `sys.executable`
+    :param extra_args: more arguments for pip, e.g. ``--find-links``
+    :param projects: project directories to resolve the dependencies of
+        too, e.g. the one holding setup.py
+    """
+    fd, report_path = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    try:
+        runner.run('{} -m pip install --dry-run --ignore-installed --quiet '
+                   '--report {} {} -r {}'.format(
+                       quote(python or sys.executable), quote(report_path),
+                       ' '.join(extra_args), quote(requirements_file_path)) +
+                   ''.join(' {}'.format(quote(project))
+                           for project in projects))
+        with io.open(report_path, encoding='utf-8') as fobj:
+            return json.load(fobj)
+    finally:
+        os.remove(report_path)
+
+
+def write_lock_file(requirements_file_path, lock_file_path, python=None,
+                    extra_args=(), projects=()):
+    """
+    Resolve `requirements_file_path` once and write every distribution it
+    needs, pinned and with its hash, to `lock_file_path`. The lock file is
+    an ordinary requirements file that installs with ``--no-deps`` (and
+    ``--require-hashes``) without pip resolving anything. It records the
+    path of the requirements file relative to itself.
+
+    :param requirements_file_path: the path to the requirements.txt file
+    :param lock_file_path: the lock file to write
+    :param python: the interpreter to resolve for, defaults to
+        `sys.executable`
+    :param extra_args: more arguments for pip, e.g. ``--find-links``
+    :param projects: project directories whose dependencies are pinned
+        too, though not the projects themselves
+    """
+    report = resolve(requirements_file_path, python, extra_args, projects)
+    lines = get_lock_lines(report, requirements_file_path)
+    digest = hash_file(requirements_file_path).hexdigest()
+
+    temp_path = '{}.tmp'.format(lock_file_path)
+    with io.open(temp_path, 'w', encoding='utf-8') as fobj:
+        fobj.write(HEADER.format(
+            path.relpath(requirements_file_path,
+                         path.dirname(path.abspath(lock_file_path))),
+            digest))
+        fobj.write(''.join('{}\n'.format(line) for line in lines))
+    os.rename(temp_path, lock_file_path)
+    logger.info('locked %d requirements in %s', len(lines), lock_file_path)
+    return lock_file_path
+
+
+def check_lock_file(lock_file_path, requirements_file_path):
+    """
+    Raise `StaleLockFile` unless the lock file was made from the current
+    contents of `requirements_file_path`.
+
+    :param lock_file_path: a lock file from `write_lock_file`
+    :param requirements_file_path: the requirements it should have been
+        made from
+    """
+    with io.open(lock_file_path, encoding='utf-8') as fobj:
+        match = HEADER_RE.match(fobj.readline())
+    if match is not None:
+        locked_path = path.normpath(path.join(
+            path.dirname(path.abspath(lock_file_path)), match.group(1)))
+        if locked_path != path.normpath(path.abspath(requirements_file_path)):
+            raise StaleLockFile(
+                '{} was made from {}, not {}, run `ship_it lock --requirements '
+                '{}` to lock that instead'.format(
+                    lock_file_path, locked_path, requirements_file_path,
+                    requirements_file_path))
+    if match is None or match.group(2) != hash_file(
+            requirements_file_path).hexdigest():
+        raise StaleLockFile(
+            '{} is out of date with {}, run `ship_it lock` again'.format(
+                lock_file_path, requirements_file_path))
@@ -1,16 +1,92 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+import copy
+import os
+import re
 from os import path
 
 import pipes
 import six
 import time
-import yaml
 
 
-def get_manifest_from_path(manifest_path):
-    return Manifest(manifest_path)
+SUPPORTED_PKG_TYPES = ('rpm', 'deb')
+PYC_INVALIDATION_MODES = ('checked-hash', 'unchecked-hash', 'timestamp')
+# what builds the packages, fpm or ship_it.native
+BACKENDS = ('fpm', 'native')
+# payload compression codecs, and what fpm calls them for each package type
+COMPRESSION_CODECS = ('gzip', 'xz', 'zstd')
+FPM_COMPRESSION = {
+    # xzmt has rpmbuild compress with every core
+    'rpm': {'gzip': 'gzip', 'xz': 'xzmt', 'zstd': 'zstd'},
+    'deb': {'gzip': 'gz', 'xz': 'xz', 'zstd': 'zst'},
+}
+
+# what ship_it.slim can prune from a virtualenv, and what ``slim: true``
+# prunes
+SLIM_PROFILES = ('tests', 'docs', 'headers', 'metadata')
+DEFAULT_SLIM_PROFILES = ('tests', 'docs', 'headers')
+
+# the suffixes `max_size` can have, e.g. 300M or 1.5GiB
+SIZE_UNITS = {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
+SIZE_RE = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([kmg]?)(?:i?b)?\s*$', re.I)
+
+# what `ship_it lock` writes next to the manifest, see ship_it.lock
+LOCK_FILE_NAME = 'requirements.lock'
+
+# isolated builds each get their own directory in here, see ship_it.workspace
+WORK_DIR_NAME = '.work'
+
+# {manifest path: ((mtime, size), [parsed documents])}
+_documents_cache = {}
+
+
+def get_manifest_from_path(manifest_path, document=None):
+    return Manifest(manifest_path, document=document)
+
+
+def get_manifests_from_path(manifest_path):
+    """
+    A `Manifest` for every document in a (possibly multi-document) manifest
+    file
+    """
+    documents = Manifest.get_manifest_documents_from_path(
+        Manifest.normalize_path(manifest_path))
+    return [Manifest(manifest_path, document=index)
+            for index in range(max(len(documents), 1))]
+
+
+def _get_file_stamp(manifest_path):
+    try:
+        stat = os.stat(manifest_path)
+    except (TypeError, OSError):
+        return None
+    return getattr(stat, 'st_mtime_ns', stat.st_mtime), stat.st_size
+
+
+def _load_documents(manifest_path):
+    """
+    Parse every document in a manifest file, reusing the last parse if the
+    file hasn't changed since. The result is shared, so don't modify it.
+    """
+    stamp = _get_file_stamp(manifest_path)
+    cached_stamp, documents = _documents_cache.get(manifest_path, (None, None))
+    if stamp is not None and cached_stamp == stamp:
+        return documents
+
+    # imported here as it's slow to import and not needed until now
+    import yaml
+
+    # LibYAML's loader is much faster, and gives the same all-strings result
+    loader = getattr(yaml, 'CBaseLoader', yaml.BaseLoader)
+    with Manifest.get_manifest_fobj(manifest_path) as fobj:
+        documents = [document for document in
+                     yaml.load_all(fobj, Loader=loader)
+                     if document]
+    if stamp is not None:
+        _documents_cache[manifest_path] = (stamp, documents)
+    return documents
 
 
 class Manifest(object):
@@ -19,16 +95,24 @@ class Manifest(object):
     configuration
     """
     def __init__(self, manifest_path=None, manifest_contents=None,
-                 pkg_type='rpm', pkg_location='/opt'):
-        # we don't currently support other packages, but deb is planned
-        assert pkg_type in ('rpm',)
+                 pkg_type='rpm', pkg_location='/opt', document=None):
+        """
+        :param document: which document of a multi-document manifest file
+            this is, defaults to the first
+        """
+        assert pkg_type in SUPPORTED_PKG_TYPES
         assert path.isabs(pkg_location)
         self.path = self.normalize_path(manifest_path)
         self.pkg_type = pkg_type
         self.pkg_location = pkg_location
+        self.document = document
+        self.from_file = not manifest_contents
+        # set for an isolated build, see `build_dir`
+        self.build_id = None
 
         if not manifest_contents:
-            self.contents = self.get_manifest_content_from_path(self.path)
+            self.contents = self.get_manifest_content_from_path(
+                self.path, document or 0)
         else:
             self.contents = manifest_contents
 
@@ -41,47 +125,107 @@ class Manifest(object):
         return open(manifest_path, 'rb')
 
     @staticmethod
-    def get_manifest_content_from_path(manifest_path):
-        fobj = Manifest.get_manifest_fobj(manifest_path)
-        return yaml.load(fobj, Loader=yaml.BaseLoader)
+    def get_manifest_documents_from_path(manifest_path):
+        """
+        Every document in the manifest file, parsed with every value as a
+        string. Parses are cached by the file's path, mtime and size.
+        """
+        return copy.deepcopy(_load_documents(manifest_path))
+
+    @staticmethod
+    def get_manifest_content_from_path(manifest_path, document=0):
+        documents = _load_documents(manifest_path)
+        if not documents and not document:
+            return None
+        if document >= len(documents):
+            raise ValueError('{} has {} document(s), there is no document '
+                             '{}'.format(manifest_path, len(documents),
+                                         document))
+        return copy.deepcopy(documents[document])
+
+    @property
+    def document_count(self):
+        """
+        The number of documents in the file this manifest came from
+        """
+        if not self.from_file:
+            return 1
+        return max(len(_load_documents(self.path)), 1)
 
-    def get_args_and_flags(self):
-        args = [pipes.quote('{}={}'.format(self.local_virtualenv_path,
-                                           self.remote_package_path))]
-        flags = self.get_single_flags()
+    def get_args_and_flags(self, pkg_type=None, staging_root=None):
+        """
+        Get the fpm arguments and flags for building this manifest as
+        `pkg_type`, which defaults to the manifest's own package type.
+
+        If `staging_root` is given, it's expected to already hold every file
+        laid out as it will be installed (see `ship_it.staging`), and fpm is
+        pointed at it instead of at each file separately.
+        """
+        pkg_type = pkg_type or self.pkg_type
+        assert pkg_type in SUPPORTED_PKG_TYPES
+        if staging_root is not None:
+            args = ['.']
+            flags = [('chdir', staging_root)]
+        else:
+            args = [pipes.quote('{}={}'.format(self.local_virtualenv_path,
+                                               self.remote_package_path))]
+            flags = []
+        flags.extend(self.get_single_flags())
 
 
         # add the package user and group. Use what's specified
         # if present, or default to virtualenv_name.
-        flags.extend([('{}-{}'.format(self.pkg_type, name_type),
+        flags.extend([('{}-{}'.format(pkg_type, name_type),
                        self.contents.get(name_type, self.virtualenv_name))
                       for name_type in ('user', 'group')])
-        flags.append(('directories', self.remote_virtualenv_path))
+        if pkg_type == 'rpm':
+            # fpm only knows how to mark directories as owned for rpms
+            flags.append(('directories', self.remote_virtualenv_path))
+
+        flags.extend(self.get_compression_flags(pkg_type))
 
         cfg_args, cfg_flags = self.get_config_args_and_flags()
-        args.extend(cfg_args)
         flags.extend(cfg_flags)
-        extra_args = self.get_extra_files_args()
-        args.extend(extra_args)
+        if staging_root is None:
+            args.extend(cfg_args)
+            args.extend(self.get_extra_files_args())
         flags.extend(self.get_dependency_flags())
         flags.extend(self.get_exclude_flags())
 
         return args, flags
 
+    def _get_file_mappings(self, setting):
+        mappings = []
+        for remote_path, local_path in (self.contents.get(setting) or {}).items():
+            remote_file = path.normpath(path.join(self.remote_virtualenv_path,
+                                                  remote_path))
+            assert path.isabs(remote_file)
+            local_file = path.normpath(path.join(self.manifest_dir, local_path))
+            # We'll rely on fpm to error if it's a nonexistent path.
+            assert path.isabs(local_file)
+            mappings.append((local_file, remote_file))
+        return mappings
+
+    def get_config_file_mappings(self):
+        """
+        Get ``(local path, remote path)`` for every config file, with remote
+        paths relative to the virtualenv made absolute.
+        """
+        return self._get_file_mappings('config_files')
+
+    def get_extra_file_mappings(self):
+        """
+        Get ``(local path, remote path)`` for every extra file, with remote
+        paths relative to the virtualenv made absolute.
+        """
+        return self._get_file_mappings('extra_files')
+
     def get_config_args_and_flags(self):
         args = []
         flags = []
-        if not self.contents.get('config_files'):
-            return args, flags
 
         # config files need to be added to both flags and args
-        for remote_path, local_path in self.contents['config_files'].items():
-            remote_cfg = path.normpath(path.join(self.remote_virtualenv_path,
-                                                 remote_path))
-            assert path.isabs(remote_cfg)
-            local_cfg = path.normpath(path.join(self.manifest_dir, local_path))
-            # We'll rely on fpm to error if it's a nonexistent path.
-            assert path.isabs(local_cfg)
+        for local_cfg, remote_cfg in self.get_config_file_mappings():
             # The leading / needs to be omitted here
             flags.append(('config-files', remote_cfg[1:]))
             args.append('{}={}/'.format(pipes.quote(local_cfg),
@@ -90,20 +234,9 @@ class Manifest(object):
         return args, flags
 
     def get_extra_files_args(self):
-        args = []
-        if not self.contents.get('extra_files'):
-            return args
-
-        for remote_path, local_path in self.contents['extra_files'].items():
-            remote_file = path.normpath(path.join(self.remote_virtualenv_path,
-                                                  remote_path))
-            assert path.isabs(remote_file)
-            local_file = path.normpath(path.join(self.manifest_dir, local_path))
-            # We'll rely on fpm to error if it's a nonexistent path.
-            assert path.isabs(local_file)
-            args.append('{}={}/'.format(pipes.quote(local_file),
-                                        pipes.quote(path.dirname(remote_file))))
-        return args
+        return ['{}={}/'.format(pipes.quote(local_file),
+                                pipes.quote(path.dirname(remote_file)))
+                for local_file, remote_file in self.get_extra_file_mappings()]
 
 
     def get_single_flags(self):
@@ -133,6 +266,19 @@ class Manifest(object):
         """
         return bool(self.contents.get(name, '').lower() in ['true', 'yes', 'on', 'y'])
 
+    def get_compression_flags(self, pkg_type):
+        """
+        fpm's flags for the payload compression, if the manifest sets it
+        """
+        flags = []
+        if self.compression is not None:
+            flags.append(('{}-compression'.format(pkg_type),
+                          FPM_COMPRESSION[pkg_type][self.compression]))
+        if self.compression_level is not None:
+            flags.append(('{}-compression-level'.format(pkg_type),
+                          self.compression_level))
+        return flags
+
     def get_dependency_flags(self):
         """
         get all the flags related to dependencies
@@ -149,6 +295,38 @@ class Manifest(object):
             excludes |= set([('exclude', excl) for excl in ['*.py[co]', '__pycache__']])
         return excludes
 
+    @property
+    def precompile(self):
+        """
+        Whether to compile the virtualenv to bytecode before packaging it.
+        That's pointless if compiled files are then excluded.
+        """
+        precompile = self.get_bool_value('precompile')
+        if precompile and self.get_bool_value('exclude_compiled'):
+            raise ValueError('precompile and exclude_compiled are mutually '
+                             'exclusive')
+        return precompile
+
+    @property
+    def precompile_optimize(self):
+        levels = self.contents.get('precompile_optimize', ['0'])
+        if not isinstance(levels, list):
+            levels = [levels]
+        levels = [int(level) for level in levels]
+        if not levels or any(level not in (0, 1, 2) for level in levels):
+            raise ValueError('precompile_optimize must be a list of 0, 1 '
+                             'and/or 2, got {!r}'.format(levels))
+        return levels
+
+    @property
+    def precompile_invalidation(self):
+        mode = self.contents.get('precompile_invalidation', 'checked-hash')
+        if mode not in PYC_INVALIDATION_MODES:
+            raise ValueError('precompile_invalidation must be one of {}, got '
+                             '{!r}'.format(', '.join(PYC_INVALIDATION_MODES),
+                                           mode))
+        return mode
+
     @property
     def manifest_dir(self):
         return path.dirname(self.path)
@@ -157,6 +335,121 @@ class Manifest(object):
     def name(self):
         return self.contents['name']
 
+    @property
+    def targets(self):
+        """
+        The package types to build, from the manifest's `targets` list.
+        Defaults to just the manifest's package type.
+        """
+        targets = self.contents.get('targets') or [self.pkg_type]
+        if isinstance(targets, six.string_types):
+            targets = [targets]
+        for target in targets:
+            if target not in SUPPORTED_PKG_TYPES:
+                raise ValueError('unsupported target {!r}, expected one of '
+                                 '{}'.format(target,
+                                             ', '.join(SUPPORTED_PKG_TYPES)))
+        return list(targets)
+
+    @property
+    def backend(self):
+        backend = self.contents.get('backend', 'fpm')
+        if backend not in BACKENDS:
+            raise ValueError('backend must be one of {}, got {!r}'.format(
+                ', '.join(BACKENDS), backend))
+        return backend
+
+    @property
+    def slim_profiles(self):
+        """
+        The profiles to prune the virtualenv with before it's packaged, from
+        the manifest's `slim` list. ``slim: true`` prunes tests, docs and
+        headers, but not the metadata pip needs to uninstall things.
+        """
+        profiles = self.contents.get('slim') or []
+        if isinstance(profiles, six.string_types):
+            if profiles.lower() in ['true', 'yes', 'on', 'y']:
+                profiles = list(DEFAULT_SLIM_PROFILES)
+            elif profiles.lower() in ['false', 'no', 'off', 'n']:
+                profiles = []
+            else:
+                profiles = [profiles]
+        for profile in profiles:
+            if profile not in SLIM_PROFILES:
+                raise ValueError('unknown slim profile {!r}, expected one of '
+                                 '{}'.format(profile,
+                                             ', '.join(SLIM_PROFILES)))
+        if 'metadata' in profiles and self.incremental:
+            raise ValueError('an incremental virtualenv needs its metadata '
+                             'to be synced, it cannot be slimmed with the '
+                             'metadata profile')
+        return list(profiles)
+
+    @property
+    def dedupe(self):
+        """
+        Whether to hardlink files in the virtualenv with the same contents,
+        so packages only hold them once
+        """
+        return self.get_bool_value('dedupe')
+
+    @property
+    def max_size(self):
+        """
+        The most bytes the package may install, e.g. ``300M``. None for no
+        limit.
+        """
+        value = self.contents.get('max_size')
+        if value is None:
+            return None
+        match = SIZE_RE.match(value)
+        if match is None:
+            raise ValueError('max_size must be a size like 300M or 1.5GiB, '
+                             'got {!r}'.format(value))
+        number, unit = match.groups()
+        return int(float(number) * SIZE_UNITS[unit.lower()])
+
+    @property
+    def max_files(self):
+        """
+        The most files the package may install. None for no limit.
+        """
+        value = self.contents.get('max_files')
+        return None if value is None else int(value)
+
+    @property
+    def analyze(self):
+        """
+        Whether to report what takes up the package's space before it's
+        packaged. Always done if it has a size or file budget.
+        """
+        return (self.get_bool_value('analyze') or self.max_size is not None
+                or self.max_files is not None)
+
+    @property
+    def compression(self):
+        """
+        The payload compression codec, None for the backend's default
+        """
+        codec = self.contents.get('compression')
+        if codec is not None and codec not in COMPRESSION_CODECS:
+            raise ValueError('compression must be one of {}, got {!r}'.format(
+                ', '.join(COMPRESSION_CODECS), codec))
+        return codec
+
+    @property
+    def compression_level(self):
+        """
+        The compression level, checked against the range of the codec (gzip
+        if none is set), so fpm and the native backend take the same values
+        """
+        level = self.contents.get('compression_level')
+        if level is None:
+            return None
+        # imported only when needed, to keep startup fast
+        from ship_it.compression import validate_level
+        return validate_level(self.compression or 'gzip', int(level))
+
     @property
     def upgrade_pip(self):
         return self.get_bool_value('upgrade_pip')
@@ -165,6 +458,66 @@ class Manifest(object):
     def upgrade_wheel(self):
         return self.get_bool_value('upgrade_wheel')
 
+    @property
+    def incremental(self):
+        return self.get_bool_value('incremental')
+
+    def get_dir_value(self, name, environment_variable):
+        """
+        Get manifest value `name` as an absolute directory, relative to the
+        manifest directory, falling back to `environment_variable`. None if
+        neither is set.
+        """
+        value = self.contents.get(name, os.environ.get(environment_variable))
+        if not value:
+            return None
+        return path.normpath(path.join(self.manifest_dir,
+                                       path.expanduser(value)))
+
+    @property
+    def cache_dir(self):
+        """
+        Where built virtualenvs are cached. None disables caching.
+        """
+        return self.get_dir_value('cache_dir', 'SHIP_IT_CACHE_DIR')
+
+    @property
+    def wheelhouse(self):
+        """
+        Where built wheels are kept for all builds. None disables it.
+        """
+        return self.get_dir_value('wheelhouse', 'SHIP_IT_WHEELHOUSE')
+
+    @property
+    def template_dir(self):
+        """
+        Where template virtualenvs to clone new virtualenvs from are kept.
+        Defaults to ``templates`` in the cache directory, None disables them.
+        """
+        template_dir = self.get_dir_value('template_dir',
+                                          'SHIP_IT_TEMPLATE_DIR')
+        if template_dir is None and self.cache_dir:
+            template_dir = path.join(self.cache_dir, 'templates')
+        return template_dir
+
+    @property
+    def lock_file_path(self):
+        """
+        The lock file written by ``ship_it lock``. When it exists, the
+        virtualenv's requirements are installed from it without resolving
+        them again.
+        """
+        return path.join(self.manifest_dir,
+                         self.contents.get('lock_file', LOCK_FILE_NAME))
+
+    @property
+    def locked(self):
+        return path.isfile(self.lock_file_path)
+
+    @property
+    def require_hashes(self):
+        return self.get_bool_value('require_hashes')
+
     @property
     def virtualenv_name(self):
         return self.contents.setdefault('virtualenv_name',
@@ -191,9 +544,50 @@ class Manifest(object):
         else:
             return self.pkg_location
 
+    @property
+    def shared_build_dir(self):
+        return path.join(self.manifest_dir, 'build')
+
+    @property
+    def build_dir(self):
+        """
+        Where the build's files go. That's ``build`` next to the manifest,
+        unless the build is isolated and has its own private directory.
+        """
+        if self.build_id:
+            return path.join(self.shared_build_dir, WORK_DIR_NAME,
+                             self.build_id)
+        return self.shared_build_dir
+
     @property
     def local_virtualenv_path(self):
-        return path.join(self.manifest_dir, 'build', self.virtualenv_name)
+        return path.join(self.build_dir, self.virtualenv_name)
+
+    @property
+    def local_staging_path(self):
+        return path.join(self.build_dir,
+                         '{}-staging'.format(self.virtualenv_name))
+
+    @property
+    def local_log_path(self):
+        """
+        Where the output of every command the build runs is logged, one file
+        per build stage. Isolated builds each log to their own directory in
+        it.
+        """
+        log_path = path.join(self.shared_build_dir,
+                             '{}-logs'.format(self.virtualenv_name))
+        if self.build_id:
+            log_path = path.join(log_path, self.build_id)
+        return log_path
+
+    @property
+    def isolated(self):
+        return self.get_bool_value('isolated')
+
+    @property
+    def use_staging_root(self):
+        return self.get_bool_value('use_staging_root')
 
 
     @property
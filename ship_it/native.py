@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import io
+import logging
+import os
+import platform
+import socket
+import time
+import uuid
+from os import path
+
+from ship_it.payload import get_payload_entries
+
+logger = logging.getLogger(__name__)
+
+# fpm flags for how fpm finds files and compresses them, which the native
+# backend gets from the manifest instead
+_MANIFEST_FLAGS = ('chdir', 'directories', 'config-files', 'exclude',
+                   'rpm-compression', 'rpm-compression-level',
+                   'deb-compression', 'deb-compression-level')
+
+
+class PackageSpec(object):
+    """
+    Everything about a package other than its files, taken from the fpm
+    flags `ship_it.manifest.Manifest.get_args_and_flags` gives, so both
+    backends build the same package.
+    """
+    def __init__(self, name, version, iteration=None, epoch=None,
+                 description=None, before_install=None, after_install=None,
+                 depends=(), user='root', group='root', architecture=None,
+                 license='unknown', vendor='none', maintainer=None,
+                 url='http://example.com/no-uri-given'):
+        """
+        :param before_install: the contents of the pre-install script
+        :param after_install: the contents of the post-install script
+        :param depends: fpm style dependencies, e.g. ``'python >= 2.7'``
+        :param user: the user owning every file
+        :param group: the group owning every file
+        """
+        self.name = name
+        self.version = version
+        self.iteration = iteration
+        self.epoch = epoch
+        self.description = description or 'no description given'
+        self.before_install = before_install
+        self.after_install = after_install
+        self.depends = list(depends)
+        self.user = user
+        self.group = group
+        self.architecture = architecture or platform.machine()
+        self.license = license
+        self.vendor = vendor
+        self.maintainer = maintainer or '<{}@{}>'.format(
+            os.environ.get('USER', 'root'), socket.gethostname())
+        self.url = url
+        self.build_host = socket.gethostname()
+        self.build_time = int(os.environ.get('SOURCE_DATE_EPOCH') or
+                              time.time())
+
+    @property
+    def summary(self):
+        return self.description.splitlines()[0]
+
+    @classmethod
+    def from_flags(cls, flags, pkg_type='rpm'):
+        """
+        :param flags: ``(flag, value)`` fpm flags, including any overrides
+        :param pkg_type: the package type the flags are for
+        """
+        options = {}
+        depends = []
+        for flag, value in flags:
+            flag = flag.lstrip('-')
+            if flag == 'depends':
+                depends.append(value)
+            elif flag in ('before-install', 'after-install'):
+                with io.open(value, encoding='utf-8') as script:
+                    options[flag.replace('-', '_')] = script.read()
+            elif flag in ('{}-user'.format(pkg_type),
+                          '{}-group'.format(pkg_type)):
+                options[flag.split('-', 1)[1]] = value
+            elif flag in ('name', 'version', 'iteration', 'epoch',
+                          'description', 'architecture', 'license', 'vendor',
+                          'maintainer', 'url'):
+                options[flag] = '{}'.format(value)
+            elif flag not in _MANIFEST_FLAGS:
+                logger.warning('the native backend ignores --%s', flag)
+        for name in ('iteration', 'epoch'):
+            if options.get(name) in (None, ''):
+                options.pop(name, None)
+        return cls(depends=depends, **options)
+
+
+def get_package_filename(spec, pkg_type='rpm'):
+    """
+    The file name fpm would give the package
+    """
+    if pkg_type == 'deb':
+        from ship_it import debwriter
+        version = spec.version
+        if spec.iteration is not None:
+            version = '{}-{}'.format(version, spec.iteration)
+        return '{}_{}_{}.deb'.format(debwriter.get_package_name(spec),
+                                     version,
+                                     debwriter.get_architecture(spec))
+    # fpm defaults the iteration for rpms, but not for debs
+    return '{}-{}-{}.{}.rpm'.format(spec.name, spec.version,
+                                    spec.iteration or '1', spec.architecture)
+
+
+def build_package(manifest, flags, pkg_type='rpm', output_dir=None):
+    """
+    Build a package of the manifest's virtualenv, config files and extra
+    files without fpm, reading every file straight from where it is. The
+    payload is compressed on every core with the manifest's `compression`
+    and `compression_level`. Returns the paths of the packages built, like
+    `ship_it.cli.get_created_packages`.
+
+    :param manifest: the manifest being built, with its virtualenv built and
+        patched
+    :param flags: the fpm flags for the package, see `PackageSpec.from_flags`
+    :param pkg_type: the package type to build
+    :param output_dir: where to write the package, defaults to the working
+        directory like fpm
+    """
+    spec = PackageSpec.from_flags(flags, pkg_type)
+    compression = manifest.compression or 'gzip'
+    level = manifest.compression_level
+    entries = get_payload_entries(manifest)
+    output_path = path.abspath(path.join(output_dir or os.getcwd(),
+                                         get_package_filename(spec, pkg_type)))
+
+    # written under another name first, so a failed build never leaves a
+    # broken package where the last good one was
+    temp_path = '{}.{}.tmp'.format(output_path, uuid.uuid4().hex)
+    try:
+        if pkg_type == 'deb':
+            from ship_it.debwriter import write_deb
+            write_deb(temp_path, spec, entries, compression, level)
+        else:
+            from ship_it.rpmwriter import write_rpm
+            write_rpm(temp_path, spec, entries, compression, level)
+        os.rename(temp_path, output_path)
+    finally:
+        if path.exists(temp_path):
+            os.unlink(temp_path)
+    logger.info('created package %s', output_path)
+    return [output_path]
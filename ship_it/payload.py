@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import hashlib
+import os
+import stat
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from os import path
+
+from ship_it.cache import hash_file
+from ship_it.tree import walk_tree
+
+# The newc cpio format (and an rpm's file size tags) can't describe bigger
+# files than this
+MAX_FILE_SIZE = 2 ** 32 - 1
+
+#: one file, directory or symlink in a package
+PayloadEntry = namedtuple('PayloadEntry', [
+    'path',         # where it's installed, absolute
+    'source',       # where it is now
+    'mode',         # st_mode, including the file type
+    'size',         # the file's size, 0 for directories and symlinks
+    'mtime',
+    'link_target',  # what a symlink points to, None for anything else
+    'config',       # whether it's a config file
+])
+
+
+def _get_entry(source, remote_path, config=False):
+    info = os.lstat(source)
+    link_target = None
+    size = 0
+    if stat.S_ISLNK(info.st_mode):
+        link_target = os.readlink(source)
+    elif stat.S_ISREG(info.st_mode):
+        size = info.st_size
+        if size > MAX_FILE_SIZE:
+            raise ValueError('{} is too big to package natively ({} bytes, '
+                             'the most is {})'.format(source, size,
+                                                      MAX_FILE_SIZE))
+    return PayloadEntry(remote_path, source, info.st_mode, size,
+                        int(info.st_mtime), link_target, config)
+
+
+def _get_tree_entries(local_dir, remote_dir, exclude, config=False,
+                      workers=None):
+    directories, files, links = walk_tree(local_dir, exclude, workers)
+    entries = [_get_entry(local_dir, remote_dir, config=False)]
+    entries.extend(_get_entry(path.join(local_dir, relative_path),
+                              path.join(remote_dir, relative_path),
+                              config=config)
+                   for relative_path in
+                   directories + files + [link for link, _ in links])
+    return entries
+
+
+def get_payload_entries(manifest, workers=None):
+    """
+    Everything a package of `manifest` installs, in the order it's packaged
+    (sorted by installed path): the virtualenv, config files and extra files.
+    Files go where fpm would put them, as for `ship_it.staging`, and the
+    manifest's excludes are applied in the same way as when copying trees.
+
+    :param manifest: the manifest being built, with its virtualenv built
+    :param workers: the number of threads to walk the virtualenv with, see
+        `ship_it.tree.walk_tree`
+    """
+    exclude = [pattern for _, pattern in manifest.get_exclude_flags()]
+    entries = _get_tree_entries(manifest.local_virtualenv_path,
+                                manifest.remote_virtualenv_path, exclude,
+                                workers=workers)
+
+    for config, mappings in ((True, manifest.get_config_file_mappings()),
+                             (False, manifest.get_extra_file_mappings())):
+        for local_path, remote_path in mappings:
+            target = path.join(path.dirname(remote_path),
+                               path.basename(local_path))
+            if path.isdir(local_path):
+                entries.extend(_get_tree_entries(local_path, target, exclude,
+                                                 config=config))
+            else:
+                entries.append(_get_entry(local_path, target, config=config))
+
+    # later mappings replace earlier ones, as they would in a staging root
+    by_path = dict((entry.path, entry) for entry in entries)
+    return [by_path[entry_path] for entry_path in sorted(by_path)]
+
+
+def hash_entries(entries, workers=None, algorithm='sha256'):
+    """
+    The hex digest of every regular file in `entries`, hashed in parallel.
+    Anything else gets an empty string.
+
+    :param entries: `PayloadEntry` tuples
+    :param workers: the number of threads to hash with
+    :param algorithm: the `hashlib` algorithm to use
+    """
+    def _hash(entry):
+        if not stat.S_ISREG(entry.mode):
+            return ''
+        return hash_file(entry.source, hashlib.new(algorithm)).hexdigest()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_hash, entries))
+
+
+def get_hardlinks(entries):
+    """
+    Find the files in `entries` that are hardlinks of each other (e.g. after
+    `ship_it.slim.hardlink_duplicates`), so they're only stored once. For
+    every entry, the indexes of all the entries that are the same file,
+    itself included, or None if it's only packaged once.
+
+    :param entries: `PayloadEntry` tuples
+    """
+    by_inode = {}
+    for index, entry in enumerate(entries):
+        if not stat.S_ISREG(entry.mode):
+            continue
+        info = os.stat(entry.source)
+        if info.st_nlink > 1:
+            by_inode.setdefault((info.st_dev, info.st_ino), []).append(index)
+
+    links = [None] * len(entries)
+    for indexes in by_inode.values():
+        if len(indexes) > 1:
+            for index in indexes:
+                links[index] = tuple(indexes)
+    return links
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import logging
+import os
+import re
+import stat
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from os import path
+
+logger = logging.getLogger(__name__)
+
+
+def _is_candidate(dirpath, filename, bin_dir):
+    """
+    Could this file have the virtualenv's path in it? Everything in bin/
+    (scripts with shebangs and the activate scripts for every shell),
+    pyvenv.cfg, .pth files and the RECORD files pip writes.
+    """
+    if dirpath == bin_dir:
+        return True
+    if filename.endswith('.pth') or filename == 'pyvenv.cfg':
+        return True
+    return filename == 'RECORD' and dirpath.endswith('.dist-info')
+
+
+def find_candidates(virtualenv_path):
+    """
+    Walk the virtualenv once, returning the regular files that may need
+    rewriting and the symlinks, for `relocate_virtualenv`.
+
+    :param virtualenv_path: the virtualenv to search
+    """
+    bin_dir = path.join(virtualenv_path, 'bin')
+    files = []
+    links = []
+    for dirpath, dirnames, filenames in os.walk(virtualenv_path):
+        for name in dirnames:
+            if path.islink(path.join(dirpath, name)):
+                links.append(path.join(dirpath, name))
+        for filename in filenames:
+            file_path = path.join(dirpath, filename)
+            if path.islink(file_path):
+                links.append(file_path)
+            elif _is_candidate(dirpath, filename, bin_dir):
+                files.append(file_path)
+    return files, links
+
+
+def _prefix_re(prefix):
+    """
+    Matches `prefix` as a whole path, or the start of one, but not as part
+    of a longer name such as ``/build/venv-old`` or ``/other/build/venv``:
+    the prefix has to be followed by a ``/``, a quote, whitespace or the
+    end of the file.
+    """
+    return re.compile(br'(?<![\w.-])' + re.escape(prefix) +
+                      br'(?=[/\'"\s]|\Z)')
+
+
+def rewrite_file(file_path, old_prefix, new_prefix):
+    """
+    Replace `old_prefix` with `new_prefix` in a text file with one read and
+    one write, wherever it's a whole path (see `_prefix_re`). The new
+    content is renamed over the old file, so a file that's hardlinked
+    somewhere else (a cache or a template) isn't changed there.
+    Returns whether the file changed.
+
+    :param file_path: the file to rewrite
+    :param old_prefix: the path to replace, as bytes
+    :param new_prefix: the replacement path, as bytes
+    """
+    with open(file_path, 'rb') as fobj:
+        content = fobj.read()
+
+    # skip binaries, they can't just have a path of a different length
+    # patched in
+    if old_prefix not in content or b'\0' in content:
+        return False
+
+    new_content = _prefix_re(old_prefix).sub(
+        lambda match: new_prefix, content)
+    if new_content == content:
+        return False
+
+    temp_path = '{}.{}.tmp'.format(file_path, uuid.uuid4().hex)
+    with open(temp_path, 'wb') as fobj:
+        fobj.write(new_content)
+    os.chmod(temp_path, stat.S_IMODE(os.stat(file_path).st_mode))
+    os.rename(temp_path, file_path)
+    return True
+
+
+def relink(link_path, old_prefix, new_prefix):
+    """
+    Point a symlink that points into `old_prefix` at `new_prefix` instead.
+    Returns whether the link changed.
+
+    :param link_path: the symlink
+    :param old_prefix: the path to replace
+    :param new_prefix: the replacement path
+    """
+    target = os.readlink(link_path)
+    if target != old_prefix and not target.startswith(old_prefix + '/'):
+        return False
+    os.unlink(link_path)
+    os.symlink(new_prefix + target[len(old_prefix):], link_path)
+    return True
+
+
+def relocate_virtualenv(virtualenv_path, destination_path, source_prefix=None,
+                        workers=None):
+    """
+    Rewrite the virtualenv at `virtualenv_path` so it works from
+    `destination_path`: shebangs, activate scripts, .pth files, RECORD
+    entries and symlinks that refer to where it was built. Returns the number
+    of files and links that changed.
+
+    :param virtualenv_path: the virtualenv to relocate
+    :param destination_path: the path it will be used from
+    :param source_prefix: the path baked into the virtualenv, if it's not
+        `virtualenv_path` (e.g. it was copied from elsewhere)
+    :param workers: the number of threads to rewrite files with
+    """
+    source_prefix = (source_prefix or virtualenv_path).rstrip('/')
+    destination_path = destination_path.rstrip('/')
+    old_prefix = source_prefix.encode('utf-8')
+    new_prefix = destination_path.encode('utf-8')
+
+    files, links = find_candidates(virtualenv_path)
+    with ThreadPoolExecutor(max_workers=workers or min(32, len(files) or 1)) \
+            as executor:
+        changed = sum(executor.map(
+            lambda file_path: rewrite_file(file_path, old_prefix, new_prefix),
+            files))
+    changed += sum(relink(link, source_prefix, destination_path)
+                   for link in links)
+
+    logger.debug('relocated %s from %s to %s: %d files and links changed',
+                 virtualenv_path, source_prefix, destination_path, changed)
+    return changed
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import os
+import re
+from os import path
+
+PINNED_RE = re.compile(r'^([A-Za-z0-9][A-Za-z0-9._-]*)\s*==\s*([^\s;#]+)$')
+NESTED_RE = re.compile(r'^(-r|-c|--requirement|--constraint)[\s=]+(\S+)$')
+# the hashes a lock file gives each requirement, see ship_it.lock
+HASH_OPTION_RE = re.compile(r'\s+--hash[\s=]+\S+')
+
+
+def normalize_name(name):
+    """
+    Normalize a distribution name the way pip compares them
+
+    :param name: the name to normalize
+    """
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+
+def read_requirement_lines(requirements_file_path):
+    """
+    Return the requirement lines of a requirements file, without comments,
+    blank lines or line continuations.
+
+    :param requirements_file_path: the path to the requirements.txt file
+    """
+    with open(requirements_file_path) as fobj:
+        content = fobj.read().replace('\\\n', ' ')
+
+    lines = []
+    for line in content.splitlines():
+        # comments need whitespace before them, so url fragments survive
+        line = re.sub(r'(^|\s)#.*$', '', line).strip()
+        if line:
+            lines.append(line)
+    return lines
+
+
+def parse_pinned(lines):
+    """
+    Split requirement lines into a ``{normalized name: (name, version)}``
+    dict of ``name==version`` pins and a list of everything else. Any
+    ``--hash`` options of the pins are ignored.
+
+    :param lines: requirement lines from `read_requirement_lines`
+    """
+    pinned = {}
+    other = []
+    for line in lines:
+        match = PINNED_RE.match(HASH_OPTION_RE.sub('', line))
+        if match:
+            name, version = match.groups()
+            pinned[normalize_name(name)] = (name, version)
+        else:
+            other.append(line)
+    return pinned, other
+
+
+def parse_freeze(output):
+    """
+    Turn ``pip freeze`` output into a ``{normalized name: version}`` dict.
+    Editable and url installs are skipped.
+
+    :param output: the output of ``pip freeze``
+    """
+    installed = {}
+    for line in output.splitlines():
+        match = PINNED_RE.match(line.strip())
+        if match:
+            name, version = match.groups()
+            installed[normalize_name(name)] = version
+    return installed
+
+
+def is_local_requirement(line, base_dir):
+    """
+    Is this requirement line something on the local filesystem (``.``, a
+    path, ``-e`` or a ``file:`` url) rather than something from an index?
+
+    :param line: a line from `read_requirement_lines`
+    :param base_dir: the directory relative paths are relative to
+    """
+    if line.startswith(('-e', '--editable', '.', '/', 'file:')):
+        return True
+    if line.startswith('-'):
+        return False
+    candidate = line.split(';')[0].split('[')[0].strip()
+    return os.sep in candidate and path.exists(path.join(base_dir, candidate))
+
+
+def split_local(lines, base_dir):
+    """
+    Split requirement lines into ones resolved through an index and ones that
+    point at the local filesystem. Nested requirement and constraint files are
+    made absolute so the remote lines can be written anywhere.
+
+    :param lines: lines from `read_requirement_lines`
+    :param base_dir: the directory relative paths are relative to
+    """
+    remote = []
+    local = []
+    for line in lines:
+        match = NESTED_RE.match(line)
+        if match:
+            option, nested = match.groups()
+            remote.append('{} {}'.format(
+                option, path.normpath(path.join(base_dir, nested))))
+        elif is_local_requirement(line, base_dir):
+            local.append(line)
+        else:
+            remote.append(line)
+    return remote, local
@@ -0,0 +1,488 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import hashlib
+import logging
+import os
+import stat
+import struct
+
+from ship_it.compression import DEFAULT_LEVELS, open_compressor
+from ship_it.payload import get_hardlinks, hash_entries
+
+logger = logging.getLogger(__name__)
+
+_CHUNK_SIZE = 1024 * 1024
+
+LEAD_MAGIC = b'\xed\xab\xee\xdb'
+HEADER_MAGIC = b'\x8e\xad\xe8\x01\x00\x00\x00\x00'
+
+# header entry types
+NULL, CHAR, INT8, INT16, INT32, INT64, STRING, BIN, STRING_ARRAY, \
+    I18NSTRING = range(10)
+_ALIGNMENT = {INT16: 2, INT32: 4, INT64: 8}
+
+# signature tags
+SIGTAG_HEADERSIGNATURES = 62
+SIGTAG_SHA1 = 269
+SIGTAG_LONGSIZE = 270
+SIGTAG_LONGARCHIVESIZE = 271
+SIGTAG_SHA256 = 273
+SIGTAG_SIZE = 1000
+SIGTAG_MD5 = 1004
+SIGTAG_PAYLOADSIZE = 1007
+
+# header tags
+RPMTAG_HEADERIMMUTABLE = 63
+RPMTAG_HEADERI18NTABLE = 100
+RPMTAG_NAME = 1000
+RPMTAG_VERSION = 1001
+RPMTAG_RELEASE = 1002
+RPMTAG_EPOCH = 1003
+RPMTAG_SUMMARY = 1004
+RPMTAG_DESCRIPTION = 1005
+RPMTAG_BUILDTIME = 1006
+RPMTAG_BUILDHOST = 1007
+RPMTAG_SIZE = 1009
+RPMTAG_VENDOR = 1011
+RPMTAG_LICENSE = 1014
+RPMTAG_PACKAGER = 1015
+RPMTAG_GROUP = 1016
+RPMTAG_URL = 1020
+RPMTAG_OS = 1021
+RPMTAG_ARCH = 1022
+RPMTAG_PREIN = 1023
+RPMTAG_POSTIN = 1024
+RPMTAG_FILESIZES = 1028
+RPMTAG_FILEMODES = 1030
+RPMTAG_FILERDEVS = 1033
+RPMTAG_FILEMTIMES = 1034
+RPMTAG_FILEDIGESTS = 1035
+RPMTAG_FILELINKTOS = 1036
+RPMTAG_FILEFLAGS = 1037
+RPMTAG_FILEUSERNAME = 1039
+RPMTAG_FILEGROUPNAME = 1040
+RPMTAG_SOURCERPM = 1044
+RPMTAG_FILEVERIFYFLAGS = 1045
+RPMTAG_PROVIDENAME = 1047
+RPMTAG_REQUIREFLAGS = 1048
+RPMTAG_REQUIRENAME = 1049
+RPMTAG_REQUIREVERSION = 1050
+RPMTAG_PREINPROG = 1085
+RPMTAG_POSTINPROG = 1086
+RPMTAG_FILEDEVICES = 1095
+RPMTAG_FILEINODES = 1096
+RPMTAG_FILELANGS = 1097
+RPMTAG_PROVIDEFLAGS = 1112
+RPMTAG_PROVIDEVERSION = 1113
+RPMTAG_DIRINDEXES = 1116
+RPMTAG_BASENAMES = 1117
+RPMTAG_DIRNAMES = 1118
+RPMTAG_PAYLOADFORMAT = 1124
+RPMTAG_PAYLOADCOMPRESSOR = 1125
+RPMTAG_PAYLOADFLAGS = 1126
+RPMTAG_LONGSIZE = 5009
+RPMTAG_FILEDIGESTALGO = 5011
+
+PGPHASHALGO_SHA256 = 8
+
+# file flags
+RPMFILE_CONFIG = 1 << 0
+RPMFILE_NOREPLACE = 1 << 4
+
+# dependency flags
+RPMSENSE_LESS = 1 << 1
+RPMSENSE_GREATER = 1 << 2
+RPMSENSE_EQUAL = 1 << 3
+RPMSENSE_INTERP = 1 << 8
+RPMSENSE_SCRIPT_PRE = 1 << 9
+RPMSENSE_SCRIPT_POST = 1 << 10
+RPMSENSE_RPMLIB = 1 << 24
+
+DEPENDENCY_OPERATORS = {
+    '<': RPMSENSE_LESS,
+    '<=': RPMSENSE_LESS | RPMSENSE_EQUAL,
+    '=': RPMSENSE_EQUAL,
+    '==': RPMSENSE_EQUAL,
+    '>=': RPMSENSE_GREATER | RPMSENSE_EQUAL,
+    '>': RPMSENSE_GREATER,
+}
+
+# features of rpm itself that every package we write needs
+RPMLIB_REQUIREMENTS = [
+    ('rpmlib(CompressedFileNames)', '3.0.4-1'),
+    ('rpmlib(FileDigests)', '4.6.0-1'),
+    ('rpmlib(PayloadFilesHavePrefix)', '4.0-1'),
+]
+# what packages with hardlinks need, only the last link has the data
+HARDLINK_REQUIREMENT = ('rpmlib(PartialHardlinkSets)', '4.0.4-1')
+# and those some compression codecs need
+PAYLOAD_REQUIREMENTS = {
+    'xz': ('rpmlib(PayloadIsXz)', '5.2-1'),
+    'zstd': ('rpmlib(PayloadIsZstd)', '5.4.18-1'),
+}
+
+CPIO_TRAILER = 'TRAILER!!!'
+
+
+def _encode_value(tag_type, value):
+    """
+    The stored bytes and count of one header entry
+    """
+    if tag_type in (STRING, I18NSTRING):
+        return value.encode('utf-8') + b'\0', 1
+    if tag_type == STRING_ARRAY:
+        return b''.join(item.encode('utf-8') + b'\0' for item in value), \
+            len(value)
+    if tag_type == BIN:
+        return bytes(value), len(value)
+    struct_format = {INT16: 'H', INT32: 'I', INT64: 'Q'}[tag_type]
+    mask = (1 << (8 * struct.calcsize(struct_format))) - 1
+    return struct.pack('>{}{}'.format(len(value), struct_format),
+                       *[item & mask for item in value]), len(value)
+
+
+def build_header(entries, region_tag=RPMTAG_HEADERIMMUTABLE):
+    """
+    Encode a header structure, with every entry in one immutable region as
+    rpm writes it.
+
+    :param entries: ``(tag, type, value)`` for every entry, with a list of
+        ints for the integer types
+    :param region_tag: `RPMTAG_HEADERIMMUTABLE` for the main header,
+        `SIGTAG_HEADERSIGNATURES` for the signature
+    """
+    index = []
+    store = bytearray()
+    for tag, tag_type, value in sorted(entries, key=lambda entry: entry[0]):
+        data, count = _encode_value(tag_type, value)
+        store.extend(b'\0' * (-len(store) % _ALIGNMENT.get(tag_type, 1)))
+        index.append(struct.pack('>iiii', tag, tag_type, len(store), count))
+        store.extend(data)
+
+    # the region's trailer points back over the whole index
+    entry_count = len(index) + 1
+    index.insert(0, struct.pack('>iiii', region_tag, BIN, len(store), 16))
+    store.extend(struct.pack('>iiii', region_tag, BIN, -16 * entry_count, 16))
+    return (HEADER_MAGIC + struct.pack('>ii', entry_count, len(store)) +
+            b''.join(index) + bytes(store))
+
+
+def build_lead(name):
+    """
+    The lead, which nothing reads any more beyond checking it's there
+    """
+    return (LEAD_MAGIC + struct.pack('>BBhh', 3, 0, 0, 1) +
+            name.encode('utf-8')[:65].ljust(66, b'\0') +
+            struct.pack('>hh', 1, 5) + b'\0' * 16)
+
+
+def parse_dependency(dependency):
+    """
+    Split an fpm style dependency, e.g. ``'python >= 2.7'``, into its name,
+    rpm sense flags and version.
+    """
+    parts = dependency.split()
+    if len(parts) == 1:
+        return parts[0], 0, ''
+    if len(parts) != 3 or parts[1] not in DEPENDENCY_OPERATORS:
+        raise ValueError('unsupported dependency {!r}, expected "name" or '
+                         '"name <op> version"'.format(dependency))
+    return parts[0], DEPENDENCY_OPERATORS[parts[1]], parts[2]
+
+
+def _cpio_header(inode, entry, size, nlink=None):
+    name = '.{}'.format(entry.path).encode('utf-8') + b'\0'
+    if nlink is None:
+        nlink = 2 if stat.S_ISDIR(entry.mode) else 1
+    fields = (inode, entry.mode, 0, 0, nlink, entry.mtime, size, 0, 0, 0, 0,
+              len(name), 0)
+    header = b'070701' + ''.join('{:08X}'.format(field)
+                                 for field in fields).encode('ascii') + name
+    return header + b'\0' * (-len(header) % 4)
+
+
+def _cpio_trailer():
+    name = CPIO_TRAILER.encode('ascii') + b'\0'
+    header = b'070701' + ''.join('{:08X}'.format(field) for field in (
+        0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, len(name), 0)).encode('ascii') + name
+    return header + b'\0' * (-len(header) % 4)
+
+
+def _payload_size(entry):
+    if entry.link_target is not None:
+        return len(entry.link_target.encode('utf-8'))
+    return entry.size
+
+
+def _get_inodes(entries, links):
+    """
+    The inode of every entry: its position, or the position of the first
+    entry it's a hardlink of
+    """
+    return [index + 1 if group is None else group[0] + 1
+            for index, group in enumerate(links or [None] * len(entries))]
+
+
+def _archive_members(entries, links):
+    """
+    ``(inode, entry, data size, link count)`` for every member of the cpio
+    archive. Like cpio, only the last of a set of hardlinks has the data.
+    """
+    links = links or [None] * len(entries)
+    for index, (inode, entry, group) in enumerate(zip(
+            _get_inodes(entries, links), entries, links)):
+        if group is None:
+            yield inode, entry, _payload_size(entry), None
+        else:
+            data_size = _payload_size(entry) if index == group[-1] else 0
+            yield inode, entry, data_size, len(group)
+
+
+def get_archive_size(entries, links=None):
+    """
+    The size of the uncompressed cpio archive of `entries`
+
+    :param links: from `ship_it.payload.get_hardlinks`
+    """
+    size = len(_cpio_trailer())
+    for _, entry, data_size, nlink in _archive_members(entries, links):
+        size += len(_cpio_header(0, entry, data_size, nlink))
+        size += data_size + (-data_size % 4)
+    return size
+
+
+def write_archive(fobj, entries, links=None):
+    """
+    Stream a newc cpio archive of `entries` into `fobj`, with paths relative
+    to ``/`` as rpm expects. Inodes are the entries' positions (the first
+    link's, for hardlinks), which is how the header refers to them too.
+
+    :param links: from `ship_it.payload.get_hardlinks`, so hardlinked files
+        are only stored once
+    """
+    for inode, entry, data_size, nlink in _archive_members(entries, links):
+        fobj.write(_cpio_header(inode, entry, data_size, nlink))
+        if entry.link_target is not None:
+            fobj.write(entry.link_target.encode('utf-8'))
+        elif data_size:
+            written = 0
+            with open(entry.source, 'rb') as source:
+                for chunk in iter(lambda: source.read(_CHUNK_SIZE), b''):
+                    written += len(chunk)
+                    if written > data_size:
+                        break
+                    fobj.write(chunk)
+            if written != data_size:
+                raise RuntimeError('{} changed while it was being '
+                                   'packaged'.format(entry.source))
+        fobj.write(b'\0' * (-data_size % 4))
+    fobj.write(_cpio_trailer())
+
+
+class _DigestingWriter(object):
+    """
+    Passes writes through to a file while hashing and counting them
+    """
+    def __init__(self, fobj, *digests):
+        self.fobj = fobj
+        self.digests = digests
+        self.size = 0
+
+    def write(self, data):
+        for digest in self.digests:
+            digest.update(data)
+        self.size += len(data)
+        self.fobj.write(data)
+
+    def flush(self):
+        self.fobj.flush()
+
+
+def get_header_entries(spec, entries, digests, compression='gzip',
+                       level=None, links=None):
+    """
+    The main header's entries for a package
+
+    :param spec: the package's `ship_it.native.PackageSpec`
+    :param entries: the `ship_it.payload.PayloadEntry` tuples to package
+    :param digests: the sha256 hex digest of every entry's contents
+    :param compression: the payload's compression codec
+    :param level: the payload's compression level
+    :param links: the hardlinks in `entries`, from
+        `ship_it.payload.get_hardlinks`
+    """
+    if level is None:
+        level = DEFAULT_LEVELS[compression]
+    release = spec.iteration or '1'
+    evr = '{}-{}'.format(spec.version, release)
+    if spec.epoch is not None:
+        evr = '{}:{}'.format(spec.epoch, evr)
+
+    rpmlib_requirements = list(RPMLIB_REQUIREMENTS)
+    if compression in PAYLOAD_REQUIREMENTS:
+        rpmlib_requirements.append(PAYLOAD_REQUIREMENTS[compression])
+    if links and any(links):
+        rpmlib_requirements.append(HARDLINK_REQUIREMENT)
+    requirements = [(name, RPMSENSE_LESS | RPMSENSE_EQUAL | RPMSENSE_RPMLIB,
+                     version) for name, version in rpmlib_requirements]
+    if spec.before_install is not None:
+        requirements.append(('/bin/sh', RPMSENSE_INTERP | RPMSENSE_SCRIPT_PRE,
+                             ''))
+    if spec.after_install is not None:
+        requirements.append(('/bin/sh',
+                             RPMSENSE_INTERP | RPMSENSE_SCRIPT_POST, ''))
+    requirements.extend(parse_dependency(dependency)
+                        for dependency in spec.depends)
+
+    dirnames = []
+    dir_indexes = {}
+    for entry in entries:
+        dirname = os.path.dirname(entry.path).rstrip('/') + '/'
+        if dirname not in dir_indexes:
+            dir_indexes[dirname] = len(dirnames)
+            dirnames.append(dirname)
+
+    total_size = sum(_payload_size(entry) for entry in entries)
+    file_flags = RPMFILE_CONFIG | RPMFILE_NOREPLACE
+
+    header = [
+        (RPMTAG_HEADERI18NTABLE, STRING_ARRAY, ['C']),
+        (RPMTAG_NAME, STRING, spec.name),
+        (RPMTAG_VERSION, STRING, spec.version),
+        (RPMTAG_RELEASE, STRING, release),
+        (RPMTAG_SUMMARY, I18NSTRING, spec.summary),
+        (RPMTAG_DESCRIPTION, I18NSTRING, spec.description),
+        (RPMTAG_BUILDTIME, INT32, [spec.build_time]),
+        (RPMTAG_BUILDHOST, STRING, spec.build_host),
+        (RPMTAG_VENDOR, STRING, spec.vendor),
+        (RPMTAG_LICENSE, STRING, spec.license),
+        (RPMTAG_PACKAGER, STRING, spec.maintainer),
+        (RPMTAG_GROUP, I18NSTRING, 'default'),
+        (RPMTAG_URL, STRING, spec.url),
+        (RPMTAG_OS, STRING, 'linux'),
+        (RPMTAG_ARCH, STRING, spec.architecture),
+        (RPMTAG_SOURCERPM, STRING, '{}-{}-{}.src.rpm'.format(
+            spec.name, spec.version, release)),
+        (RPMTAG_PROVIDENAME, STRING_ARRAY, [spec.name]),
+        (RPMTAG_PROVIDEFLAGS, INT32, [RPMSENSE_EQUAL]),
+        (RPMTAG_PROVIDEVERSION, STRING_ARRAY, [evr]),
+        (RPMTAG_REQUIRENAME, STRING_ARRAY,
+         [name for name, _, _ in requirements]),
+        (RPMTAG_REQUIREFLAGS, INT32, [flags for _, flags, _ in requirements]),
+        (RPMTAG_REQUIREVERSION, STRING_ARRAY,
+         [version for _, _, version in requirements]),
+        (RPMTAG_FILESIZES, INT32, [_payload_size(entry) for entry in entries]),
+        (RPMTAG_FILEMODES, INT16, [entry.mode for entry in entries]),
+        (RPMTAG_FILERDEVS, INT16, [0] * len(entries)),
+        (RPMTAG_FILEMTIMES, INT32, [entry.mtime for entry in entries]),
+        (RPMTAG_FILEDIGESTS, STRING_ARRAY, digests),
+        (RPMTAG_FILELINKTOS, STRING_ARRAY,
+         [entry.link_target or '' for entry in entries]),
+        # only regular files are %config, as for a deb's conffiles, not the
+        # directories and links of a config directory
+        (RPMTAG_FILEFLAGS, INT32,
+         [file_flags if entry.config and stat.S_ISREG(entry.mode) else 0
+          for entry in entries]),
+        (RPMTAG_FILEUSERNAME, STRING_ARRAY, [spec.user] * len(entries)),
+        (RPMTAG_FILEGROUPNAME, STRING_ARRAY, [spec.group] * len(entries)),
+        (RPMTAG_FILEVERIFYFLAGS, INT32, [-1] * len(entries)),
+        (RPMTAG_FILEDEVICES, INT32, [1] * len(entries)),
+        (RPMTAG_FILEINODES, INT32, _get_inodes(entries, links)),
+        (RPMTAG_FILELANGS, STRING_ARRAY, [''] * len(entries)),
+        (RPMTAG_DIRINDEXES, INT32,
+         [dir_indexes[os.path.dirname(entry.path).rstrip('/') + '/']
+          for entry in entries]),
+        (RPMTAG_BASENAMES, STRING_ARRAY,
+         [os.path.basename(entry.path) for entry in entries]),
+        (RPMTAG_DIRNAMES, STRING_ARRAY, dirnames),
+        (RPMTAG_PAYLOADFORMAT, STRING, 'cpio'),
+        (RPMTAG_PAYLOADCOMPRESSOR, STRING, compression),
+        (RPMTAG_PAYLOADFLAGS, STRING, str(level)),
+        (RPMTAG_FILEDIGESTALGO, INT32, [PGPHASHALGO_SHA256]),
+    ]
+    if total_size > 0xffffffff:
+        header.append((RPMTAG_LONGSIZE, INT64, [total_size]))
+    else:
+        header.append((RPMTAG_SIZE, INT32, [total_size]))
+    if spec.epoch is not None:
+        header.append((RPMTAG_EPOCH, INT32, [int(spec.epoch)]))
+    for tag, prog_tag, script in ((RPMTAG_PREIN, RPMTAG_PREINPROG,
+                                   spec.before_install),
+                                  (RPMTAG_POSTIN, RPMTAG_POSTINPROG,
+                                   spec.after_install)):
+        if script is not None:
+            header.append((tag, STRING, script))
+            header.append((prog_tag, STRING_ARRAY, ['/bin/sh']))
+    return header
+
+
+def _build_signature(header, md5, size, archive_size, large):
+    if large:
+        sizes = [(SIGTAG_LONGSIZE, INT64, [size]),
+                 (SIGTAG_LONGARCHIVESIZE, INT64, [archive_size])]
+    else:
+        sizes = [(SIGTAG_SIZE, INT32, [size]),
+                 (SIGTAG_PAYLOADSIZE, INT32, [archive_size])]
+    signature = build_header(sizes + [
+        (SIGTAG_SHA1, STRING, hashlib.sha1(header).hexdigest()),
+        (SIGTAG_SHA256, STRING, hashlib.sha256(header).hexdigest()),
+        (SIGTAG_MD5, BIN, md5),
+    ], region_tag=SIGTAG_HEADERSIGNATURES)
+    # the header that follows starts on an 8 byte boundary
+    return signature + b'\0' * (-len(signature) % 8)
+
+
+def write_rpm(output_path, spec, entries, compression='gzip', level=None,
+              workers=None):
+    """
+    Write a binary rpm of `entries` to `output_path`: the lead, the signature,
+    the header and a compressed cpio payload streamed from the files
+    themselves rather than from a copy of them.
+
+    The header holds the digest of every file, so files are read twice: in
+    parallel to hash them, then again while the payload is written. The
+    signature covers the compressed payload, which isn't known until
+    it's been written, so space is left for it and it's filled in at the
+    end. Nothing but the current chunk of a file is held in memory.
+
+    :param output_path: the rpm to write
+    :param spec: the package's `ship_it.native.PackageSpec`
+    :param entries: the `ship_it.payload.PayloadEntry` tuples to package,
+        sorted by path
+    :param compression: how to compress the payload, see
+        `ship_it.compression.open_compressor`
+    :param level: the compression level
+    :param workers: the number of threads to hash and compress with
+    """
+    digests = hash_entries(entries, workers)
+    links = get_hardlinks(entries)
+    header = build_header(get_header_entries(spec, entries, digests,
+                                             compression, level, links))
+    archive_size = get_archive_size(entries, links)
+    # decided up front, as the signature's size mustn't change. Compression
+    # can only grow the archive by a fraction of a percent.
+    large = len(header) + archive_size * 1.01 + 2 ** 20 > 0xffffffff
+    placeholder = _build_signature(header, b'\0' * 16, 0, archive_size, large)
+
+    with open(output_path, 'wb') as fobj:
+        fobj.write(build_lead('{}-{}-{}'.format(spec.name, spec.version,
+                                                spec.iteration or '1')))
+        signature_offset = fobj.tell()
+        fobj.write(placeholder)
+
+        md5 = hashlib.md5()
+        signed = _DigestingWriter(fobj, md5)
+        signed.write(header)
+        with open_compressor(signed, compression, level,
+                             workers) as compressor:
+            write_archive(compressor, entries, links)
+
+        signature = _build_signature(header, md5.digest(), signed.size,
+                                     archive_size, large)
+        assert len(signature) == len(placeholder)
+        fobj.seek(signature_offset)
+        fobj.write(signature)
+
+    logger.debug('wrote %s: %d files, %d bytes', output_path, len(entries),
+                 signed.size)
+    return output_path
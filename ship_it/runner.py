@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import collections
+import contextlib
+import io
+import logging
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+from os import path
+
+from ship_it.timing import recorder
+
+logger = logging.getLogger(__name__)
+
+# how many lines of a command's output are kept in memory for error reports
+TAIL_LINES = 200
+
+CommandResult = collections.namedtuple(
+    'CommandResult', ['command', 'exited', 'stdout', 'tail', 'log_path'])
+
+
+class CommandError(Exception):
+    """
+    A command exited with a non-zero status
+    """
+    def __init__(self, result):
+        self.result = result
+        message = 'command exited with status {}: {}'.format(result.exited,
+                                                              result.command)
+        if result.tail:
+            message += '\n\nlast {} lines of output:\n{}'.format(
+                len(result.tail), ''.join(result.tail).rstrip('\n'))
+        if result.log_path:
+            message += '\n\nfull output in {}'.format(result.log_path)
+        super(CommandError, self).__init__(message)
+
+
+def _log_name(stage_name):
+    return re.sub(r'[^\w.-]+', '-', stage_name).strip('-') or 'commands'
+
+
+class CommandRunner(object):
+    """
+    Runs shell commands without holding their output in memory. Output is
+    streamed to a log file per build stage (or echoed, if there's no log
+    directory) and only the last `tail_lines` lines are kept for error
+    reports.
+    """
+    def __init__(self, log_dir=None, tail_lines=TAIL_LINES):
+        """
+        :param log_dir: the directory to write per-stage logs to
+        :param tail_lines: how many lines of output to keep in memory
+        """
+        self.log_dir = log_dir
+        self.tail_lines = tail_lines
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def logging_to(self, log_dir):
+        """
+        Write the logs of commands run in the body of the with statement to
+        `log_dir`, which is created when the first command runs
+        """
+        previous, self.log_dir = self.log_dir, log_dir
+        try:
+            yield log_dir
+        finally:
+            self.log_dir = previous
+
+    def get_log_path(self):
+        """
+        The log file for the stage running on this thread, or None
+        """
+        if not self.log_dir:
+            return None
+        stage_name = recorder.current_stage() or 'commands'
+        return path.join(self.log_dir, '{}.log'.format(_log_name(stage_name)))
+
+    def run(self, command, hide=False):
+        """
+        Run `command` in a shell, raising `CommandError` if it fails.
+
+        :param command: the command line to run
+        :param hide: capture stdout and return all of it as the result's
+            `stdout`, rather than logging it. Only for commands with small
+            output, e.g. ``pip freeze``.
+        """
+        log_path = self.get_log_path()
+        logger.debug('running %s (output: %s)', command, log_path or 'stdout')
+        tail = collections.deque(maxlen=self.tail_lines)
+        if log_path:
+            if not path.isdir(self.log_dir):
+                try:
+                    os.makedirs(self.log_dir)
+                except OSError:
+                    # another thread got there first
+                    if not path.isdir(self.log_dir):
+                        raise
+            log = io.open(log_path, 'ab')
+            log.write('$ {}\n'.format(command).encode('utf-8'))
+            log.flush()
+        else:
+            log = None
+
+        try:
+            if hide:
+                exited, stdout = self._run_captured(command, log, tail)
+            else:
+                exited = self._run_streamed(command, log, tail)
+                stdout = ''.join(tail)
+        finally:
+            if log is not None:
+                log.close()
+
+        result = CommandResult(command, exited, stdout, list(tail), log_path)
+        if exited != 0:
+            raise CommandError(result)
+        return result
+
+    def _write(self, line, log, tail):
+        tail.append(line.decode('utf-8', 'replace'))
+        if log is not None:
+            log.write(line)
+        else:
+            with self._lock:
+                sys.stdout.write(tail[-1])
+
+    def _run_streamed(self, command, log, tail):
+        process = subprocess.Popen(command, shell=True,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT)
+        with process.stdout:
+            for line in iter(process.stdout.readline, b''):
+                self._write(line, log, tail)
+        return process.wait()
+
+    def _run_captured(self, command, log, tail):
+        # stdout goes to a temporary file rather than a pipe, so stderr can
+        # be streamed without the two blocking each other
+        with tempfile.TemporaryFile() as stdout:
+            process = subprocess.Popen(command, shell=True, stdout=stdout,
+                                       stderr=subprocess.PIPE)
+            with process.stderr:
+                for line in iter(process.stderr.readline, b''):
+                    self._write(line, log, tail)
+            exited = process.wait()
+            stdout.seek(0)
+            return exited, stdout.read().decode('utf-8', 'replace')
+
+
+# the runner for this process
+runner = CommandRunner()
+
+
+def run(command, hide=False):
+    return runner.run(command, hide=hide)
+
+
+def logging_to(log_dir):
+    return runner.logging_to(log_dir)
@@ -1,12 +1,217 @@
+import logging
+import sys
+from os import path
+
 import click
 from ship_it import fpm
+from ship_it.timing import recorder
+
+
+class DefaultGroup(click.Group):
+    """
+    A command group that runs `build` when it isn't given a command, so
+    ``ship_it manifest.yaml`` still works.
+    """
+    default_command = 'build'
+
+    def parse_args(self, ctx, args):
+        if args and args[0] not in self.commands and \
+                args[0] not in ctx.help_option_names:
+            args = [self.default_command] + list(args)
+        return super(DefaultGroup, self).parse_args(ctx, args)
 
-@click.command()
+
+@click.group(cls=DefaultGroup)
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+
+@main.command()
 @click.option('--requirements', default=None, help='Path to requirements.txt')
 @click.option('--setup', default=None, help='Path to setup.py')
+@click.option('--cache-dir', default=None,
+              help='Directory to cache built virtualenvs in')
+@click.option('--wheelhouse', default=None,
+              help='Directory to build and install requirement wheels from')
+@click.option('--jobs', '-j', default=None, type=int,
+              help='Number of manifests to build at once (defaults to the '
+                   'number of cpus)')
+@click.option('--log-dir', default=None,
+              help='Directory for per-manifest logs when building several')
+@click.option('--skip-unchanged', is_flag=True, default=False,
+              help="Don't rebuild if nothing that goes into the package "
+                   "changed and the last build's packages are still there")
+@click.option('--isolated', is_flag=True, default=False,
+              help='Build in a private directory, so builds of the same '
+                   'manifest can run at once')
+@click.option('--trace', default=None,
+              help='Write a Chrome trace-event file of the build stages')
+@click.option('--timings', default=None,
+              help='Write a JSON summary of time spent per build stage')
+@click.option('--daemon', is_flag=True, default=False,
+              help='Have a running `ship_it serve` daemon do the build')
+@click.option('--socket', default=None,
+              help="The daemon's socket (defaults to $SHIP_IT_SOCKET or one "
+                   "in a directory only you can use)")
+@click.argument('manifests', nargs=-1, required=True)
+@click.pass_context
+def build(ctx, manifests, requirements, setup, cache_dir, wheelhouse, jobs,
+          log_dir, skip_unchanged, isolated, trace, timings, daemon,
+          socket):
+    """
+    Build packages from manifests, or directories of them
+    """
+    try:
+        if daemon:
+            _build_with_daemon(ctx, manifests, socket,
+                               requirements=requirements, setup=setup,
+                               jobs=jobs, log_dir=log_dir,
+                               cache_dir=cache_dir, wheelhouse=wheelhouse,
+                               skip_unchanged=skip_unchanged,
+                               isolated=isolated)
+        else:
+            _build(ctx, manifests, requirements, setup, jobs, log_dir,
+                   cache_dir=cache_dir, wheelhouse=wheelhouse,
+                   skip_unchanged=skip_unchanged, isolated=isolated)
+    finally:
+        if trace:
+            recorder.write_trace(trace)
+        if timings:
+            recorder.write_summary(timings)
+
+
+def _build(ctx, manifests, requirements, setup, jobs, log_dir, **options):
+    if len(manifests) == 1 and not path.isdir(manifests[0]):
+        fpm(manifests[0], requirements, setup, **options)
+        return
+
+    if requirements or setup:
+        raise click.UsageError('--requirements and --setup only make sense '
+                               'for a single manifest')
+
+    from ship_it.batch import find_manifests, build_many
+    manifest_paths = find_manifests(manifests)
+    if not manifest_paths:
+        raise click.UsageError('no manifests found in {}'.format(
+            ', '.join(manifests)))
+
+    results = build_many(manifest_paths, jobs=jobs, log_dir=log_dir,
+                         **options)
+    if not all(result.success for result in results):
+        ctx.exit(1)
+
+
+def _build_with_daemon(ctx, manifests, socket_path, **options):
+    from ship_it import daemon
+
+    try:
+        response = daemon.build(manifests, socket_path, **options)
+    except (daemon.DaemonNotRunning, daemon.InsecureSocket) as exc:
+        raise click.ClickException(str(exc))
+
+    recorder.extend(response.get('timings', []))
+    if 'results' not in response:
+        raise click.ClickException(response.get('error', 'build failed'))
+
+    sys.stdout.write(response.get('output', ''))
+    for result in response['results']:
+        if result.get('traceback'):
+            sys.stderr.write(result['traceback'])
+        for artifact in result.get('artifacts') or []:
+            click.echo('created {}'.format(artifact))
+    if not response['ok']:
+        ctx.exit(1)
+
+
+@main.command()
+@click.option('--requirements', default=None,
+              help='Path to requirements.txt (defaults to the one next to '
+                   'the manifest)')
+@click.option('--find-links', multiple=True,
+              help='Also look for distributions here, as for pip')
 @click.argument('manifest')
-def main(manifest, requirements, setup):
-    fpm(manifest, requirements, setup)
+def lock(manifest, requirements, find_links):
+    """
+    Resolve a manifest's requirements once and pin them, with their hashes,
+    in its lock file. Builds with a different requirements file than this
+    one's won't use it.
+    """
+    from pipes import quote
+    from ship_it.lock import write_lock_file
+    from ship_it.manifest import get_manifest_from_path
+
+    loaded = get_manifest_from_path(manifest)
+    if requirements is None:
+        requirements = path.join(loaded.manifest_dir, 'requirements.txt')
+    if not path.isfile(requirements):
+        raise click.UsageError('{} does not exist'.format(requirements))
+
+    extra_args = []
+    for link in find_links:
+        extra_args.extend(['--find-links', quote(link)])
+    # `pip install .` needs whatever setup.py asks for as well
+    projects = ([loaded.manifest_dir]
+                if loaded.contents.get('method') == 'pip' else [])
+    lock_file = write_lock_file(path.abspath(requirements),
+                                loaded.lock_file_path, extra_args=extra_args,
+                                projects=projects)
+    click.echo('wrote {}'.format(lock_file))
+
+
+@main.command()
+@click.option('--top', default=10, type=int,
+              help='How many of the biggest contributors to show')
+@click.argument('manifest')
+@click.pass_context
+def analyze(ctx, manifest, top):
+    """
+    Show what takes up the space in a manifest's built virtualenv and check
+    it against the manifest's max_size and max_files budgets
+    """
+    from ship_it.analyze import BudgetExceeded, analyze_package
+    from ship_it.manifest import get_manifests_from_path
+
+    over_budget = False
+    for loaded in get_manifests_from_path(manifest):
+        if not path.isdir(loaded.local_virtualenv_path):
+            raise click.UsageError('{} has not been built, there is no '
+                                   '{}'.format(manifest,
+                                               loaded.local_virtualenv_path))
+        analysis = analyze_package(loaded)
+        click.echo(analysis.format(top))
+        try:
+            analysis.check_budgets(loaded.max_size, loaded.max_files)
+        except BudgetExceeded as exc:
+            click.echo(str(exc), err=True)
+            over_budget = True
+    if over_budget:
+        ctx.exit(1)
+
+
+@main.command()
+@click.option('--socket', default=None,
+              help='The socket to listen on (defaults to $SHIP_IT_SOCKET or '
+                   'one in a directory only you can use)')
+@click.option('--stop', is_flag=True, default=False,
+              help='Stop the daemon listening on the socket instead')
+def serve(socket, stop):
+    """
+    Run a build daemon that keeps its caches warm between builds
+    """
+    from ship_it import daemon
+
+    if stop:
+        try:
+            daemon.stop(socket)
+        except (daemon.DaemonNotRunning, daemon.InsecureSocket) as exc:
+            raise click.ClickException(str(exc))
+        return
+
+    try:
+        daemon.serve(socket)
+    except RuntimeError as exc:
+        raise click.ClickException(str(exc))
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import logging
+import os
+import shutil
+import stat
+from concurrent.futures import ThreadPoolExecutor
+from os import path
+
+from ship_it.cache import hash_file
+from ship_it.tree import is_excluded, walk_tree
+
+logger = logging.getLogger(__name__)
+
+# what each slimming profile removes from a virtualenv, as `is_excluded`
+# patterns. Directories that are importable packages are kept whatever
+# they're called, e.g. django/test.
+PROFILES = {
+    'tests': ('tests', 'test', 'test_*.py', '*_test.py', 'conftest.py'),
+    'docs': ('docs', 'doc', 'examples', 'man', '*.rst', '*.md'),
+    'headers': ('include', '*.h', '*.hh', '*.hpp', '*.pxd'),
+    # only pip needs these, to uninstall things
+    'metadata': ('*.dist-info/RECORD', '*.dist-info/INSTALLER',
+                 '*.dist-info/REQUESTED', '*.dist-info/direct_url.json'),
+}
+
+# hardlinking anything smaller saves nothing once it's in a tar, which
+# pads every file to 512 bytes
+MIN_DEDUPE_SIZE = 512
+
+
+def format_size(size):
+    if size < 1024:
+        return '{}B'.format(size)
+    for unit in ('KiB', 'MiB'):
+        size /= 1024.0
+        if size < 1024:
+            return '{:.1f}{}'.format(size, unit)
+    return '{:.1f}GiB'.format(size / 1024.0)
+
+
+class SlimReport(object):
+    """
+    What slimming a virtualenv removed and hardlinked, and the bytes that
+    saved
+    """
+    def __init__(self):
+        self.removed_files = 0
+        self.removed_bytes = 0
+        self.linked_files = 0
+        self.linked_bytes = 0
+
+    @property
+    def saved_bytes(self):
+        return self.removed_bytes + self.linked_bytes
+
+    def __str__(self):
+        return ('removed {} files ({}), hardlinked {} duplicates ({}), '
+                'saving {}'.format(
+                    self.removed_files, format_size(self.removed_bytes),
+                    self.linked_files, format_size(self.linked_bytes),
+                    format_size(self.saved_bytes)))
+
+
+def get_slim_patterns(manifest):
+    """
+    What to prune from the virtualenv of `manifest`: the patterns of its
+    slimming profiles and its excludes. Excludes are applied again when
+    packaging, so any packages they match that `prune_tree` keeps are still
+    left out.
+
+    :param manifest: the manifest being built
+    """
+    patterns = []
+    for profile in manifest.slim_profiles:
+        patterns.extend(PROFILES[profile])
+    patterns.extend(sorted(pattern for _, pattern in
+                           manifest.get_exclude_flags()))
+    return patterns
+
+
+def _tree_size(root):
+    size = 0
+    count = 0
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            info = os.lstat(path.join(dirpath, filename))
+            size += info.st_size
+            count += 1
+    return count, size
+
+
+def _remove_bytecode(file_path):
+    """
+    Remove what the interpreter compiled from a source file that's gone
+    """
+    stem, extension = path.splitext(path.basename(file_path))
+    cache_dir = path.join(path.dirname(file_path), '__pycache__')
+    if extension != '.py' or not path.isdir(cache_dir):
+        return 0
+    removed = 0
+    for name in os.listdir(cache_dir):
+        if name.startswith(stem + '.') and name.endswith(('.pyc', '.pyo')):
+            compiled = path.join(cache_dir, name)
+            removed += os.lstat(compiled).st_size
+            os.unlink(compiled)
+    return removed
+
+
+def _is_package(dir_path):
+    return path.isfile(path.join(dir_path, '__init__.py'))
+
+
+def prune_tree(root, patterns, report=None, keep_packages=False):
+    """
+    Remove every file and directory below `root` matching `patterns`, along
+    with the bytecode of any removed source file.
+
+    :param root: the directory to prune, e.g. a virtualenv
+    :param patterns: glob patterns, see `ship_it.tree.is_excluded`
+    :param report: a `SlimReport` to add to, a new one if not given
+    :param keep_packages: leave directories with an ``__init__.py`` alone,
+        as something may import them. What's in them is still pruned.
+    """
+    report = report or SlimReport()
+    if not patterns:
+        return report
+    for dirpath, dirnames, filenames in os.walk(root):
+        relative_dir = path.relpath(dirpath, root)
+        if relative_dir == '.':
+            relative_dir = ''
+        for dirname in list(dirnames):
+            full_path = path.join(dirpath, dirname)
+            if is_excluded(path.join(relative_dir, dirname), patterns):
+                if keep_packages and _is_package(full_path):
+                    continue
+                dirnames.remove(dirname)
+                if path.islink(full_path):
+                    os.unlink(full_path)
+                    continue
+                count, size = _tree_size(full_path)
+                shutil.rmtree(full_path)
+                report.removed_files += count
+                report.removed_bytes += size
+        for filename in filenames:
+            full_path = path.join(dirpath, filename)
+            if is_excluded(path.join(relative_dir, filename), patterns):
+                report.removed_bytes += os.lstat(full_path).st_size
+                report.removed_files += 1
+                os.unlink(full_path)
+                report.removed_bytes += _remove_bytecode(full_path)
+    return report
+
+
+def hardlink_duplicates(root, report=None, workers=None,
+                        min_size=MIN_DEDUPE_SIZE):
+    """
+    Replace files below `root` that have the same contents and permissions
+    with hardlinks to one of them, so packages only hold them once. Files
+    are only hashed if another file has the same size, and are replaced by
+    renaming a new link over them, so nothing that shares them with another
+    tree (e.g. the cache) is ever written to.
+
+    :param root: the directory to deduplicate, e.g. a virtualenv
+    :param report: a `SlimReport` to add to, a new one if not given
+    :param workers: the number of threads to hash with
+    :param min_size: leave files smaller than this alone
+    """
+    report = report or SlimReport()
+    _, files, _ = walk_tree(root)
+
+    by_size = {}
+    for relative_path in files:
+        info = os.lstat(path.join(root, relative_path))
+        if info.st_size >= min_size:
+            by_size.setdefault((info.st_size, stat.S_IMODE(info.st_mode)),
+                               []).append((relative_path, info))
+    candidates = [item for items in by_size.values() if len(items) > 1
+                  for item in items]
+
+    def _hash(item):
+        return hash_file(path.join(root, item[0])).hexdigest()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        digests = list(executor.map(_hash, candidates))
+
+    groups = {}
+    for (relative_path, info), digest in zip(candidates, digests):
+        groups.setdefault((info.st_size, stat.S_IMODE(info.st_mode), digest),
+                          []).append((relative_path, info))
+
+    for items in groups.values():
+        items.sort(key=lambda item: item[0])
+        original, original_info = items[0]
+        for relative_path, info in items[1:]:
+            if (info.st_dev, info.st_ino) == (original_info.st_dev,
+                                              original_info.st_ino):
+                continue
+            target = path.join(root, relative_path)
+            temp_path = '{}.ship_it-link'.format(target)
+            os.link(path.join(root, original), temp_path)
+            os.rename(temp_path, target)
+            report.linked_files += 1
+            report.linked_bytes += info.st_size
+    return report
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import logging
+import os
+import shutil
+from os import path
+
+from ship_it.tree import clone_file, copy_tree
+
+logger = logging.getLogger(__name__)
+
+
+def _staged_path(staging_root, remote_path):
+    return path.join(staging_root, remote_path.lstrip('/'))
+
+
+def assemble_staging_root(manifest, staging_root):
+    """
+    Lay out everything the package installs under `staging_root` exactly as
+    it will be on the target system: the relocated virtualenv, config files
+    and extra files. Files are hardlinked (or reflinked) rather than copied,
+    and fpm is then run once against the whole root.
+
+    Files end up where fpm's ``local=remote/`` mappings put them, i.e. in the
+    remote path's directory under their local name.
+
+    :param manifest: the manifest being built
+    :param staging_root: the directory to assemble the package in, anything
+        already in it is removed
+    """
+    if path.lexists(staging_root):
+        shutil.rmtree(staging_root)
+    os.makedirs(staging_root)
+
+    copy_tree(manifest.local_virtualenv_path,
+              _staged_path(staging_root, manifest.remote_virtualenv_path),
+              exclude=(), link=True)
+
+    for local_path, remote_path in (manifest.get_config_file_mappings() +
+                                    manifest.get_extra_file_mappings()):
+        target = path.join(_staged_path(staging_root,
+                                        path.dirname(remote_path)),
+                           path.basename(local_path))
+        if path.isdir(local_path):
+            copy_tree(local_path, target, exclude=(), link=True)
+        else:
+            if not path.isdir(path.dirname(target)):
+                os.makedirs(path.dirname(target))
+            if path.lexists(target):
+                os.unlink(target)
+            clone_file(local_path, target, link=True)
+
+    logger.debug('assembled staging root %s', staging_root)
+    return staging_root
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import errno
+import hashlib
+import io
+import logging
+import os
+import shutil
+import sys
+import time
+import uuid
+from os import path
+
+from ship_it.relocate import relocate_virtualenv
+from ship_it.tree import copy_tree
+from ship_it.virtualenv import create_virtualenv, get_virtualenv
+
+logger = logging.getLogger(__name__)
+
+# templates are rebuilt after this long so they pick up new pip releases
+TEMPLATE_MAX_AGE = 7 * 24 * 60 * 60
+
+# written into a template once it's complete, never copied into clones
+TEMPLATE_MARKER = '.ship_it-template'
+
+
+def get_template_key(upgrade_pip=False, upgrade_wheel=False, python=None):
+    """
+    Identify the template for an interpreter and set of options.
+
+    :param upgrade_pip: whether pip is upgraded in the template
+    :param upgrade_wheel: whether wheel is upgraded in the template
+    :param python: the interpreter, defaults to `sys.executable`
+    """
+    digest = hashlib.sha256()
+    for value in (python or sys.executable, sys.version, get_virtualenv(),
+                  upgrade_pip, upgrade_wheel):
+        digest.update('{}\0'.format(value).encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+class VirtualEnvTemplates(object):
+    """
+    Freshly created (and optionally upgraded) virtualenvs, one per
+    interpreter and set of options, that new virtualenvs are cloned from
+    instead of being created from scratch.
+    """
+    def __init__(self, root, max_age=TEMPLATE_MAX_AGE):
+        """
+        :param root: the directory to keep templates in
+        :param max_age: rebuild templates older than this many seconds
+        """
+        self.root = root
+        self.max_age = max_age
+
+    def get_path(self, key):
+        return path.join(self.root, key)
+
+    def is_fresh(self, template_path):
+        marker = path.join(template_path, TEMPLATE_MARKER)
+        if not path.isfile(marker):
+            return False
+        return time.time() - os.stat(marker).st_mtime < self.max_age
+
+    def get(self, upgrade_pip=False, upgrade_wheel=False):
+        """
+        The path to an up to date template, building it if needed
+
+        :param upgrade_pip: upgrade pip in the template
+        :param upgrade_wheel: upgrade wheel in the template
+        """
+        template_path = self.get_path(get_template_key(upgrade_pip,
+                                                       upgrade_wheel))
+        if not self.is_fresh(template_path):
+            logger.info('building template virtualenv %s', template_path)
+            self._build(template_path, upgrade_pip, upgrade_wheel)
+        return template_path
+
+    def _build(self, template_path, upgrade_pip, upgrade_wheel):
+        """
+        Build a template somewhere private and rename it into place, so a
+        half built template is never used and concurrent builds don't step on
+        each other.
+        """
+        if not path.isdir(self.root):
+            os.makedirs(self.root)
+        temp_path = path.join(self.root, '.tmp-{}'.format(uuid.uuid4().hex))
+        try:
+            create_virtualenv(temp_path, upgrade_pip, upgrade_wheel)
+            relocate_virtualenv(temp_path, template_path)
+            with io.open(path.join(temp_path, TEMPLATE_MARKER), 'w',
+                         encoding='utf-8') as marker:
+                marker.write('{}\n'.format(time.time()))
+
+            if path.exists(template_path):
+                # a stale template, move it out of the way first
+                old_path = path.join(self.root,
+                                     '.old-{}'.format(uuid.uuid4().hex))
+                try:
+                    os.rename(template_path, old_path)
+                except OSError as exc:
+                    if exc.errno != errno.ENOENT:
+                        raise
+                else:
+                    shutil.rmtree(old_path, ignore_errors=True)
+
+            try:
+                os.rename(temp_path, template_path)
+            except OSError as exc:
+                if exc.errno not in (errno.EEXIST, errno.ENOTEMPTY):
+                    raise
+                # another build finished one first, use theirs
+        finally:
+            if path.exists(temp_path):
+                shutil.rmtree(temp_path, ignore_errors=True)
+
+    def clone(self, virtualenv_path, upgrade_pip=False, upgrade_wheel=False):
+        """
+        Make a new virtualenv at `virtualenv_path` by copying the template
+        (as reflinks where the filesystem supports them) and relocating it.
+        Files are never hardlinked, as installing into the virtualenv can
+        change some of them in place.
+
+        :param virtualenv_path: the path to the virtualenv we're going to make
+        :param upgrade_pip: upgrade pip in the virtualenv
+        :param upgrade_wheel: upgrade wheel in the virtualenv
+        """
+        template_path = self.get(upgrade_pip, upgrade_wheel)
+        if path.lexists(virtualenv_path):
+            shutil.rmtree(virtualenv_path)
+        copy_tree(template_path, virtualenv_path,
+                  exclude=(TEMPLATE_MARKER,), link=False)
+        relocate_virtualenv(virtualenv_path, virtualenv_path,
+                            source_prefix=template_path)
+        logger.debug('cloned %s from template %s', virtualenv_path,
+                     template_path)
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import collections
+import contextlib
+import functools
+import io
+import json
+import os
+import threading
+import time
+
+
+class Recorder(object):
+    """
+    Collects how long each build stage took, as Chrome trace events
+    (https://chromium.googlesource.com/catapult/+/HEAD/docs/trace-event-format.md)
+    """
+    def __init__(self):
+        self.events = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def reset(self):
+        with self._lock:
+            self.events = []
+
+    def extend(self, events):
+        """
+        Add events recorded elsewhere, e.g. by another process.
+
+        :param events: trace event dicts
+        """
+        with self._lock:
+            self.events.extend(events)
+
+    def current_stage(self):
+        """
+        The innermost stage running on this thread, or None
+        """
+        stack = getattr(self._local, 'stack', None)
+        return stack[-1] if stack else None
+
+    @contextlib.contextmanager
+    def stage(self, name, **args):
+        """
+        Time the body of the with statement as stage `name`.
+
+        :param name: the name of the stage
+        :param args: extra details to record with it
+        """
+        stack = self._local.__dict__.setdefault('stack', [])
+        stack.append(name)
+        start = time.time()
+        try:
+            yield
+        finally:
+            end = time.time()
+            stack.pop()
+            event = {
+                'name': name,
+                'cat': 'ship_it',
+                'ph': 'X',
+                'ts': int(start * 1e6),
+                'dur': int((end - start) * 1e6),
+                'pid': os.getpid(),
+                'tid': threading.current_thread().ident,
+            }
+            if args:
+                event['args'] = dict((key, str(value))
+                                     for key, value in args.items())
+            with self._lock:
+                self.events.append(event)
+
+    def summary(self):
+        """
+        Total time, and time and count per stage name, slowest first.
+        Nested stages are included in their parent's time too.
+        """
+        with self._lock:
+            events = list(self.events)
+        totals = collections.OrderedDict()
+        for event in events:
+            count, seconds = totals.get(event['name'], (0, 0.0))
+            totals[event['name']] = (count + 1, seconds + event['dur'] / 1e6)
+
+        if events:
+            wall = (max(event['ts'] + event['dur'] for event in events) -
+                    min(event['ts'] for event in events)) / 1e6
+        else:
+            wall = 0.0
+        return {
+            'total_seconds': round(wall, 6),
+            'stages': [
+                {'name': name, 'count': count, 'seconds': round(seconds, 6)}
+                for name, (count, seconds) in sorted(
+                    totals.items(), key=lambda item: -item[1][1])
+            ],
+        }
+
+    def write_summary(self, summary_path):
+        _write_json(summary_path, self.summary())
+
+    def write_trace(self, trace_path):
+        with self._lock:
+            events = sorted(self.events, key=lambda event: event['ts'])
+        _write_json(trace_path, {'traceEvents': events,
+                                 'displayTimeUnit': 'ms'})
+
+
+def _write_json(file_path, data):
+    with io.open(file_path, 'w', encoding='utf-8') as fobj:
+        fobj.write(json.dumps(data, indent=2, sort_keys=True))
+
+
+# the recorder for this process
+recorder = Recorder()
+
+
+def stage(name, **args):
+    return recorder.stage(name, **args)
+
+
+def timed(name):
+    """
+    Decorator recording every call of the function as stage `name`
+
+    :param name: the name of the stage
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with recorder.stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import errno
+import fnmatch
+import logging
+import os
+import shutil
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from os import path
+
+try:
+    import fcntl
+except ImportError:  # not on a posix system
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# bytecode is never copied, it's rebuilt for wherever the files end up
+COMPILED_PATTERNS = ('*.py[co]', '__pycache__')
+
+# the linux ioctl to share a file's extents with another (a reflink)
+FICLONE = 0x40049409
+
+# errors that mean "this filesystem can't do that", rather than real failures
+_UNSUPPORTED = frozenset([errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTTY,
+                          errno.EINVAL, errno.ENOSYS, errno.EPERM,
+                          errno.EMLINK])
+
+
+def _reflink(src, dst):
+    if fcntl is None:
+        raise OSError(errno.ENOSYS, 'reflinks need fcntl')
+    with open(src, 'rb') as src_fobj, open(dst, 'wb') as dst_fobj:
+        fcntl.ioctl(dst_fobj.fileno(), FICLONE, src_fobj.fileno())
+
+
+def _copy_file_range(src, dst):
+    copy_file_range = getattr(os, 'copy_file_range', None)
+    if copy_file_range is None:
+        raise OSError(errno.ENOSYS, 'copy_file_range is not available')
+    with open(src, 'rb') as src_fobj, open(dst, 'wb') as dst_fobj:
+        remaining = os.fstat(src_fobj.fileno()).st_size
+        while remaining > 0:
+            copied = copy_file_range(src_fobj.fileno(), dst_fobj.fileno(),
+                                     remaining)
+            if not copied:
+                break
+            remaining -= copied
+
+
+def clone_file(src, dst, link=False):
+    """
+    Copy one regular file as cheaply as the filesystem allows: a hardlink if
+    `link` is set, then a reflink, then ``copy_file_range``, then a plain
+    copy. Returns the method that worked.
+
+    :param src: the file to copy
+    :param dst: where to copy it to, which must not exist
+    :param link: allow hardlinking, only safe if nothing will modify either
+        file in place
+    """
+    if link:
+        try:
+            os.link(src, dst)
+            return 'hardlink'
+        except OSError as exc:
+            if exc.errno not in _UNSUPPORTED:
+                raise
+
+    for method, copier in (('reflink', _reflink),
+                           ('copy_file_range', _copy_file_range)):
+        try:
+            copier(src, dst)
+        except (IOError, OSError) as exc:
+            if exc.errno not in _UNSUPPORTED:
+                raise
+        else:
+            shutil.copymode(src, dst)
+            return method
+
+    shutil.copyfile(src, dst)
+    shutil.copymode(src, dst)
+    return 'copy'
+
+
+def is_excluded(relative_path, patterns):
+    """
+    Does a path match any of the exclude `patterns`? Patterns are matched
+    against both the full relative path and the file name, so ``*.pyc`` and
+    ``docs/*.rst`` both work.
+
+    :param relative_path: the path relative to the top of the tree
+    :param patterns: glob patterns
+    """
+    name = path.basename(relative_path)
+    return any(fnmatch.fnmatch(name, pattern) or
+               fnmatch.fnmatch(relative_path, pattern)
+               for pattern in patterns)
+
+
+def _scan_dir(src, relative_dir, exclude):
+    directories = []
+    files = []
+    links = []
+    for entry in os.scandir(path.join(src, relative_dir)):
+        relative_path = path.join(relative_dir, entry.name)
+        if is_excluded(relative_path, exclude):
+            continue
+        if entry.is_symlink():
+            links.append((relative_path, os.readlink(entry.path)))
+        elif entry.is_dir():
+            directories.append(relative_path)
+        elif entry.is_file():
+            files.append(relative_path)
+    return directories, files, links
+
+
+def walk_tree(src, exclude=(), workers=None):
+    """
+    Walk `src` with ``os.scandir`` without descending into excluded
+    directories. Returns lists of relative directory paths, relative regular
+    file paths and ``(relative path, target)`` for symlinks. Parents always
+    come before their children.
+
+    :param src: the directory to walk
+    :param exclude: glob patterns to leave out
+    :param workers: the number of threads to scan directories with, for big
+        trees on storage that's faster with several requests in flight. The
+        order of the results varies when it's more than one.
+    """
+    directories = []
+    files = []
+    links = []
+
+    def _add(result):
+        directories.extend(result[0])
+        files.extend(result[1])
+        links.extend(result[2])
+        return result[0]
+
+    if not workers or workers == 1:
+        pending = ['']
+        while pending:
+            pending.extend(_add(_scan_dir(src, pending.pop(), exclude)))
+        return directories, files, links
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = set([executor.submit(_scan_dir, src, '', exclude)])
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                pending.update(executor.submit(_scan_dir, src, relative_dir,
+                                               exclude)
+                               for relative_dir in _add(future.result()))
+    return directories, files, links
+
+
+def copy_tree(src, dst, exclude=COMPILED_PATTERNS, link=False, workers=None):
+    """
+    Copy the directory `src` to `dst` without ever changing `src`. Excluded
+    files are filtered out during the walk, symlinks are copied as symlinks
+    and files are copied in parallel with `clone_file`. Returns the number of
+    files copied.
+
+    :param src: the directory to copy
+    :param dst: where to copy it to
+    :param exclude: glob patterns to leave out, see `is_excluded`
+    :param link: allow hardlinking files, see `clone_file`
+    :param workers: the number of threads to copy files with
+    """
+    directories, files, links = walk_tree(src, exclude)
+
+    if not path.isdir(dst):
+        os.makedirs(dst)
+    shutil.copymode(src, dst)
+    # parents always come before their children in the walk
+    for relative_path in directories:
+        target = path.join(dst, relative_path)
+        if not path.isdir(target):
+            os.mkdir(target)
+        shutil.copymode(path.join(src, relative_path), target)
+
+    for relative_path, link_target in links:
+        target = path.join(dst, relative_path)
+        if path.lexists(target):
+            os.unlink(target)
+        os.symlink(link_target, target)
+
+    def _copy(relative_path):
+        target = path.join(dst, relative_path)
+        if path.lexists(target):
+            os.unlink(target)
+        return clone_file(path.join(src, relative_path), target, link)
+
+    with ThreadPoolExecutor(max_workers=workers or min(32, len(files) or 1)) \
+            as executor:
+        methods = list(executor.map(_copy, files))
+
+    logger.debug('copied %d files from %s to %s (%s)', len(files), src, dst,
+                 ', '.join('{} {}'.format(methods.count(method), method)
+                           for method in sorted(set(methods))))
+    return len(files)
@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import ast
+import hashlib
+import io
+import logging
+import re
+from os import path
+
+try:
+    from configparser import RawConfigParser
+except ImportError:  # python 2
+    from ConfigParser import RawConfigParser
+
+try:
+    import tomllib
+except ImportError:
+    try:
+        import tomli as tomllib
+    except ImportError:
+        tomllib = None
+
+logger = logging.getLogger(__name__)
+
+# {setup.py path: (version, {file it was read from: sha256 of that file})}
+_cache = {}
+
+# versions setuptools leaves as they are, see PEP 440. Anything else (e.g.
+# 1.0-beta, which becomes 1.0b0) is left to setuptools to normalize.
+CANONICAL_VERSION_RE = re.compile(
+    r'^([1-9][0-9]*!)?(0|[1-9][0-9]*)(\.(0|[1-9][0-9]*))*'
+    r'((a|b|rc)(0|[1-9][0-9]*))?(\.post(0|[1-9][0-9]*))?'
+    r'(\.dev(0|[1-9][0-9]*))?(\+[a-z0-9]+(\.[a-z0-9]+)*)?$')
+
+
+def _read(file_path):
+    with io.open(file_path, 'rb') as fobj:
+        return fobj.read()
+
+
+def _hash(file_path):
+    if not path.isfile(file_path):
+        return None
+    return hashlib.sha256(_read(file_path)).hexdigest()
+
+
+def _string_value(node):
+    """
+    The value of an ast node if it's a string literal, otherwise None
+    """
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return node.value
+    if isinstance(node, getattr(ast, 'Str', ())):  # python 2
+        return node.s
+    return None
+
+
+def _module_assignments(tree, name):
+    """
+    The values assigned to `name` at the top level of a module
+    """
+    values = []
+    for node in tree.body:
+        if isinstance(node, ast.Assign):
+            targets = [target.id for target in node.targets
+                       if isinstance(target, ast.Name)]
+            if name in targets:
+                values.append(node.value)
+    return values
+
+
+def _version_from_module(module_path):
+    """
+    Read a literal ``__version__ = '...'`` from a module, returning the
+    version and the file it came from, or (None, None).
+    """
+    if not path.isfile(module_path):
+        return None, None
+    try:
+        tree = ast.parse(_read(module_path), module_path)
+    except SyntaxError:
+        return None, None
+    values = _module_assignments(tree, '__version__')
+    if len(values) != 1:
+        return None, None
+    return _string_value(values[0]), module_path
+
+
+def _find_module(base_dir, dotted_name):
+    """
+    Find the source of an importable module in a project, in the top level or
+    in ``src/``.
+    """
+    relative = dotted_name.replace('.', path.sep)
+    for root in (base_dir, path.join(base_dir, 'src')):
+        for candidate in (path.join(root, relative, '__init__.py'),
+                          path.join(root, relative + '.py')):
+            if path.isfile(candidate):
+                return candidate
+    return None
+
+
+def _version_from_import(base_dir, module_name):
+    module_path = _find_module(base_dir, module_name)
+    if module_path is None:
+        return None, None
+    return _version_from_module(module_path)
+
+
+def _resolve_version_node(node, tree, base_dir):
+    """
+    Work out the value of the ``version=`` passed to ``setup()`` without
+    running anything. Returns (version, file it came from) or (None, None)
+    if it can't be known for sure.
+    """
+    value = _string_value(node)
+    if value is not None:
+        return value, None
+
+    if isinstance(node, ast.Name):
+        assignments = _module_assignments(tree, node.id)
+        if len(assignments) == 1:
+            return _resolve_version_node(assignments[0], tree, base_dir)
+        if assignments:
+            return None, None
+        # from package import __version__ [as name]
+        for statement in tree.body:
+            if isinstance(statement, ast.ImportFrom) and statement.module:
+                for alias in statement.names:
+                    if (alias.asname or alias.name) == node.id and \
+                            alias.name == '__version__':
+                        return _version_from_import(base_dir,
+                                                    statement.module)
+        return None, None
+
+    # package.__version__
+    if isinstance(node, ast.Attribute) and node.attr == '__version__' and \
+            isinstance(node.value, ast.Name):
+        return _version_from_import(base_dir, node.value.id)
+
+    return None, None
+
+
+def _find_setup_call(tree):
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.Call):
+            continue
+        func = node.func
+        name = getattr(func, 'id', None) or getattr(func, 'attr', None)
+        if name == 'setup':
+            return node
+    return None
+
+
+def _version_from_setup_py(setup_py_path):
+    """
+    Returns (version, file it came from, whether setup() could be getting it
+    from elsewhere)
+    """
+    try:
+        tree = ast.parse(_read(setup_py_path), setup_py_path)
+    except (SyntaxError, IOError, OSError):
+        return None, None, False
+
+    call = _find_setup_call(tree)
+    if call is None:
+        return None, None, False
+
+    for keyword in call.keywords:
+        if keyword.arg == 'version':
+            version, source = _resolve_version_node(
+                keyword.value, tree, path.dirname(setup_py_path))
+            # setup.cfg and pyproject.toml don't count if setup.py has a
+            # version of its own, even one that can't be read statically
+            return version, source, version is None
+
+    # setup(**kwargs) could be passing the version in
+    has_kwargs = any(keyword.arg is None for keyword in call.keywords) or \
+        getattr(call, 'kwargs', None) is not None
+    return None, None, has_kwargs
+
+
+def _version_from_setup_cfg(setup_cfg_path):
+    if not path.isfile(setup_cfg_path):
+        return None, None
+    parser = RawConfigParser()
+    try:
+        parser.read(setup_cfg_path)
+        value = parser.get('metadata', 'version').strip()
+    except Exception:
+        return None, None
+
+    base_dir = path.dirname(setup_cfg_path)
+    if value.startswith('attr:'):
+        module, _, attribute = value[len('attr:'):].strip().rpartition('.')
+        if attribute != '__version__' or not module:
+            return None, None
+        return _version_from_import(base_dir, module)
+    if value.startswith('file:'):
+        version_file = path.join(base_dir, value[len('file:'):].strip())
+        if ',' in version_file or not path.isfile(version_file):
+            return None, None
+        return _read(version_file).decode('utf-8').strip(), version_file
+    return value, setup_cfg_path
+
+
+def _version_from_pyproject(pyproject_path):
+    if tomllib is None or not path.isfile(pyproject_path):
+        return None, None
+    try:
+        project = tomllib.loads(_read(pyproject_path).decode('utf-8')).get(
+            'project', {})
+    except Exception:
+        return None, None
+    if 'version' in project.get('dynamic', []):
+        return None, None
+    version = project.get('version')
+    if not isinstance(version, str):
+        return None, None
+    return version, pyproject_path
+
+
+def get_static_version(setup_py_path):
+    """
+    Read the project version next to `setup_py_path` without running
+    anything: from the ``setup()`` call (a literal, a module level constant or
+    a package's ``__version__``), then ``setup.cfg``, then
+    ``pyproject.toml``. Returns (version, files it depends on), or
+    (None, None) if it can't be known for sure or setuptools would
+    normalize it.
+
+    :param setup_py_path: the path to setup.py
+    """
+    base_dir = path.dirname(setup_py_path)
+    version, source, ambiguous = _version_from_setup_py(setup_py_path)
+    if version is None and not ambiguous:
+        for reader, file_name in ((_version_from_setup_cfg, 'setup.cfg'),
+                                  (_version_from_pyproject, 'pyproject.toml')):
+            version, source = reader(path.join(base_dir, file_name))
+            if version:
+                break
+
+    if not version:
+        return None, None
+    if not CANONICAL_VERSION_RE.match(version):
+        logger.debug('%s is not a normalized version, leaving it to '
+                     'setuptools', version)
+        return None, None
+
+    sources = set([setup_py_path, path.join(base_dir, 'setup.cfg'),
+                   path.join(base_dir, 'pyproject.toml')])
+    if source:
+        sources.add(source)
+    return version, sources
+
+
+def get_cached_version(setup_py_path):
+    """
+    A version previously read by `read_version`, if none of the files it was
+    read from changed since.
+
+    :param setup_py_path: the path to setup.py
+    """
+    version, hashes = _cache.get(setup_py_path, (None, {}))
+    if version is None:
+        return None
+    if any(_hash(source) != digest for source, digest in hashes.items()):
+        return None
+    return version
+
+
+def read_version(setup_py_path):
+    """
+    Get the version statically (see `get_static_version`), remembering it
+    against the hashes of the files it came from. Returns None if it has to be
+    found by running setup.py.
+
+    :param setup_py_path: the path to setup.py
+    """
+    version = get_cached_version(setup_py_path)
+    if version is not None:
+        return version
+
+    version, sources = get_static_version(setup_py_path)
+    if version is None:
+        logger.debug("couldn't read the version from %s statically",
+                     setup_py_path)
+        return None
+
+    _cache[setup_py_path] = (version, dict((source, _hash(source))
+                                           for source in sources))
+    return version
@@ -1,15 +1,26 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 import logging
+import os
+import re
+import shutil
 import sys
 from os import path
 from pipes import quote
 
-# this is to more easily mock for unittest
-import invoke
+from ship_it import runner
+from ship_it.relocate import relocate_virtualenv
+from ship_it.timing import stage, timed
+from ship_it.tree import COMPILED_PATTERNS, copy_tree
+from ship_it.requirements import (read_requirement_lines, parse_pinned,
+                                  parse_freeze, split_local)
 
 logger = logging.getLogger(__name__)
 
+# how compileall reports each file it can't compile
+COMPILE_ERROR_RE = re.compile(r"^\*\*\* Error compiling '(.+)'\.\.\.$",
+                              re.MULTILINE)
+
 def _quote_and_vlidate_file(filepath):
     """
     Checking that the file exists, is absolute, and is a file.
@@ -34,16 +45,74 @@ def get_virtualenv():
     assert sys.executable, "can't infer python executable path"
     return '{} -m virtualenv'.format(quote(sys.executable))
 
+def create_virtualenv(virtualenv_path, upgrade_pip=False, upgrade_wheel=False):
+    """
+    Make a new virtualenv, optionally upgrading pip and wheel in it
+
+    :param virtualenv_path: the path to the virtualenv we're going to make
+    :param upgrade_pip: upgrade pip after building virtualenv
+    :param upgrade_wheel: upgrade wheel after building virtualenv
+    """
+    quoted_path = _quote_and_validate_dir(virtualenv_path)
+    with stage('create virtualenv'):
+        runner.run('{virtualenv} {location}'.format(
+            virtualenv=get_virtualenv(), location=quoted_path))
+
+    if upgrade_pip:
+        with stage('upgrade pip'):
+            runner.run('{pip} install --upgrade pip'
+                       ''.format(pip=quote(path.join(virtualenv_path,
+                                                     'bin', 'pip'))))
+
+    if upgrade_wheel:
+        with stage('upgrade wheel'):
+            runner.run('{pip} install --upgrade wheel'
+                       ''.format(pip=quote(path.join(virtualenv_path,
+                                                     'bin', 'pip'))))
+
 class VirtualEnvPackager(object):
 
-    def __init__(self, virtualenv_path, upgrade_pip=False, upgrade_wheel=False):
+    # distributions the incremental sync never uninstalls
+    PROTECTED_DISTRIBUTIONS = frozenset(['pip', 'setuptools', 'wheel',
+                                         'distribute'])
+
+    def __init__(self, virtualenv_path, upgrade_pip=False, upgrade_wheel=False,
+                 build=True, incremental=False, wheelhouse=None,
+                 template=None, lock_file=None, require_hashes=False):
         """
         :param virtualenv_path: the path to the virtualenv we're going to make
         :param upgrade_pip: upgrade pip after building virtualenv
         :param upgrade_wheel: upgrade wheel after building virtualenv
+        :param build: build the virtualenv, set to False to wrap one that
+            already exists (e.g. restored from the cache)
+        :param incremental: keep an existing virtualenv and only install the
+            requirements that changed since it was built
+        :param wheelhouse: a `ship_it.wheelhouse.Wheelhouse` to build and
+            install requirements from
+        :param template: a `ship_it.template.VirtualEnvTemplates` to clone
+            the new virtualenv from instead of creating it
+        :param lock_file: a lock file from ``ship_it lock`` to install
+            requirements from, without pip resolving their dependencies
+        :param require_hashes: have pip check everything installed from the
+            lock file against its hashes
         """
         self.virtualenv_path = virtualenv_path
-        self.build_virtualenv(virtualenv_path, upgrade_pip, upgrade_wheel)
+        self.incremental = incremental
+        self.wheelhouse = wheelhouse
+        self.template = template
+        self.lock_file = lock_file
+        self.require_hashes = require_hashes
+        self.reused = False
+        if build:
+            self.build_virtualenv(virtualenv_path, upgrade_pip, upgrade_wheel)
+
+    @property
+    def requirements_state_path(self):
+        """
+        Where the requirements an incremental virtualenv was last synced to
+        are kept. It lives next to the virtualenv so it never gets packaged.
+        """
+        return '{}.requirements.txt'.format(self.virtualenv_path.rstrip('/'))
 
     def build_virtualenv(self, virtualenv_path, upgrade_pip, upgrade_wheel):
         """
@@ -53,34 +122,49 @@ class VirtualEnvPackager(object):
         """
         quoted_path = _quote_and_validate_dir(virtualenv_path)
 
-        if path.exists(virtualenv_path):
-            invoke.run('rm -rf {}'.format(quoted_path))
+        if self.incremental and path.exists(path.join(virtualenv_path,
+                                                      'bin', 'python')):
+            logger.info('reusing existing virtualenv %s', virtualenv_path)
+            self.reused = True
+            return
 
-        invoke.run('{virtualenv} {location}'.format(virtualenv=get_virtualenv(),
-                                                    location=quoted_path))
-        if upgrade_pip:
-            invoke.run('{pip} install --upgrade pip'
-                       ''.format(pip=quote(path.join(virtualenv_path,
-                                                     'bin', 'pip'))))
+        if self.template is not None:
+            with stage('clone template'):
+                self.template.clone(virtualenv_path, upgrade_pip,
+                                    upgrade_wheel)
+            return
 
-        if upgrade_wheel:
-            invoke.run('{pip} install --upgrade wheel'
-                       ''.format(pip=quote(path.join(virtualenv_path,
-                                                     'bin', 'pip'))))
+        if path.exists(virtualenv_path):
+            runner.run('rm -rf {}'.format(quoted_path))
+
+        create_virtualenv(virtualenv_path, upgrade_pip, upgrade_wheel)
 
-    def run_venv_command(self, command, arg_list):
+    def run_venv_command(self, command, arg_list, **run_kwargs):
         """
         Run a command in virtualenv's /bin/ folder
 
         :param command: the command to run
         :param arg_list: list of arguments passed to command
+        :param run_kwargs: extra keyword arguments for `ship_it.runner.run`
         """
         args = ' '.join(arg_list)
         command = quote(path.join(self.virtualenv_path,
                             'bin', command))
-        invoke.run('{command} {args}'.format(command=command,
-                                             args=args))
+        return runner.run('{command} {args}'.format(command=command,
+                                                    args=args), **run_kwargs)
 
+    def run_pip(self, arg_list, **run_kwargs):
+        """
+        Run pip through the virtualenv's python. Unlike ``bin/pip`` this
+        keeps working after the virtualenv was relocated.
+
+        :param arg_list: list of arguments passed to pip
+        :param run_kwargs: extra keyword arguments for `ship_it.runner.run`
+        """
+        return self.run_venv_command('python', ['-m', 'pip'] + list(arg_list),
+                                     **run_kwargs)
+
+    @timed('install package')
     def install_package(self, setup_py_path):
         """
         Run python setup.py install
@@ -94,61 +178,215 @@ class VirtualEnvPackager(object):
         # variables that we were invoked with (notably custom paths)
         self.run_venv_command('python', [setup_file, 'install'])
 
+    @property
+    def no_deps_args(self):
+        """
+        A lock file already lists every dependency, so pip needn't look for
+        any
+        """
+        return ['--no-deps'] if self.lock_file is not None else []
+
+    @timed('install requirements')
     def install_requirements(self, requirements_file_path):
         """
         Package installation is provided by requirements file. Usually
-        because '.' is included in requirements file.
+        because '.' is included in requirements file. With a lock file, that
+        is installed instead.
 
         :param requirements_file_path: the path to the requirements.txt file
         """
         req_file = _quote_and_vlidate_file(requirements_file_path)
-        self.run_venv_command('pip', ['install', '-r', req_file])
+        if self.lock_file is not None:
+            requirements_file_path = self.lock_file
+        if self.reused:
+            self.sync_requirements(requirements_file_path)
+        else:
+            if self.wheelhouse is not None:
+                self.wheelhouse.install_requirements(
+                    self, requirements_file_path,
+                    no_deps=self.lock_file is not None,
+                    require_hashes=self.require_hashes)
+            elif self.lock_file is not None:
+                self.install_lock_file(requirements_file_path)
+            else:
+                self.run_venv_command('pip', ['install', '-r', req_file])
+            if self.incremental:
+                shutil.copyfile(requirements_file_path,
+                                self.requirements_state_path)
 
+    def install_lock_file(self, lock_file_path):
+        """
+        Install everything in a lock file exactly as it's pinned, without
+        pip resolving anything. Local requirements (``.``, paths, ``-e``)
+        have no hash, so they're installed separately.
+
+        :param lock_file_path: a lock file from ``ship_it lock``
+        """
+        remote, local = split_local(read_requirement_lines(lock_file_path),
+                                    path.dirname(lock_file_path))
+        if remote:
+            remote_file = '{}.lock.txt'.format(self.virtualenv_path.rstrip('/'))
+            with open(remote_file, 'w') as fobj:
+                fobj.write('\n'.join(remote) + '\n')
+            try:
+                self.run_venv_command('pip', [
+                    'install', '--no-deps'
+                ] + (['--require-hashes'] if self.require_hashes else []) +
+                    ['-r', quote(remote_file)])
+            finally:
+                os.remove(remote_file)
+        if local:
+            self.run_venv_command('pip', ['install', '--no-deps'] + local)
+
+    @timed('sync requirements')
+    def sync_requirements(self, requirements_file_path):
+        """
+        Bring a reused virtualenv in line with a requirements file by only
+        uninstalling, upgrading or installing the distributions that differ.
+        Pinned (``name==version``) requirements are compared against what's
+        installed, anything else is handed to pip, which skips requirements
+        that are already satisfied.
+
+        :param requirements_file_path: the path to the requirements.txt file
+        """
+        req_file = _quote_and_vlidate_file(requirements_file_path)
+        wanted, unpinned = parse_pinned(
+            read_requirement_lines(requirements_file_path))
+
+        previous = {}
+        if path.isfile(self.requirements_state_path):
+            previous, _ = parse_pinned(
+                read_requirement_lines(self.requirements_state_path))
+
+        installed = parse_freeze(
+            self.run_pip(['freeze'], hide=True).stdout)
+
+        # Only drop what we installed for a previous requirements file, as
+        # anything else may be a dependency of something we still want.
+        to_uninstall = sorted(
+            name for name in previous
+            if name not in wanted and name in installed
+            and name not in self.PROTECTED_DISTRIBUTIONS)
+        to_install = sorted(
+            '{}=={}'.format(*wanted[name]) for name in wanted
+            if installed.get(name) != wanted[name][1])
+
+        logger.info('incremental sync: %d to uninstall, %d to install',
+                    len(to_uninstall), len(to_install))
+        if to_uninstall:
+            self.run_pip(['uninstall', '-y'] + [quote(name)
+                                                for name in to_uninstall])
+        find_links = (self.wheelhouse.find_links_args
+                      if self.wheelhouse is not None else [])
+        if to_install:
+            self.run_pip(['install'] + self.no_deps_args + find_links +
+                         [quote(spec) for spec in to_install])
+        if unpinned and self.lock_file is not None:
+            # the lock file's hashes would have pip insist on them for these
+            self.run_pip(['install', '--no-deps'] + find_links + unpinned)
+        elif unpinned:
+            self.run_pip(['install'] + find_links + ['-r', req_file])
+
+        shutil.copyfile(requirements_file_path, self.requirements_state_path)
+
+    @timed('pip install package')
     def pip_install_package(self, requirements_file_path):
         """
         Install local package from '.' using pip. Installs requirements from
         requirements_file_path first.
 
+        Its dependencies are still resolved, even with a lock file: those
+        that were locked are already installed by then, and anything
+        setup.py has asked for since is installed rather than left out.
+
         :param requirements_file_path: the path to the requirements.txt file
         """
         self.install_requirements(requirements_file_path)
-        self.run_venv_command('pip', ['install', '.'])
+        if self.reused:
+            self.run_pip(['install', '--force-reinstall', '--no-deps', '.'])
+        elif self.wheelhouse is not None:
+            self.run_venv_command('pip', ['install'] +
+                                  self.wheelhouse.find_links_args + ['.'])
+        else:
+            self.run_venv_command('pip', ['install', '.'])
 
-    def copy_package(self, requirements_file_path, package_path):
+    @timed('copy package')
+    def copy_package(self, requirements_file_path, package_path, exclude=()):
         """
         :param requirements_file_path: the path to the requirements.txt file
         :param package_path: the path to the package we're going to copy into
             the virtualenv
+        :param exclude: glob patterns for files to leave out, on top of
+            compiled bytecode
         """
-        req_file = _quote_and_vlidate_file(requirements_file_path)
-        pkg_path = _quote_and_validate_dir(package_path)
+        _quote_and_vlidate_file(requirements_file_path)
+        _quote_and_validate_dir(package_path)
 
-        self.run_venv_command('pip', ['install', '-r', req_file])
+        self.install_requirements(requirements_file_path)
 
-        invoke.run('find {pkg} -type f -name "*.py[co]" -delete;'
-                   'find {pkg} -type d -name "__pycache__" -delete'.format(
-                    pkg=pkg_path))
-        invoke.run('cp -r {} {}'.format(quote(package_path.rstrip('/')),
-                                        quote(self.virtualenv_path)))
+        package_path = package_path.rstrip('/')
+        copied_path = path.join(self.virtualenv_path,
+                                path.basename(package_path))
+        if self.reused and path.exists(copied_path):
+            # don't leave files removed from the package behind
+            shutil.rmtree(copied_path)
 
-    def patch_virtualenv(self, destination_path):
+        copy_tree(package_path, copied_path,
+                  exclude=COMPILED_PATTERNS + tuple(exclude))
+
+    @timed('precompile')
+    def precompile(self, destination_path, optimize_levels=(0,),
+                   invalidation_mode='checked-hash'):
         """
-        Patch the virtualenv we built to be relocatable and
+        Compile everything in the virtualenv to bytecode with a process pool,
+        so it isn't done on first start on every host. Source paths in the
+        bytecode point at `destination_path`, and hash-based invalidation
+        keeps the output the same from build to build.
+
+        Files in site-packages that don't compile (e.g. python 2 only tests
+        or templates in a dependency) are logged and left as they are, as
+        pip does when installing them. Anything else that doesn't compile
+        fails the build.
 
         :param destination_path: the path you expect it to be in the resulting
             system
+        :param optimize_levels: the optimization levels to compile for
+        :param invalidation_mode: timestamp, checked-hash or unchecked-hash
         """
-        self.remove_prelink_if_applicable()
+        venv = _quote_and_validate_dir(self.virtualenv_path)
+        args = ['-m', 'compileall', '-q', '-f', '-j', '0',
+                '--invalidation-mode', quote(invalidation_mode)]
+        for level in optimize_levels:
+            args.extend(['-o', str(int(level))])
+        args.extend(['-s', venv, '-p', _quote_and_validate_dir(destination_path),
+                     venv])
+        # compileall carries on past errors, and with -q only prints those
+        try:
+            self.run_venv_command('python', args, hide=True)
+        except runner.CommandError as exc:
+            errors = exc.result.stdout
+            failed = COMPILE_ERROR_RE.findall(errors)
+            if not failed or any('{0}site-packages{0}'.format(path.sep)
+                                 not in file_path for file_path in failed):
+                raise runner.CommandError(exc.result._replace(
+                    tail=exc.result.tail + errors.splitlines(True)))
+            logger.warning("couldn't compile %d files in site-packages, "
+                           "leaving them as they are:\n%s", len(failed),
+                           errors.rstrip())
 
-        invoke.run('{virtualenv} --relocatable {local_path}'.format(
-            virtualenv=get_virtualenv(), local_path=quote(self.virtualenv_path)
-        ))
+    @timed('patch virtualenv')
+    def patch_virtualenv(self, destination_path):
+        """
+        Patch the virtualenv we built to work from `destination_path`
 
-        # the activate script isn't handled by doing --relocatable
-        invoke.run('sed -i "s:{local}:{dest}:" {local_activate}'.format(
-            local=self.virtualenv_path, dest=destination_path,
-            local_activate=quote(path.join(self.virtualenv_path, 'bin', 'activate'))))
+        :param destination_path: the path you expect it to be in the resulting
+            system
+        """
+        self.remove_prelink_if_applicable()
+        with stage('relocate'):
+            relocate_virtualenv(self.virtualenv_path, destination_path)
 
+    @timed('prelink')
     def remove_prelink_if_applicable(self):
         """
         Packaging a virtualenv has issues if you prelink the executables. Ideally,
@@ -156,7 +394,7 @@ class VirtualEnvPackager(object):
         it for our python.
         """
         try:
-            invoke.run('prelink -u {}'.format(quote(path.join(self.virtualenv_path,
+            runner.run('prelink -u {}'.format(quote(path.join(self.virtualenv_path,
                                                               'bin', 'python'))))
         except:
             # We're assuming that if it didn't work, then prelink must not be
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import os
+import platform
+import sys
+import sysconfig
+from os import path
+from pipes import quote
+
+from ship_it.requirements import (HASH_OPTION_RE, read_requirement_lines,
+                                  split_local)
+
+
+def get_abi_tag():
+    """
+    A tag for the running interpreter's ABI, so that wheels built for one
+    interpreter are never offered to another one.
+    """
+    implementation = {
+        'CPython': 'cp',
+        'PyPy': 'pp',
+    }.get(platform.python_implementation(),
+          platform.python_implementation().lower())
+    platform_tag = sysconfig.get_platform().replace('-', '_').replace('.', '_')
+    return '{}{}{}{}-{}'.format(implementation, sys.version_info[0],
+                                sys.version_info[1],
+                                getattr(sys, 'abiflags', ''), platform_tag)
+
+
+def _write_lines(file_path, lines):
+    with open(file_path, 'w') as fobj:
+        fobj.write('\n'.join(lines) + '\n')
+
+
+class Wheelhouse(object):
+    """
+    A directory of built wheels shared by every build on the host, with one
+    subdirectory per interpreter ABI.
+    """
+    def __init__(self, root):
+        """
+        :param root: the directory wheelhouses for all interpreters live in
+        """
+        assert path.isabs(root)
+        self.root = root
+        self.path = path.join(root, get_abi_tag())
+
+    @property
+    def find_links_args(self):
+        return ['--find-links', quote(self.path)]
+
+    def install_requirements(self, packager, requirements_file_path,
+                             no_deps=False, require_hashes=False):
+        """
+        Build wheels for any requirements that don't have one yet and install
+        them with `packager` without going to the index. Local requirements
+        (``.``, paths, ``-e``) are never put in the wheelhouse, they're
+        installed afterwards with the wheelhouse available for their
+        dependencies.
+
+        :param packager: the `VirtualEnvPackager` to install into
+        :param requirements_file_path: the path to the requirements.txt file
+        :param no_deps: don't install anything that isn't in the requirements
+            file, e.g. for a lock file
+        :param require_hashes: check downloads against the requirements'
+            hashes. Wheels built from source distributions have hashes of
+            their own, so only what's downloaded is checked.
+        """
+        # several builds can share a wheelhouse, so it may appear any time
+        os.makedirs(self.path, exist_ok=True)
+
+        remote, local = split_local(
+            read_requirement_lines(requirements_file_path),
+            path.dirname(requirements_file_path))
+
+        no_deps_args = ['--no-deps'] if no_deps else []
+        if remote:
+            remote_file = '{}.wheelhouse.txt'.format(
+                packager.virtualenv_path.rstrip('/'))
+            try:
+                _write_lines(remote_file, remote)
+                packager.run_venv_command('pip', [
+                    'wheel', '--wheel-dir', quote(self.path)
+                ] + no_deps_args + (['--require-hashes'] if require_hashes
+                                    else []) +
+                    self.find_links_args + ['-r', quote(remote_file)])
+                # the wheels built from source distributions won't match
+                _write_lines(remote_file, [HASH_OPTION_RE.sub('', line)
+                                           for line in remote])
+                packager.run_venv_command('pip', [
+                    'install', '--no-index'
+                ] + no_deps_args + self.find_links_args +
+                    ['-r', quote(remote_file)])
+            finally:
+                if path.exists(remote_file):
+                    os.remove(remote_file)
+
+        if local:
+            # keep '-e .' and friends as separate arguments
+            packager.run_venv_command(
+                'pip', ['install'] + no_deps_args + self.find_links_args +
+                local)
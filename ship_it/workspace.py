@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import errno
+import fcntl
+import logging
+import os
+import shutil
+import time
+import uuid
+from os import path
+
+from ship_it.manifest import WORK_DIR_NAME
+
+logger = logging.getLogger(__name__)
+
+
+class FileLock(object):
+    """
+    An exclusive ``flock`` on a file, which the OS releases if the process
+    holding it dies
+    """
+    def __init__(self, lock_path):
+        """
+        :param lock_path: the file to lock, created if needed
+        """
+        self.path = lock_path
+        self._fd = None
+
+    def acquire(self, blocking=True):
+        """
+        Take the lock, returning whether we got it. Waits for it unless
+        `blocking` is False.
+        """
+        while True:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX |
+                            (0 if blocking else fcntl.LOCK_NB))
+            except (IOError, OSError) as exc:
+                os.close(fd)
+                if exc.errno in (errno.EAGAIN, errno.EACCES):
+                    return False
+                raise
+            # whoever held it before may have removed the file, in which case
+            # we locked a file nobody else will ever see
+            try:
+                same_file = os.fstat(fd).st_ino == os.stat(self.path).st_ino
+            except OSError:
+                same_file = False
+            if same_file:
+                self._fd = fd
+                return True
+            os.close(fd)
+
+    def release(self, remove=False):
+        """
+        :param remove: remove the lock file too, only for locks nobody else
+            will want again
+        """
+        if self._fd is None:
+            return
+        if remove and path.exists(self.path):
+            os.unlink(self.path)
+        os.close(self._fd)
+        self._fd = None
+
+    def __enter__(self):
+        if not self.acquire(blocking=False):
+            logger.info('waiting for %s', self.path)
+            self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+def clean_work_dirs(work_root):
+    """
+    Remove the directories of isolated builds that are no longer running,
+    i.e. whose lock nobody holds.
+
+    :param work_root: the directory isolated builds have their directories in
+    """
+    if not path.isdir(work_root):
+        return
+    for name in os.listdir(work_root):
+        if not name.endswith('.lock'):
+            continue
+        lock = FileLock(path.join(work_root, name))
+        if not lock.acquire(blocking=False):
+            continue
+        logger.info('removing the leftovers of build %s', name[:-5])
+        shutil.rmtree(path.join(work_root, name[:-5]), ignore_errors=True)
+        lock.release(remove=True)
+
+    # anything without a lock was abandoned part way through being removed
+    for name in os.listdir(work_root):
+        entry = path.join(work_root, name)
+        if path.isdir(entry) and not path.exists('{}.lock'.format(entry)):
+            shutil.rmtree(entry, ignore_errors=True)
+
+
+class BuildWorkspace(object):
+    """
+    Coordinates builds of the same manifest in one checkout.
+
+    A normal build uses ``build/`` next to the manifest and holds the
+    manifest's lock for the whole build, so concurrent builds wait for each
+    other rather than removing each other's virtualenv.
+
+    An isolated build gets its own directory in ``build/.work``, so any
+    number can run at once. The finished virtualenv is moved to
+    ``build/<virtualenv_name>`` under the lock, and the private directory is
+    removed afterwards. Directories left behind by builds that died are
+    cleaned up by later ones.
+    """
+    def __init__(self, manifest, isolated=False):
+        """
+        :param manifest: the manifest being built, its `build_id` is set for
+            an isolated build
+        :param isolated: give the build its own directory
+        """
+        self.manifest = manifest
+        self.isolated = isolated
+        self.lock = FileLock(path.join(
+            manifest.shared_build_dir,
+            '.{}.lock'.format(manifest.virtualenv_name)))
+        self.work_lock = None
+
+    @property
+    def work_root(self):
+        return path.join(self.manifest.shared_build_dir, WORK_DIR_NAME)
+
+    def __enter__(self):
+        if not path.isdir(self.manifest.shared_build_dir):
+            os.makedirs(self.manifest.shared_build_dir)
+
+        if not self.isolated:
+            self.lock.__enter__()
+            return self
+
+        clean_work_dirs(self.work_root)
+        if not path.isdir(self.work_root):
+            os.makedirs(self.work_root)
+        # the lock is taken before the directory exists, so the directory is
+        # never cleaned up from under us
+        build_id = '{}-{}'.format(int(time.time()), uuid.uuid4().hex[:12])
+        self.work_lock = FileLock(path.join(self.work_root,
+                                            '{}.lock'.format(build_id)))
+        self.work_lock.acquire()
+        self.manifest.build_id = build_id
+        os.makedirs(self.manifest.build_dir)
+        logger.debug('building %s in %s', self.manifest.path,
+                     self.manifest.build_dir)
+        return self
+
+    def promote(self):
+        """
+        Move an isolated build's virtualenv to where a normal build would
+        have left it, replacing whatever is there.
+        """
+        if not self.isolated:
+            return
+        source = self.manifest.local_virtualenv_path
+        if not path.isdir(source):
+            return
+        target = path.join(self.manifest.shared_build_dir,
+                           self.manifest.virtualenv_name)
+        trash = None
+        with self.lock:
+            if path.lexists(target):
+                trash = path.join(self.manifest.build_dir, 'replaced')
+                os.rename(target, trash)
+            os.rename(source, target)
+        if trash:
+            shutil.rmtree(trash, ignore_errors=True)
+        logger.info('moved the finished virtualenv to %s', target)
+
+    def __exit__(self, *exc_info):
+        if not self.isolated:
+            self.lock.__exit__(*exc_info)
+            return
+
+        shutil.rmtree(self.manifest.build_dir, ignore_errors=True)
+        self.work_lock.release(remove=True)
+        self.manifest.build_id = None
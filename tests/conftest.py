@@ -4,7 +4,7 @@ from __future__ import unicode_literals
 import mock
 import pytest
 
-import invoke
+from ship_it import runner
 from ship_it.manifest import Manifest
 
 
@@ -15,7 +15,16 @@ def mock_local():
 
 @pytest.fixture(autouse=True)
 def patch_local(monkeypatch, mock_local):
-    monkeypatch.setattr(invoke, 'run', mock_local)
+    monkeypatch.setattr(runner, 'run', mock_local)
+
+
+@pytest.fixture(autouse=True)
+def patch_workspace(monkeypatch):
+    """
+    Builds of the fake manifests below mustn't create or lock anything next
+    to them. Tests of the real workspace import it before this runs.
+    """
+    monkeypatch.setattr('ship_it.workspace.BuildWorkspace', mock.MagicMock())
 
 
 @pytest.fixture
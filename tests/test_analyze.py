@@ -0,0 +1,80 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import os
+
+import pytest
+
+from ship_it import analyze
+from ship_it.manifest import Manifest
+
+
+@pytest.fixture
+def manifest(tmpdir):
+    venv = tmpdir.join('build', 'ship_it')
+    site_packages = venv.join('lib', 'python3.6', 'site-packages')
+    site_packages.join('six.py').write('x' * 100, ensure=True)
+    site_packages.join('__pycache__', 'six.cpython-36.pyc').write(
+        'c' * 50, ensure=True)
+    site_packages.join('six-1.0.dist-info', 'RECORD').write(
+        'six.py,sha256=abc,100\n'
+        'six-1.0.dist-info/RECORD,,\n'
+        '../../../bin/six,sha256=def,10\n', ensure=True)
+    site_packages.join('yaml', '__init__.py').write('y' * 30, ensure=True)
+    site_packages.join('PyYAML-3.11-py3.6.egg-info',
+                       'installed-files.txt').write(
+        '../yaml/__init__.py\n', ensure=True)
+    venv.join('bin', 'six').write('s' * 10, ensure=True)
+    venv.join('bin', 'python').write('p' * 1000)
+    tmpdir.join('settings.cfg').write('[settings]')
+    tmpdir.join('content', 'index.html').write('<html>', ensure=True)
+    return Manifest(str(tmpdir.join('manifest.yaml')), manifest_contents=dict(
+        name='ship_it',
+        config_files={'/etc/ship_it/settings.cfg': 'settings.cfg'},
+        extra_files={'/srv/www/content': 'content/'},
+    ))
+
+
+def test_analyze_package(manifest):
+    analysis = analyze.analyze_package(manifest, workers=2)
+
+    assert analysis.by_owner == {
+        'six-1.0': [100 + 50 + 10 + len('six.py,sha256=abc,100\n'
+                                        'six-1.0.dist-info/RECORD,,\n'
+                                        '../../../bin/six,sha256=def,10\n'),
+                    4],
+        'PyYAML-3.11-py3.6': [30 + len('../yaml/__init__.py\n'), 2],
+        analyze.OTHER_FILES: [1000, 1],
+        analyze.CONFIG_FILES: [len('[settings]'), 1],
+        analyze.EXTRA_FILES: [len('<html>'), 1],
+    }
+    assert analysis.total_files == 9
+    assert analysis.top(1) == [(analyze.OTHER_FILES, 1000, 1)]
+    assert analysis.format(2).splitlines()[:2] == [
+        'ship_it: 1.3KiB in 9 files',
+        '  (other virtualenv files)      1000B       1 files']
+
+
+def test_hardlinks_count_once(manifest, tmpdir):
+    venv = tmpdir.join('build', 'ship_it')
+    os.link(str(venv.join('bin', 'python')), str(venv.join('bin', 'python3')))
+    analysis = analyze.analyze_package(manifest)
+    assert analysis.by_owner[analyze.OTHER_FILES] == [1000, 2]
+
+
+@pytest.mark.parametrize('max_size, max_files, message', [
+    (None, None, None),
+    (100, None, 'over its size budget'),
+    (None, 1, 'over its file budget'),
+])
+def test_check_budgets(max_size, max_files, message):
+    analysis = analyze.PackageAnalysis('ship_it')
+    analysis.add('six', 60)
+    analysis.add('yaml', 50)
+    if message is None:
+        analysis.check_budgets(max_size, max_files)
+        return
+    with pytest.raises(analyze.BudgetExceeded) as exc_info:
+        analysis.check_budgets(max_size, max_files)
+    assert message in str(exc_info.value)
+    assert 'six (60B), yaml (50B)' in str(exc_info.value)
@@ -0,0 +1,105 @@
+# coding=utf-8
+from __future__ import unicode_literals
+import multiprocessing
+import os
+
+import pytest
+from six import StringIO
+
+import ship_it
+from ship_it.batch import (_build_one, find_manifests, build_many,
+                           expand_documents)
+
+
+def test_find_manifests(tmpdir):
+    tmpdir.join('svc_a', 'manifest.yaml').ensure()
+    tmpdir.join('svc_b', 'nested', 'manifest.yml').ensure()
+    tmpdir.join('svc_b', 'build', 'manifest.yaml').ensure()
+    tmpdir.join('.git', 'manifest.yaml').ensure()
+    single = tmpdir.join('other.yaml').ensure()
+
+    assert find_manifests([str(tmpdir), str(single),
+                           str(tmpdir.join('svc_a'))]) == [
+        str(tmpdir.join('svc_a', 'manifest.yaml')),
+        str(tmpdir.join('svc_b', 'nested', 'manifest.yml')),
+        str(single),
+    ]
+
+
+def test_failures_are_reported(tmpdir):
+    missing = [str(tmpdir.join(name, 'manifest.yaml'))
+               for name in ('svc_a', 'svc_b')]
+    output = StringIO()
+    results = build_many(missing, jobs=2, log_dir=str(tmpdir.join('logs')),
+                         output=output)
+
+    assert [result.manifest_path for result in results] == missing
+    assert not any(result.success for result in results)
+    for result in results:
+        with open(result.log_path) as log:
+            assert 'Traceback' in log.read()
+    assert '0 built, 2 failed' in output.getvalue()
+
+
+def _fake_fpm(manifest_path, **options):
+    print('building {} with {}'.format(manifest_path, sorted(options)))
+    if 'bad' in manifest_path:
+        raise ValueError('nope')
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != 'fork',
+                    reason='workers only see the patched fpm when forked')
+def test_output_is_grouped_per_manifest(tmpdir, monkeypatch):
+    monkeypatch.setattr(ship_it, 'fpm', _fake_fpm)
+    output = StringIO()
+    results = build_many(['/good/manifest.yaml', '/bad/manifest.yaml'],
+                         log_dir=str(tmpdir), output=output, cache_dir=None)
+
+    assert [result.success for result in results] == [True, False]
+    assert results[1].error == 'ValueError: nope'
+    text = output.getvalue()
+    assert ('==> /good/manifest.yaml (ok, ' in text and
+            "building /good/manifest.yaml with ['cache_dir']" in text)
+    assert '  FAILED  /bad/manifest.yaml (ValueError: nope)' in text
+
+
+def test_output_is_restored_after_each_build(tmpdir, monkeypatch, capfd):
+    def fake_fpm(manifest_path, **options):
+        os.write(1, b'from a subprocess\n')
+    monkeypatch.setattr(ship_it, 'fpm', fake_fpm)
+    log_path = str(tmpdir.join('one.log'))
+
+    assert _build_one('/one/manifest.yaml', None, log_path, {}).success
+    os.write(1, b'between builds\n')
+
+    assert tmpdir.join('one.log').read() == 'from a subprocess\n'
+    assert capfd.readouterr().out == 'between builds\n'
+
+
+def test_expand_documents(tmpdir):
+    single = tmpdir.join('single.yaml')
+    single.write('name: one\n')
+    multiple = tmpdir.join('multiple.yaml')
+    multiple.write('name: one\n---\nname: two\n')
+    missing = str(tmpdir.join('missing.yaml'))
+
+    assert expand_documents([str(single), str(multiple), missing]) == [
+        (str(single), None), (str(multiple), 0), (str(multiple), 1),
+        (missing, None)]
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != 'fork',
+                    reason='workers only see the patched fpm when forked')
+def test_every_document_is_built(tmpdir, monkeypatch):
+    monkeypatch.setattr(ship_it, 'fpm', lambda manifest_path, **options:
+                        print(options))
+    multiple = tmpdir.join('manifest.yaml')
+    multiple.write('name: one\n---\nname: two\n')
+    output = StringIO()
+    results = build_many([str(multiple)], log_dir=str(tmpdir.join('logs')),
+                         output=output)
+
+    assert [(result.document, result.success) for result in results] == [
+        (0, True), (1, True)]
+    assert "{'document': 1}" in output.getvalue()
+    assert '  ok      {}[1]'.format(multiple) in output.getvalue()
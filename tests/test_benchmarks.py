@@ -0,0 +1,142 @@
+# coding=utf-8
+from __future__ import unicode_literals
+import io
+import json
+import os
+import sys
+import timeit
+
+import pytest
+
+from ship_it import cli
+from ship_it.manifest import Manifest
+
+__here__ = os.path.dirname(os.path.abspath(__file__))
+
+# the stored time per manifest entry of each benchmark, in microseconds, as
+# measured on one machine. Only compared against with SHIP_IT_BENCHMARKS=1,
+# and SHIP_IT_SAVE_BENCHMARKS=1 rewrites it from the current run.
+BASELINE_PATH = os.path.join(__here__, 'benchmarks.json')
+
+# how many times slower than its baseline a benchmark may get
+THRESHOLD = float(os.environ.get('SHIP_IT_BENCHMARK_THRESHOLD', 3))
+SAVE = bool(os.environ.get('SHIP_IT_SAVE_BENCHMARKS'))
+COMPARE = SAVE or bool(os.environ.get('SHIP_IT_BENCHMARKS'))
+
+# the number of config files, extra files, excludes and dependencies in
+# each synthetic manifest
+SIZES = (100, 1000, 5000)
+
+ROUNDS = 5
+# how long each round should take, so small manifests aren't all noise
+ROUND_SECONDS = 0.02
+
+
+def _synthetic_manifest(size):
+    return Manifest('/test_dir/manifest.yaml', manifest_contents=dict(
+        name='ship_it',
+        version='0.1.0',
+        iteration='1',
+        description='a manifest with {} of everything'.format(size),
+        compression='xz',
+        config_files={'/etc/ship_it/conf.d/{}.cfg'.format(i):
+                      'conf/settings {}.cfg'.format(i) for i in range(size)},
+        extra_files={'share/data/{}/file.dat'.format(i):
+                     'data/{}.dat'.format(i) for i in range(size)},
+        exclude=['*.skip{}'.format(i) for i in range(size)],
+        depends=['lib{} >= 1.{}'.format(i, i) for i in range(size)],
+    ))
+
+
+def _formatting(format_function):
+    def benchmark(manifest):
+        # only the formatting is timed, not working out the flags
+        args, flags = manifest.get_args_and_flags()
+        return lambda: format_function(args, flags)
+    return benchmark
+
+
+# what each benchmark times, given a manifest
+BENCHMARKS = {
+    'get_args_and_flags': lambda manifest: manifest.get_args_and_flags,
+    'get_config_args_and_flags':
+        lambda manifest: manifest.get_config_args_and_flags,
+    'get_extra_files_args': lambda manifest: manifest.get_extra_files_args,
+    'format_flags': _formatting(
+        lambda args, flags: list(cli.format_flags(flags))),
+    'get_command_line': _formatting(cli.get_command_line),
+}
+
+_measured = {}
+
+
+def _time_per_entry_us(name, size):
+    """
+    The best time of `ROUNDS` rounds of benchmark `name` over a manifest of
+    `size` entries, in microseconds per entry
+    """
+    if (name, size) not in _measured:
+        timer = timeit.Timer(BENCHMARKS[name](_synthetic_manifest(size)))
+        number = max(1, int(ROUND_SECONDS / max(timer.timeit(1), 1e-6)))
+        best = min(timer.repeat(repeat=ROUNDS, number=number)) / number
+        _measured[name, size] = best * 1e6 / size
+    return _measured[name, size]
+
+
+def _traced():
+    """
+    Whether a tracer such as coverage is slowing everything down
+    """
+    if sys.gettrace() is not None:
+        return True
+    monitoring = getattr(sys, 'monitoring', None)
+    return monitoring is not None and \
+        monitoring.get_tool(monitoring.COVERAGE_ID) is not None
+
+
+def _load_baseline():
+    try:
+        with io.open(BASELINE_PATH, encoding='utf-8') as fobj:
+            return json.load(fobj)
+    except IOError:
+        return {}
+
+
+@pytest.fixture(scope='module')
+def results():
+    results = {}
+    yield results
+    if SAVE and results:
+        baseline = _load_baseline()
+        for key, value in results.items():
+            baseline[key] = round(value, 3)
+        with io.open(BASELINE_PATH, 'w', encoding='utf-8') as fobj:
+            fobj.write(json.dumps(baseline, indent=2, sort_keys=True) + '\n')
+
+
+@pytest.mark.skipif(not COMPARE, reason='compares against timings from '
+                    'another machine, set SHIP_IT_BENCHMARKS=1 to run it')
+@pytest.mark.skipif(_traced(), reason="tracing skews the timings")
+@pytest.mark.parametrize('size', SIZES)
+@pytest.mark.parametrize('name', sorted(BENCHMARKS))
+def test_benchmark(results, name, size):
+    key = '{}[{}]'.format(name, size)
+    results[key] = measured = _time_per_entry_us(name, size)
+    baseline = _load_baseline().get(key)
+    if SAVE or baseline is None:
+        pytest.skip('{} for {}, measured {:.3f}us per entry'.format(
+            'saving a baseline' if SAVE else 'no baseline', key, measured))
+    assert measured <= baseline * THRESHOLD, (
+        '{} took {:.3f}us per entry, over {}x its {:.3f}us baseline '
+        '(SHIP_IT_BENCHMARK_THRESHOLD, SHIP_IT_SAVE_BENCHMARKS=1 to store '
+        'a new one)'.format(key, measured, THRESHOLD, baseline))
+
+
+@pytest.mark.parametrize('name', sorted(BENCHMARKS))
+def test_scales_linearly(name):
+    # relative to itself on the same machine, unlike the stored baseline
+    small = _time_per_entry_us(name, SIZES[0])
+    large = _time_per_entry_us(name, SIZES[-1])
+    assert large <= small * THRESHOLD, (
+        '{} took {:.3f}us per entry with {} entries but {:.3f}us with '
+        '{}'.format(name, large, SIZES[-1], small, SIZES[0]))
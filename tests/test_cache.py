@@ -0,0 +1,150 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import mock
+import pytest
+
+import ship_it
+from ship_it.cache import (PREFIX_FILE, VirtualEnvCache, get_cache_key,
+                            hash_tree)
+from ship_it.manifest import Manifest
+
+
+@pytest.fixture
+def project(tmpdir):
+    tmpdir.join('requirements.txt').write('six==1.7.3\n')
+    tmpdir.join('setup.py').write('from setuptools import setup\n')
+    tmpdir.join('ship_it').mkdir().join('__init__.py').write('')
+    return tmpdir
+
+
+@pytest.fixture
+def project_manifest(project):
+    return Manifest(str(project.join('manifest.yaml')),
+                    manifest_contents=dict(name='ship_it', version='0.1.0'))
+
+
+def _key(project, project_manifest):
+    return get_cache_key(project_manifest,
+                         str(project.join('requirements.txt')),
+                         str(project.join('setup.py')))
+
+
+def test_key_is_stable(project, project_manifest):
+    assert _key(project, project_manifest) == _key(project, project_manifest)
+
+
+@pytest.mark.parametrize('change', [
+    lambda proj, man: proj.join('requirements.txt').write('six==1.8.0\n'),
+    lambda proj, man: proj.join('setup.py').write('# changed\n'),
+    lambda proj, man: proj.join('requirements.lock').write('six==1.7.3\n'),
+    lambda proj, man: proj.join('ship_it', '__init__.py').write('x = 1\n'),
+    lambda proj, man: man.contents.update(method='pip'),
+    lambda proj, man: man.contents.update(upgrade_pip='yes'),
+])
+def test_key_changes_with_inputs(project, project_manifest, change):
+    before = _key(project, project_manifest)
+    change(project, project_manifest)
+    assert _key(project, project_manifest) != before
+
+
+def test_key_changes_with_copy_excludes(project, project_manifest):
+    project_manifest.contents.update(method='copy', exclude=['*.txt', '*.c'])
+    before = _key(project, project_manifest)
+    project_manifest.contents.update(exclude=['*.c', '*.txt'])
+    assert _key(project, project_manifest) == before
+    project_manifest.contents.update(exclude=['*.c'])
+    assert _key(project, project_manifest) != before
+
+
+def test_isolated_builds_share_a_key(project, project_manifest):
+    before = _key(project, project_manifest)
+    project_manifest.build_id = 'first'
+    first = _key(project, project_manifest)
+    project_manifest.build_id = 'second'
+    assert _key(project, project_manifest) == first == before
+
+
+def test_key_ignores_build_output(project, project_manifest):
+    before = _key(project, project_manifest)
+    project.join('build').mkdir().join('junk').write('junk')
+    project.join('ship_it', '__init__.pyc').write('junk')
+    assert _key(project, project_manifest) == before
+
+
+def test_hash_tree_includes_paths(tmpdir):
+    tmpdir.join('a').write('same')
+    before = hash_tree(str(tmpdir)).hexdigest()
+    tmpdir.join('a').rename(tmpdir.join('b'))
+    assert hash_tree(str(tmpdir)).hexdigest() != before
+
+
+def test_store_and_restore(tmpdir):
+    cache = VirtualEnvCache(str(tmpdir.join('cache')))
+    venv = tmpdir.join('venv')
+    venv.join('bin').ensure(dir=True).join('python').write('python')
+    venv.join('bin', 'python3').mksymlinkto('python')
+
+    assert not cache.restore('key', str(venv))
+    cache.store('key', str(venv))
+
+    venv.join('bin', 'python').write('changed')
+    assert cache.restore('key', str(venv))
+    assert venv.join('bin', 'python').read() == 'python'
+    assert venv.join('bin', 'python3').islink()
+
+
+@mock.patch('ship_it.VirtualEnvPackager.build_virtualenv')
+@mock.patch('ship_it.VirtualEnvPackager.install_package')
+def test_cache_hit_skips_build(mock_install, mock_build, project,
+                               project_manifest):
+    project_manifest.contents['cache_dir'] = 'cache'
+    requirements = str(project.join('requirements.txt'))
+    setup = str(project.join('setup.py'))
+    project.join('build', 'ship_it', 'bin').ensure(dir=True).join(
+        'python').write('python')
+
+    ship_it._package_virtualenv_with_manifest(project_manifest, requirements,
+                                              setup)
+    assert mock_build.call_count == 1
+    assert mock_install.call_count == 1
+    assert project.join('cache', 'virtualenvs').listdir()
+
+    ship_it._package_virtualenv_with_manifest(project_manifest, requirements,
+                                              setup)
+    assert mock_build.call_count == 1
+    assert mock_install.call_count == 1
+
+
+@mock.patch('ship_it.VirtualEnvPackager.build_virtualenv')
+@mock.patch('ship_it.VirtualEnvPackager.install_package')
+def test_isolated_builds_share_an_entry(mock_install, mock_build, project,
+                                        project_manifest):
+    project_manifest.contents['cache_dir'] = 'cache'
+    requirements = str(project.join('requirements.txt'))
+    setup = str(project.join('setup.py'))
+
+    for build_id in ('first', 'second'):
+        project_manifest.build_id = build_id
+        venv = project.join('build', '.work', build_id, 'ship_it')
+        venv.join('bin').ensure(dir=True).join('tool').write(
+            '#!{}/bin/python\n'.format(venv))
+        ship_it._package_virtualenv_with_manifest(project_manifest,
+                                                  requirements, setup)
+
+    assert mock_build.call_count == 1
+    assert len(project.join('cache', 'virtualenvs').listdir()) == 1
+    assert venv.join('bin', 'tool').read() == '#!{}/bin/python\n'.format(venv)
+
+
+def test_restore_elsewhere_relocates(tmpdir):
+    cache = VirtualEnvCache(str(tmpdir.join('cache')))
+    built = tmpdir.join('work', 'venv')
+    built.join('bin').ensure(dir=True).join('tool').write(
+        '#!{}/bin/python\n'.format(built))
+    cache.store('key', str(built))
+
+    venv = tmpdir.join('build', 'venv')
+    assert cache.restore('key', str(venv))
+    assert venv.join('bin', 'tool').read() == '#!{}/bin/python\n'.format(venv)
+    assert not venv.join(PREFIX_FILE).exists()
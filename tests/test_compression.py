@@ -0,0 +1,77 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import gzip
+import io
+import lzma
+import os
+
+import pytest
+
+from ship_it import compression
+from ship_it.compression import BlockCompressor
+
+
+def _decompress(codec, data):
+    if codec == 'gzip':
+        return gzip.GzipFile(fileobj=io.BytesIO(data)).read()
+    if codec == 'xz':
+        return lzma.decompress(data, format=lzma.FORMAT_XZ)
+    return compression.zstandard.ZstdDecompressor().decompressobj(
+    ).decompress(data)
+
+
+@pytest.fixture(params=compression.CODECS)
+def codec(request):
+    if request.param == 'zstd' and compression.zstandard is None:
+        pytest.skip('zstandard is not installed')
+    return request.param
+
+
+@pytest.mark.parametrize('data', [
+    b'',
+    b'small',
+    os.urandom(3000) + b'compressible ' * 1000,
+], ids=['empty', 'one block', 'several blocks'])
+def test_round_trip(codec, data):
+    output = io.BytesIO()
+    with BlockCompressor(output, codec, block_size=1024,
+                         workers=3) as compressor:
+        # in writes that don't line up with the blocks
+        for start in range(0, len(data), 700):
+            compressor.write(data[start:start + 700])
+
+    assert _decompress(codec, output.getvalue()) == data
+
+
+def test_xz_is_one_stream_of_blocks():
+    output = io.BytesIO()
+    with BlockCompressor(output, 'xz', block_size=1024) as compressor:
+        compressor.write(b'x' * 4000)
+
+    data = output.getvalue()
+    assert data.startswith(b'\xfd7zXZ\x00') and data.endswith(b'YZ')
+    assert data.count(b'\xfd7zXZ\x00') == 1
+    decompressor = lzma.LZMADecompressor(format=lzma.FORMAT_XZ)
+    assert decompressor.decompress(data) == b'x' * 4000
+    assert decompressor.eof and not decompressor.unused_data
+
+
+def test_zstd_is_one_frame():
+    if compression.zstandard is None:
+        pytest.skip('zstandard is not installed')
+    output = io.BytesIO()
+    with BlockCompressor(output, 'zstd', workers=2) as compressor:
+        compressor.write(b'x' * 4000)
+
+    assert output.getvalue().count(b'\x28\xb5\x2f\xfd') == 1
+
+
+@pytest.mark.parametrize('codec, level', [
+    ('brotli', None),
+    ('gzip', 0),
+    ('xz', 10),
+])
+def test_invalid(codec, level):
+    with pytest.raises(ValueError):
+        BlockCompressor(io.BytesIO(), codec, level)
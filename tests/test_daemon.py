@@ -0,0 +1,191 @@
+# coding=utf-8
+from __future__ import unicode_literals
+import os
+import stat
+import tempfile
+import threading
+
+import mock
+import pytest
+
+import ship_it
+from ship_it import daemon
+
+
+@pytest.fixture
+def socket_path(tmpdir):
+    return str(tmpdir.join('ship_it.sock'))
+
+
+@pytest.fixture
+def server(socket_path):
+    server = daemon.BuildServer(socket_path)
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,))
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def test_ping(server, socket_path):
+    assert daemon.send_request({'command': 'ping'}, socket_path) == {
+        'ok': True, 'pid': os.getpid()}
+
+
+def test_build(server, socket_path, tmpdir, monkeypatch):
+    calls = []
+
+    def fake_fpm(manifest_path, requirements, setup, **options):
+        calls.append((manifest_path, requirements, setup, options,
+                      os.getcwd()))
+        with ship_it.stage('fpm rpm'):
+            return ['/out/ship_it.rpm']
+
+    monkeypatch.setattr(ship_it, 'fpm', fake_fpm)
+    monkeypatch.chdir(tmpdir)
+    response = daemon.build(['manifest.yaml'], socket_path,
+                            cache_dir='/cache', skip_unchanged=False)
+
+    assert calls == [(str(tmpdir.join('manifest.yaml')), None, None,
+                      {'cache_dir': '/cache'}, str(tmpdir))]
+    assert response['ok']
+    assert response['results'] == [{'manifest': str(tmpdir.join(
+        'manifest.yaml')), 'ok': True, 'artifacts': ['/out/ship_it.rpm']}]
+    assert [event['name'] for event in response['timings']] == ['fpm rpm']
+
+
+def test_build_uses_the_client_environment(server, socket_path,
+                                           monkeypatch):
+    seen = []
+
+    def fake_fpm(manifest_path, requirements, setup, **options):
+        seen.append((os.environ.get('SHIP_IT_CACHE_DIR'),
+                     os.environ.get('SHIP_IT_WHEELHOUSE'),
+                     os.environ.get('DAEMON_ONLY'),
+                     os.environ.get('CLIENT_TOKEN')))
+        return []
+
+    monkeypatch.setattr(ship_it, 'fpm', fake_fpm)
+    monkeypatch.setenv('DAEMON_ONLY', 'yes')
+    monkeypatch.setenv('SHIP_IT_WHEELHOUSE', '/daemon/wheels')
+    response = daemon.send_request({
+        'command': 'build', 'manifests': ['/manifest.yaml'],
+        'environment': {'SHIP_IT_CACHE_DIR': '/client/cache',
+                        'PATH': '/client/bin',
+                        'CLIENT_TOKEN': 'secret'}}, socket_path)
+
+    assert response['ok']
+    assert seen == [('/client/cache', None, 'yes', None)]
+    # and the daemon's own environment is back
+    assert os.environ.get('SHIP_IT_WHEELHOUSE') == '/daemon/wheels'
+    assert 'SHIP_IT_CACHE_DIR' not in os.environ
+
+
+def test_build_only_sends_what_a_build_uses(monkeypatch):
+    send_request = mock.Mock()
+    monkeypatch.setattr(daemon, 'send_request', send_request)
+    monkeypatch.setenv('SHIP_IT_CACHE_DIR', '/client/cache')
+    monkeypatch.setenv('PIP_INDEX_URL', 'https://pypi.example.com/simple')
+    monkeypatch.setenv('PATH', '/client/bin')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'secret')
+    daemon.build(['/manifest.yaml'])
+
+    (request, socket_path), kwargs = send_request.call_args
+    assert request['environment']['SHIP_IT_CACHE_DIR'] == '/client/cache'
+    assert request['environment']['PIP_INDEX_URL'] == \
+        'https://pypi.example.com/simple'
+    assert request['environment']['PATH'] == '/client/bin'
+    assert 'AWS_SECRET_ACCESS_KEY' not in request['environment']
+
+
+def test_build_refuses_another_interpreter(server, socket_path, monkeypatch):
+    monkeypatch.setattr(ship_it, 'fpm', mock.Mock())
+    response = daemon.send_request({
+        'command': 'build', 'manifests': ['/manifest.yaml'],
+        'python': '/some/other/python'}, socket_path)
+
+    assert not response['ok']
+    assert 'not /some/other/python' in response['error']
+    assert not ship_it.fpm.called
+
+
+def test_failed_build(server, socket_path, monkeypatch):
+    def fake_fpm(manifest_path, requirements, setup, **options):
+        raise ValueError('nope')
+
+    monkeypatch.setattr(ship_it, 'fpm', fake_fpm)
+    response = daemon.build(['/manifest.yaml'], socket_path)
+
+    assert not response['ok']
+    result, = response['results']
+    assert result['error'] == 'ValueError: nope'
+    assert 'Traceback' in result['traceback']
+    # the daemon is still there
+    assert daemon.send_request({'command': 'ping'}, socket_path)['ok']
+
+
+def test_bad_requests(server, socket_path):
+    response = daemon.send_request({'command': 'dance'}, socket_path)
+    assert response == {'ok': False,
+                        'error': "ValueError: unknown command 'dance'"}
+
+
+def test_other_users_are_refused(server, socket_path, monkeypatch):
+    monkeypatch.setattr(daemon, '_peer_uid', lambda sock: os.getuid() + 1)
+    assert not server.verify_request(mock.Mock(), None)
+
+    with pytest.raises(daemon.InsecureSocket):
+        daemon.send_request({'command': 'ping'}, socket_path)
+
+
+def test_default_socket_path(tmpdir, monkeypatch):
+    monkeypatch.delenv('SHIP_IT_SOCKET', raising=False)
+    monkeypatch.setenv('XDG_RUNTIME_DIR', str(tmpdir))
+    assert daemon.get_socket_path() == str(tmpdir.join('ship_it',
+                                                       'ship_it.sock'))
+    assert stat.S_IMODE(tmpdir.join('ship_it').stat().mode) == 0o700
+
+    monkeypatch.delenv('XDG_RUNTIME_DIR')
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmpdir))
+    assert daemon.get_socket_path() == str(tmpdir.join(
+        'ship_it-{}'.format(os.getuid()), 'ship_it.sock'))
+
+
+def test_insecure_socket_dirs_are_refused(tmpdir, monkeypatch):
+    monkeypatch.delenv('SHIP_IT_SOCKET', raising=False)
+    monkeypatch.setenv('XDG_RUNTIME_DIR', str(tmpdir))
+    tmpdir.mkdir('ship_it').chmod(0o777)
+    with pytest.raises(daemon.InsecureSocket):
+        daemon.get_socket_path()
+
+    tmpdir.join('ship_it').remove()
+    tmpdir.join('ship_it').mksymlinkto(tmpdir.mkdir('elsewhere'))
+    with pytest.raises(daemon.InsecureSocket):
+        daemon.get_socket_path()
+
+
+def test_not_running(socket_path):
+    with pytest.raises(daemon.DaemonNotRunning):
+        daemon.send_request({'command': 'ping'}, socket_path)
+
+
+def test_stale_sockets_are_replaced(server, socket_path, tmpdir):
+    with pytest.raises(RuntimeError):
+        daemon.BuildServer(socket_path)
+
+    stale = str(tmpdir.join('stale.sock'))
+    open(stale, 'w').close()
+    daemon.BuildServer(stale).server_close()
+    assert not os.path.exists(stale)
+
+
+def test_stop(socket_path):
+    server = daemon.BuildServer(socket_path)
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,))
+    thread.start()
+    assert daemon.stop(socket_path) == {'ok': True}
+    thread.join(5)
+    assert not thread.is_alive()
+    server.server_close()
+    assert not os.path.exists(socket_path)
@@ -0,0 +1,149 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import hashlib
+import io
+import os
+import shutil
+import stat
+import subprocess
+import tarfile
+
+import pytest
+
+from ship_it import compression, debwriter
+from ship_it.native import PackageSpec
+from ship_it.payload import PayloadEntry
+
+
+def _entry(local, remote, config=False):
+    info = os.lstat(str(local))
+    link_target = os.readlink(str(local)) if local.islink() else None
+    size = info.st_size if stat.S_ISREG(info.st_mode) else 0
+    return PayloadEntry(remote, str(local), info.st_mode, size,
+                        int(info.st_mtime), link_target, config)
+
+
+def read_ar(deb_path):
+    with open(deb_path, 'rb') as fobj:
+        assert fobj.read(8) == debwriter.AR_MAGIC
+        members = []
+        while True:
+            header = fobj.read(60)
+            if not header:
+                return members
+            assert header.endswith(b'`\n')
+            size = int(header[48:58])
+            members.append((header[:16].decode('ascii').strip(),
+                            fobj.read(size)))
+            fobj.read(size % 2)
+
+
+@pytest.fixture
+def files(tmpdir):
+    tmpdir.join('venv', 'bin', 'python').write('python', ensure=True)
+    tmpdir.join('venv', 'bin', 'python3').mksymlinkto('python')
+    tmpdir.join('settings.cfg').write('[settings]')
+    venv = tmpdir.join('venv')
+    return tmpdir, [
+        _entry(tmpdir.join('settings.cfg'), '/etc/ship_it/settings.cfg',
+               config=True),
+        _entry(venv, '/opt/ship_it'),
+        _entry(venv.join('bin'), '/opt/ship_it/bin'),
+        _entry(venv.join('bin', 'python'), '/opt/ship_it/bin/python'),
+        _entry(venv.join('bin', 'python3'), '/opt/ship_it/bin/python3'),
+    ]
+
+
+@pytest.fixture
+def spec():
+    return PackageSpec('ship_it', '1.0', '2', epoch='3',
+                       description='ships it\n\nreally',
+                       after_install='echo after',
+                       depends=['python >= 2.7', 'libyaml'],
+                       user='ship_it', group='ship_it', architecture='x86_64')
+
+
+@pytest.mark.parametrize('codec', compression.CODECS)
+def test_write_deb(files, spec, codec):
+    if codec == 'zstd' and compression.zstandard is None:
+        pytest.skip('zstandard is not installed')
+    tmpdir, entries = files
+    deb_path = str(tmpdir.join('ship_it.deb'))
+
+    debwriter.write_deb(deb_path, spec, entries, compression=codec)
+
+    extension = compression.EXTENSIONS[codec]
+    members = read_ar(deb_path)
+    assert [name for name, _ in members] == [
+        'debian-binary', 'control.tar' + extension, 'data.tar' + extension]
+    assert members[0][1] == b'2.0\n'
+    if codec == 'zstd':
+        return
+
+    mode = 'r:{}'.format({'gzip': 'gz', 'xz': 'xz'}[codec])
+    with tarfile.open(fileobj=io.BytesIO(members[1][1]), mode=mode) as tar:
+        control = dict((member.name, tar.extractfile(member).read())
+                       for member in tar if member.isfile())
+        assert tar.getmember('./postinst').mode == 0o755
+    assert b'Package: ship-it\n' in control['./control']
+    assert b'Version: 3:1.0-2\n' in control['./control']
+    assert b'Depends: python (>= 2.7), libyaml\n' in control['./control']
+    assert control['./control'].endswith(
+        b'Description: ships it\n .\n really\n')
+    assert control['./md5sums'] == (
+        '{}  etc/ship_it/settings.cfg\n{}  opt/ship_it/bin/python\n'.format(
+            hashlib.md5(b'[settings]').hexdigest(),
+            hashlib.md5(b'python').hexdigest()).encode('ascii'))
+    assert control['./conffiles'] == b'/etc/ship_it/settings.cfg\n'
+    assert control['./postinst'] == b'#!/bin/sh\necho after'
+
+    with tarfile.open(fileobj=io.BytesIO(members[2][1]), mode=mode) as tar:
+        assert tar.getnames() == [
+            '.', './etc', './etc/ship_it', './etc/ship_it/settings.cfg',
+            './opt', './opt/ship_it', './opt/ship_it/bin',
+            './opt/ship_it/bin/python', './opt/ship_it/bin/python3']
+        assert tar.getmember('./opt/ship_it/bin/python3').linkname == \
+            'python'
+        assert tar.getmember('./opt/ship_it/bin/python').uname == 'ship_it'
+
+
+@pytest.mark.skipif(not shutil.which('dpkg-deb'),
+                    reason='dpkg-deb is not installed')
+def test_dpkg_reads_it(files, spec):
+    tmpdir, entries = files
+    deb_path = str(tmpdir.join('ship_it.deb'))
+    debwriter.write_deb(deb_path, spec, entries, compression='xz')
+
+    assert 'Package: ship-it' in subprocess.check_output(
+        ['dpkg-deb', '--info', deb_path]).decode('utf-8')
+    subprocess.check_call(['dpkg-deb', '-x', deb_path,
+                           str(tmpdir.join('root'))])
+    assert tmpdir.join('root', 'opt', 'ship_it', 'bin', 'python').read() == \
+        'python'
+
+
+def test_hardlinks_are_stored_once(files, spec):
+    tmpdir, entries = files
+    venv = tmpdir.join('venv')
+    os.link(str(venv.join('bin', 'python')), str(venv.join('bin', 'python2')))
+    entries.insert(4, _entry(venv.join('bin', 'python2'),
+                             '/opt/ship_it/bin/python2'))
+    deb_path = str(tmpdir.join('ship_it.deb'))
+
+    debwriter.write_deb(deb_path, spec, entries)
+
+    with tarfile.open(fileobj=io.BytesIO(read_ar(deb_path)[2][1]),
+                      mode='r:gz') as tar:
+        assert tar.getmember('./opt/ship_it/bin/python').isfile()
+        link = tar.getmember('./opt/ship_it/bin/python2')
+        assert link.islnk() and link.linkname == './opt/ship_it/bin/python'
+
+
+@pytest.mark.parametrize('dependency, expected', [
+    ('python', 'python'),
+    ('python < 3', 'python (<< 3)'),
+    ('python = 2.7', 'python (= 2.7)'),
+])
+def test_format_dependency(dependency, expected):
+    assert debwriter.format_dependency(dependency) == expected
@@ -0,0 +1,61 @@
+# coding=utf-8
+from __future__ import unicode_literals
+import os
+import threading
+
+import mock
+import pytest
+
+from ship_it.fingerprint import BuildRecord
+from ship_it.manifest import Manifest
+
+
+@pytest.fixture
+def project_manifest(tmpdir):
+    return Manifest(str(tmpdir.join('manifest.yaml')),
+                    manifest_contents={'name': 'ship_it'})
+
+
+def test_record_is_shared_between_builds(project_manifest):
+    shared = BuildRecord(project_manifest).path
+    project_manifest.build_id = 'isolated'
+    assert BuildRecord(project_manifest).path == shared
+    assert os.path.dirname(shared) == project_manifest.shared_build_dir
+
+
+def test_save_and_check(project_manifest, tmpdir):
+    artifact = tmpdir.join('ship_it.rpm')
+    artifact.write('rpm')
+    record = BuildRecord(project_manifest)
+    record.save('abc', [str(artifact)])
+
+    assert record.is_up_to_date('abc')
+    assert not record.is_up_to_date('def')
+    assert os.listdir(project_manifest.shared_build_dir) == [
+        os.path.basename(record.path)]
+
+
+def test_concurrent_saves_write_whole_records(project_manifest, tmpdir):
+    artifact = tmpdir.join('ship_it.rpm')
+    artifact.write('rpm')
+    threads = [threading.Thread(target=BuildRecord(project_manifest).save,
+                                args=(fingerprint, [str(artifact)]))
+               for fingerprint in ('abc', 'def') * 10]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert BuildRecord(project_manifest).load()['fingerprint'] in (
+        'abc', 'def')
+    assert len(os.listdir(project_manifest.shared_build_dir)) == 1
+
+
+def test_failed_save_leaves_no_temporary_file(project_manifest, tmpdir):
+    artifact = tmpdir.join('ship_it.rpm')
+    artifact.write('rpm')
+    record = BuildRecord(project_manifest)
+    with mock.patch('os.rename', side_effect=OSError('nope')):
+        with pytest.raises(OSError):
+            record.save('abc', [str(artifact)])
+    assert os.listdir(project_manifest.shared_build_dir) == []
@@ -31,7 +31,8 @@ def test_manifest_calls(mock_cl, mock_get, mock_invoke, mock_val,
     assert mock_val.mock_calls == [mock.call('/test_dir/manifest.yaml')]
     mock_cl.assert_called_once_with(['arg'], [('version', '1.2.3'),
                                               ('overridden', 'flag')])
-    mock_invoke.assert_called_once_with('command line')
+    mock_get.assert_called_once_with('rpm', staging_root=None)
+    mock_invoke.assert_called_once_with('command line', 'rpm')
 
 
 @pytest.mark.parametrize('file_path, valid', [
@@ -70,4 +71,173 @@ class TestCallingTheRightPackaging(object):
         assert not mock_copy.called
         ship_it._package_virtualenv_with_manifest(copy_manifest, 'req', 'set')
         mock_copy.assert_called_once_with('req',
-                                          copy_manifest.local_package_path)
+                                          copy_manifest.local_package_path,
+                                          exclude=[])
+
+
+@mock.patch('ship_it.VirtualEnvPackager.patch_virtualenv')
+@mock.patch('ship_it._package_virtualenv_with_manifest')
+@mock.patch('ship_it.validate_path')
+@mock.patch('ship_it.get_version_from_setup_py', return_value='1.2.3')
+@mock.patch('ship_it.cli.invoke_fpm')
+def test_every_target_from_one_virtualenv(mock_invoke, mock_version, mock_val,
+                                          mock_pack, mock_patch, manifest):
+    del manifest.contents['version']
+    manifest.contents['targets'] = ['rpm', 'deb']
+
+    with mock.patch('ship_it.get_manifest_from_path', return_value=manifest):
+        ship_it.fpm(manifest.path)
+
+    assert mock_pack.call_count == 1
+    assert mock_version.call_count == 1
+    assert sorted(call[1][1] for call in mock_invoke.mock_calls) == [
+        'deb', 'rpm']
+    for name, (command_line, target), _ in mock_invoke.mock_calls:
+        assert '--{}-user ship_it'.format(target) in command_line
+        assert '--version 1.2.3' in command_line
+
+
+@mock.patch('ship_it.VirtualEnvPackager.patch_virtualenv')
+@mock.patch('ship_it._package_virtualenv_with_manifest')
+@mock.patch('ship_it.validate_path')
+@mock.patch('ship_it.staging.assemble_staging_root')
+@mock.patch('ship_it.cli.invoke_fpm')
+def test_staging_root(mock_invoke, mock_stage, mock_val, mock_pack,
+                      mock_patch, manifest):
+    manifest.contents['use_staging_root'] = 'yes'
+    with mock.patch('ship_it.get_manifest_from_path', return_value=manifest):
+        ship_it.fpm(manifest.path)
+
+    mock_stage.assert_called_once_with(manifest, manifest.local_staging_path)
+    command_line, target = mock_invoke.call_args[0]
+    assert command_line.startswith('--chdir {} '.format(
+        manifest.local_staging_path))
+    assert command_line.endswith(' .')
+
+
+@mock.patch('ship_it._package_virtualenv_with_manifest')
+@mock.patch('ship_it.validate_path')
+@mock.patch('ship_it.cli.invoke_fpm')
+def test_slimming(mock_invoke, mock_val, mock_pack, manifest):
+    manifest.contents.update(slim=['tests'], dedupe='true')
+    calls = mock.Mock()
+    mock_pack.return_value.patch_virtualenv = calls.patch_virtualenv
+    with mock.patch('ship_it.get_manifest_from_path', return_value=manifest), \
+            mock.patch('ship_it.slim.prune_tree', calls.prune_tree), \
+            mock.patch('ship_it.slim.hardlink_duplicates',
+                       calls.hardlink_duplicates):
+        ship_it.fpm(manifest.path)
+
+    # pruned before relocating, deduplicated after
+    assert [name for name, _, _ in calls.mock_calls] == [
+        'prune_tree', 'patch_virtualenv', 'hardlink_duplicates']
+    venv, patterns, _ = calls.prune_tree.call_args[0]
+    assert venv == manifest.local_virtualenv_path and 'tests' in patterns
+    assert calls.prune_tree.call_args[1] == {'keep_packages': True}
+
+
+@mock.patch('ship_it._package_virtualenv_with_manifest')
+@mock.patch('ship_it.validate_path')
+@mock.patch('ship_it.cli.invoke_fpm')
+def test_over_budget_fails_before_packaging(mock_invoke, mock_val, mock_pack,
+                                            manifest):
+    from ship_it.analyze import BudgetExceeded, PackageAnalysis
+
+    manifest.contents['max_size'] = '1k'
+    analysis = PackageAnalysis('ship_it')
+    analysis.add('six', 2000)
+    with mock.patch('ship_it.get_manifest_from_path', return_value=manifest), \
+            mock.patch('ship_it.analyze.analyze_package', return_value=analysis):
+        with pytest.raises(BudgetExceeded):
+            ship_it.fpm(manifest.path)
+
+    assert not mock_invoke.called
+
+
+@mock.patch('ship_it.VirtualEnvPackager.patch_virtualenv')
+@mock.patch('ship_it._package_virtualenv_with_manifest')
+@mock.patch('ship_it.validate_path')
+@mock.patch('ship_it.native.build_package', return_value=['/ship_it.rpm'])
+@mock.patch('ship_it.cli.invoke_fpm')
+def test_native_backend(mock_invoke, mock_native, mock_val, mock_pack,
+                        mock_patch, manifest):
+    manifest.contents.update(backend='native', use_staging_root='yes')
+    with mock.patch('ship_it.get_manifest_from_path', return_value=manifest):
+        assert ship_it.fpm(manifest.path, iteration='2') == ['/ship_it.rpm']
+
+    assert not mock_invoke.called
+    native_manifest, flags, target = mock_native.call_args[0]
+    assert native_manifest is manifest and target == 'rpm'
+    assert ('version', '0.1.0') in flags and ('iteration', '2') in flags
+    # nothing needs staging
+    assert not any(flag == 'chdir' for flag, _ in flags)
+
+
+class TestSkipUnchanged(object):
+
+    @pytest.fixture
+    def project(self, tmpdir, monkeypatch):
+        monkeypatch.chdir(tmpdir)
+        tmpdir.join('manifest.yaml').write('name: ship_it\nversion: 0.1.0\n')
+        tmpdir.join('requirements.txt').write('six==1.7.3\n')
+        tmpdir.join('setup.py').write('')
+        return tmpdir
+
+    @pytest.yield_fixture
+    def mock_build(self, project):
+        def fake_fpm(command_line, target):
+            project.join('ship_it.rpm').write(command_line)
+            result = mock.Mock()
+            result.stdout = ('{:timestamp=>"now", :message=>"Created package", '
+                             ':path=>"ship_it.rpm"}\n')
+            return result
+
+        with mock.patch('ship_it._package_virtualenv_with_manifest') as pack, \
+                mock.patch('ship_it.cli.invoke_fpm', side_effect=fake_fpm):
+            yield pack
+
+    def test_second_build_is_skipped(self, project, mock_build):
+        manifest_path = str(project.join('manifest.yaml'))
+        assert ship_it.fpm(manifest_path, skip_unchanged=True) == [
+            str(project.join('ship_it.rpm'))]
+        assert mock_build.call_count == 1
+
+        assert ship_it.fpm(manifest_path, skip_unchanged=True) == []
+        assert mock_build.call_count == 1
+
+    @pytest.mark.parametrize('change', [
+        lambda proj: proj.join('requirements.txt').write('six==1.8.0\n'),
+        lambda proj: proj.join('ship_it.rpm').remove(),
+        lambda proj: proj.join('manifest.yaml').write('name: ship_it\n'
+                                                      'version: 0.2.0\n'),
+    ])
+    def test_changes_rebuild(self, project, mock_build, change):
+        manifest_path = str(project.join('manifest.yaml'))
+        ship_it.fpm(manifest_path, skip_unchanged=True)
+        change(project)
+        ship_it.fpm(manifest_path, skip_unchanged=True)
+        assert mock_build.call_count == 2
+
+    def test_overrides_rebuild(self, project, mock_build):
+        manifest_path = str(project.join('manifest.yaml'))
+        ship_it.fpm(manifest_path, skip_unchanged=True)
+        ship_it.fpm(manifest_path, skip_unchanged=True, iteration='2')
+        assert mock_build.call_count == 2
+
+
+@mock.patch('ship_it.VirtualEnvPackager.patch_virtualenv')
+@mock.patch('ship_it._package_virtualenv_with_manifest')
+@mock.patch('ship_it.cli.invoke_fpm')
+def test_multiple_documents(mock_invoke, mock_pack, mock_patch, tmpdir):
+    tmpdir.join('manifest.yaml').write(
+        'name: first\nversion: 1.0\n---\nname: second\nversion: 2.0\n')
+    manifest_path = str(tmpdir.join('manifest.yaml'))
+
+    ship_it.fpm(manifest_path)
+    assert [call[0][0].virtualenv_name
+            for call in mock_pack.call_args_list] == ['first', 'second']
+
+    mock_pack.reset_mock()
+    ship_it.fpm(manifest_path, document=1)
+    assert [call[0][0].virtualenv_name
+            for call in mock_pack.call_args_list] == ['second']
@@ -0,0 +1,78 @@
+# coding=utf-8
+from __future__ import unicode_literals
+import os
+import subprocess
+import sys
+
+import pytest
+
+__here__ = os.path.dirname(os.path.abspath(__file__))
+__root__ = os.path.dirname(__here__)
+
+# how long importing the command line tool may take, in milliseconds. It's
+# generous, so only a real regression on a busy machine goes over it.
+IMPORT_BUDGET_MS = float(os.environ.get('SHIP_IT_IMPORT_BUDGET_MS', 500))
+
+# all of ship_it that the command line tool loads before a build starts
+STARTUP_MODULES = ['ship_it', 'ship_it.cli', 'ship_it.manifest',
+                   'ship_it.scripts', 'ship_it.timing']
+
+# modules that are only needed once a build actually starts
+BUILD_ONLY_MODULES = ['yaml', 'concurrent.futures.thread', 'ship_it.runner',
+                      'ship_it.virtualenv', 'ship_it.wheelhouse',
+                      'ship_it.cache', 'ship_it.staging', 'ship_it.version',
+                      'zstandard']
+
+
+def _run_python(*args):
+    return subprocess.run([sys.executable] + list(args), cwd=__root__,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True, check=True)
+
+
+def _import_time_ms(module):
+    """
+    The cumulative import time of `module`, as reported by
+    ``python -X importtime``
+    """
+    stderr = _run_python('-X', 'importtime', '-c',
+                         'import {}'.format(module)).stderr
+    for line in stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        fields = [field.strip() for field in line.split('|')]
+        if len(fields) == 3 and fields[2] == module:
+            return int(fields[1]) / 1000.0
+    raise AssertionError('no import time for {} in:\n{}'.format(module,
+                                                                 stderr))
+
+
+def _loaded_modules(module):
+    """
+    What importing `module` loads, in a fresh interpreter
+    """
+    return set(_run_python('-c', 'import sys, {}; print("\\n".join('
+                                 'sys.modules))'.format(module)).stdout.split())
+
+
+def test_build_modules_are_not_imported_up_front():
+    assert not set(BUILD_ONLY_MODULES) & _loaded_modules('ship_it.scripts')
+
+
+def test_only_startup_modules_are_imported():
+    loaded = _loaded_modules('ship_it.scripts')
+    assert sorted(name for name in loaded
+                  if name.split('.')[0] == 'ship_it') == STARTUP_MODULES
+
+
+@pytest.mark.parametrize('name', ['VirtualEnvPackager', 'virtualenv'])
+def test_build_names_are_still_available(name):
+    import ship_it
+    assert getattr(ship_it, name)
+
+
+def test_import_time_budget():
+    # the best of a few runs, so a busy machine doesn't fail the test
+    best = min(_import_time_ms('ship_it.scripts') for _ in range(3))
+    assert best <= IMPORT_BUDGET_MS, (
+        'importing ship_it.scripts took {:.1f}ms, over the {:.0f}ms budget '
+        '(SHIP_IT_IMPORT_BUDGET_MS)'.format(best, IMPORT_BUDGET_MS))
@@ -19,6 +19,19 @@ def test_invoke_with_command_line(mock_local):
     mock_local.assert_called_once_with('fpm -f -s dir -t rpm test')
 
 
+def test_get_created_packages():
+    output = ('{:timestamp=>"2017-01-01T00:00:00", :message=>"Created package",'
+              ' :path=>"ship_it-0.1.0-1.x86_64.rpm"}\n')
+    assert cli.get_created_packages(output) == [
+        os.path.abspath('ship_it-0.1.0-1.x86_64.rpm')]
+    assert cli.get_created_packages(None) == []
+
+
+def test_invoke_deb(mock_local):
+    cli.invoke_fpm('test', 'deb')
+    mock_local.assert_called_once_with('fpm -f -s dir -t deb test')
+
+
 class TestGettingTheCommandLine(object):
     # Using ordered dictionaries for an expected order in tests.
     @pytest.mark.parametrize('flag_list, expected', [
@@ -0,0 +1,120 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import json
+import re
+
+import mock
+import pytest
+
+from ship_it import lock
+
+REPORT = {
+    'version': '1',
+    'install': [
+        {'metadata': {'name': 'six', 'version': '1.16.0'},
+         'download_info': {'url': 'https://example.com/six.whl',
+                           'archive_info': {'hashes': {'sha256': 'abc'}}}},
+        {'metadata': {'name': 'ship_it', 'version': '0.11.0'},
+         'download_info': {'url': 'file:///src', 'dir_info': {}}},
+        {'metadata': {'name': 'Click', 'version': '6.6'},
+         'download_info': {'url': 'https://example.com/click.tar.gz',
+                           'archive_info': {'hash': 'sha256=def'}}},
+        {'metadata': {'name': 'repo', 'version': '1.0'},
+         'download_info': {'url': 'https://example.com/repo.git',
+                           'vcs_info': {'vcs': 'git', 'commit_id': '1234'}}},
+    ],
+}
+
+
+@pytest.fixture
+def requirements(tmpdir):
+    req = tmpdir.join('requirements.txt')
+    req.write('six\nclick>=6\ngit+https://example.com/repo.git#egg=repo\n.\n')
+    return str(req)
+
+
+def test_get_lock_lines(requirements):
+    assert lock.get_lock_lines(REPORT, requirements) == [
+        'Click==6.6 \\\n    --hash=sha256:def',
+        'repo @ git+https://example.com/repo.git@1234',
+        'six==1.16.0 \\\n    --hash=sha256:abc',
+        '.',
+    ]
+
+
+def test_resolve(mock_local, requirements):
+    def run(command):
+        report_path = re.search(r'--report (\S+)', command).group(1)
+        with open(report_path, 'w') as fobj:
+            json.dump(REPORT, fobj)
+
+    mock_local.side_effect = run
+    assert lock.resolve(requirements, python='/bin/python') == REPORT
+    command = mock_local.call_args[0][0]
+    assert command.startswith('/bin/python -m pip install --dry-run ')
+    assert command.endswith('-r {}'.format(requirements))
+
+
+def test_resolve_projects(mock_local, requirements):
+    mock_local.side_effect = lambda command: None
+    with mock.patch('json.load', return_value=REPORT):
+        lock.resolve(requirements, python='/bin/python', projects=['/src'])
+    assert mock_local.call_args[0][0].endswith(
+        '-r {} /src'.format(requirements))
+
+
+def test_dependencies_only_in_setup_py_are_locked(tmpdir):
+    tmpdir.join('requirements.txt').write('six\n')
+    report = dict(REPORT, install=REPORT['install'][:2])
+    with mock.patch('ship_it.lock.resolve', return_value=report) as resolve:
+        lock.write_lock_file(str(tmpdir.join('requirements.txt')),
+                             str(tmpdir.join('requirements.lock')),
+                             projects=[str(tmpdir)])
+
+    assert resolve.call_args[0][3] == [str(tmpdir)]
+    content = tmpdir.join('requirements.lock').read()
+    # six only comes from setup.py, and the project itself is left out
+    assert 'six==1.16.0' in content
+    assert 'ship_it' not in content.split('\n', 1)[1]
+
+
+def test_write_and_check_lock_file(tmpdir, requirements):
+    lock_file = str(tmpdir.join('requirements.lock'))
+    with mock.patch('ship_it.lock.resolve', return_value=REPORT):
+        lock.write_lock_file(requirements, lock_file)
+
+    with open(lock_file) as fobj:
+        content = fobj.read()
+    assert content.startswith('# generated by ship_it lock from '
+                              'requirements.txt')
+    assert 'six==1.16.0 \\\n    --hash=sha256:abc\n' in content
+    lock.check_lock_file(lock_file, requirements)
+
+    tmpdir.join('requirements.txt').write('six==1.15.0\n')
+    with pytest.raises(lock.StaleLockFile):
+        lock.check_lock_file(lock_file, requirements)
+
+
+def test_hand_written_lock_file_is_stale(tmpdir, requirements):
+    tmpdir.join('requirements.lock').write('six==1.16.0\n')
+    with pytest.raises(lock.StaleLockFile):
+        lock.check_lock_file(str(tmpdir.join('requirements.lock')),
+                             requirements)
+
+
+def test_lock_file_records_its_requirements_file(tmpdir):
+    other = tmpdir.join('reqs', 'other.txt')
+    other.write('six\n', ensure=True)
+    lock_file = str(tmpdir.join('requirements.lock'))
+    with mock.patch('ship_it.lock.resolve', return_value=REPORT):
+        lock.write_lock_file(str(other), lock_file)
+
+    assert tmpdir.join('requirements.lock').read().startswith(
+        '# generated by ship_it lock from reqs/other.txt ')
+    lock.check_lock_file(lock_file, str(other))
+
+    tmpdir.join('requirements.txt').write('six\n')
+    with pytest.raises(lock.StaleLockFile) as excinfo:
+        lock.check_lock_file(lock_file, str(tmpdir.join('requirements.txt')))
+    assert 'was made from {}'.format(other) in str(excinfo.value)
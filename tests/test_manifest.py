@@ -11,7 +11,9 @@ except ImportError:
 import mock
 import pytest
 import yaml
-from ship_it.manifest import Manifest, get_manifest_from_path
+from ship_it import manifest as manifest_module
+from ship_it.manifest import (Manifest, get_manifest_from_path,
+                              get_manifests_from_path)
 
 
 @pytest.fixture
@@ -32,15 +34,17 @@ def test_sanity(tmpdir, manifest_file, manifest):
     assert get_manifest_from_path(str(_file)).contents == manifest.contents
 
 
-@mock.patch('yaml.load')
+@mock.patch('yaml.load_all', return_value=[{}])
 @mock.patch('ship_it.manifest.Manifest.get_manifest_fobj')
 def test_open_for_yaml(mock_fobj, mock_load):
     assert not mock_fobj.called
     assert not mock_load.called
     Manifest('some path')
     mock_fobj.assert_called_once_with(os.path.abspath('some path'))
-    mock_load.assert_called_once_with(mock_fobj.return_value,
-                                      Loader=yaml.BaseLoader)
+    mock_load.assert_called_once_with(
+        mock_fobj.return_value.__enter__.return_value,
+        Loader=getattr(yaml, 'CBaseLoader', yaml.BaseLoader))
+    assert mock_fobj.return_value.__exit__.called
 
 
 @pytest.mark.parametrize('path', [
@@ -55,7 +59,7 @@ def test_manifest_normalizes_path(mock_content, path):
     """
     assert not mock_content.called
     _man = Manifest(path)
-    mock_content.assert_called_once_with(Manifest.normalize_path(path))
+    mock_content.assert_called_once_with(Manifest.normalize_path(path), 0)
     assert _man.path
     assert os.path.isabs(_man.path)
     assert _man.manifest_dir
@@ -434,3 +438,213 @@ class TestGettingArgsAndFlags(object):
         actual_args, actual_flags = manifest.get_args_and_flags()
         assert sorted(actual_args) == sorted(expected_args)
         assert sorted(actual_flags) == sorted(expected_flags)
+
+
+class TestTargets(object):
+
+    @pytest.mark.parametrize('targets,expected', [
+        (None, ['rpm']),
+        ('deb', ['deb']),
+        (['rpm', 'deb'], ['rpm', 'deb']),
+    ])
+    def test_targets(self, manifest, targets, expected):
+        if targets is not None:
+            manifest.contents['targets'] = targets
+        assert manifest.targets == expected
+
+    def test_unsupported_target(self, manifest):
+        manifest.contents['targets'] = ['rpm', 'msi']
+        with pytest.raises(ValueError):
+            manifest.targets
+
+    def test_deb_flags(self, manifest):
+        manifest.contents['user'] = 'root'
+        args, flags = manifest.get_args_and_flags('deb')
+        assert ('deb-user', 'root') in flags
+        assert ('deb-group', 'ship_it') in flags
+        assert not any(flag[0].startswith('rpm-') for flag in flags)
+        # fpm can only mark owned directories for rpms
+        assert not any(flag[0] == 'directories' for flag in flags)
+        assert args == manifest.get_args_and_flags('rpm')[0]
+
+
+def test_backend(manifest):
+    assert manifest.backend == 'fpm'
+    manifest.contents['backend'] = 'native'
+    assert manifest.backend == 'native'
+    manifest.contents['backend'] = 'rpmbuild'
+    with pytest.raises(ValueError):
+        manifest.backend
+
+
+@pytest.mark.parametrize('pkg_type, contents, expected', [
+    ('rpm', {}, []),
+    ('rpm', {'compression': 'xz'}, [('rpm-compression', 'xzmt')]),
+    ('deb', {'compression': 'zstd', 'compression_level': '12'},
+     [('deb-compression', 'zst'), ('deb-compression-level', 12)]),
+])
+def test_compression_flags(manifest, pkg_type, contents, expected):
+    manifest.contents.update(contents)
+    flags = manifest.get_args_and_flags(pkg_type)[1]
+    assert [flag for flag in flags if 'compression' in flag[0]] == expected
+
+
+@pytest.mark.parametrize('contents', [
+    {'compression': 'brotli'},
+    {'compression_level': '23'},
+    {'compression_level': '15'},
+    {'compression_level': '0'},
+    {'compression': 'gzip', 'compression_level': '10'},
+    {'compression': 'xz', 'compression_level': '12'},
+])
+def test_invalid_compression(manifest, contents):
+    manifest.contents.update(contents)
+    with pytest.raises(ValueError):
+        manifest.get_compression_flags('rpm')
+
+
+def test_staged_args_and_flags(manifest):
+    manifest.contents.update({
+        'config_files': {'/etc/ship_it/settings.cfg': 'settings.cfg'},
+        'extra_files': {'bin/tool': 'tool.sh'},
+    })
+    args, flags = manifest.get_args_and_flags(staging_root='/stage')
+    assert args == ['.']
+    assert flags[0] == ('chdir', '/stage')
+    # config files still need marking as such
+    assert ('config-files', 'etc/ship_it/settings.cfg') in flags
+
+
+class TestPrecompile(object):
+
+    def test_defaults(self, manifest):
+        assert not manifest.precompile
+        assert manifest.precompile_optimize == [0]
+        assert manifest.precompile_invalidation == 'checked-hash'
+
+    def test_settings(self, manifest):
+        manifest.contents.update(precompile='yes',
+                                 precompile_optimize=['0', '2'],
+                                 precompile_invalidation='unchecked-hash')
+        assert manifest.precompile
+        assert manifest.precompile_optimize == [0, 2]
+        assert manifest.precompile_invalidation == 'unchecked-hash'
+
+    @pytest.mark.parametrize('setting', [
+        dict(precompile='yes', exclude_compiled='yes'),
+        dict(precompile_optimize=['3']),
+        dict(precompile_invalidation='sometimes'),
+    ])
+    def test_invalid(self, manifest, setting):
+        manifest.contents.update(setting)
+        with pytest.raises(ValueError):
+            (manifest.precompile, manifest.precompile_optimize,
+             manifest.precompile_invalidation)
+
+
+class TestLoading(object):
+    @pytest.fixture(autouse=True)
+    def clear_cache(self):
+        manifest_module._documents_cache.clear()
+
+    def test_parses_are_cached_until_the_file_changes(self, tmpdir):
+        _file = tmpdir.join('manifest.yaml')
+        _file.write('name: ship_it\nversion: 0.1.0\n')
+
+        first = get_manifest_from_path(str(_file))
+        with mock.patch('yaml.load_all') as mock_load:
+            second = get_manifest_from_path(str(_file))
+        assert not mock_load.called
+        assert second.contents == first.contents
+
+        # each manifest gets its own copy to modify
+        second.contents['version'] = '0.2.0'
+        assert get_manifest_from_path(str(_file)).contents['version'] == \
+            '0.1.0'
+
+        _file.write('name: ship_it\nversion: 0.3.0\n')
+        os.utime(str(_file), (time.time() + 5, time.time() + 5))
+        assert get_manifest_from_path(str(_file)).contents['version'] == \
+            '0.3.0'
+
+    def test_multiple_documents(self, tmpdir):
+        _file = tmpdir.join('manifest.yaml')
+        _file.write('name: first\nversion: 1\n---\n'
+                    'name: second\nversion: 2\n---\n')
+
+        manifests = get_manifests_from_path(str(_file))
+        assert [(man.name, man.contents['version'], man.document)
+                for man in manifests] == [('first', '1', 0),
+                                          ('second', '2', 1)]
+        assert all(man.document_count == 2 for man in manifests)
+        assert get_manifest_from_path(str(_file)).name == 'first'
+        with pytest.raises(ValueError):
+            get_manifest_from_path(str(_file), document=2)
+
+    def test_single_document(self, tmpdir, manifest):
+        _file = tmpdir.join('manifest.yaml')
+        _file.write('name: ship_it\n')
+        assert [man.name for man in get_manifests_from_path(str(_file))] == \
+            ['ship_it']
+        assert manifest.document_count == 1
+
+
+@pytest.mark.parametrize('contents, expected', [
+    ({}, None),
+    ({'cache_dir': '/cache'}, '/cache/templates'),
+    ({'cache_dir': '/cache', 'template_dir': 'templates'},
+     '/path/templates'),
+])
+def test_template_dir(contents, expected, monkeypatch):
+    monkeypatch.delenv('SHIP_IT_CACHE_DIR', raising=False)
+    monkeypatch.delenv('SHIP_IT_TEMPLATE_DIR', raising=False)
+    contents.update(name='ship_it')
+    test_man = Manifest('/path/manifest.yaml', manifest_contents=contents)
+    assert test_man.template_dir == expected
+
+
+@pytest.mark.parametrize('slim, expected', [
+    (None, []),
+    ('false', []),
+    ('true', ['tests', 'docs', 'headers']),
+    ('tests', ['tests']),
+    (['tests', 'metadata'], ['tests', 'metadata']),
+])
+def test_slim_profiles(slim, expected):
+    manifest = Manifest('/test_dir/manifest.yaml',
+                        manifest_contents=dict(name='ship_it', slim=slim))
+    assert manifest.slim_profiles == expected
+
+
+@pytest.mark.parametrize('contents', [
+    dict(slim=['everything']),
+    dict(slim=['metadata'], incremental='true'),
+])
+def test_invalid_slim_profiles(contents):
+    manifest = Manifest('/test_dir/manifest.yaml',
+                        manifest_contents=dict(name='ship_it', **contents))
+    with pytest.raises(ValueError):
+        manifest.slim_profiles
+
+
+@pytest.mark.parametrize('max_size, expected', [
+    (None, None),
+    ('1000', 1000),
+    ('300M', 300 * 1024 ** 2),
+    ('1.5GiB', int(1.5 * 1024 ** 3)),
+    ('20 kb', 20 * 1024),
+])
+def test_max_size(max_size, expected):
+    manifest = Manifest('/test_dir/manifest.yaml',
+                        manifest_contents=dict(name='ship_it',
+                                               max_size=max_size))
+    assert manifest.max_size == expected
+    assert manifest.analyze == (expected is not None)
+
+
+def test_invalid_max_size():
+    manifest = Manifest('/test_dir/manifest.yaml',
+                        manifest_contents=dict(name='ship_it',
+                                               max_size='huge'))
+    with pytest.raises(ValueError):
+        manifest.max_size
@@ -0,0 +1,57 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import pytest
+
+from ship_it import native
+from ship_it.manifest import Manifest
+from ship_it.native import PackageSpec
+
+
+def test_spec_from_flags(tmpdir):
+    tmpdir.join('after.sh').write('echo after')
+    manifest = Manifest(str(tmpdir.join('manifest.yaml')),
+                        manifest_contents=dict(
+        name='ship_it',
+        version='1.0',
+        epoch='2',
+        after_install='after.sh',
+        depends=['python >= 2.7'],
+        user='deploy',
+    ))
+    _, flags = manifest.get_args_and_flags()
+
+    spec = PackageSpec.from_flags(flags + [('iteration', 5)])
+
+    assert (spec.name, spec.version, spec.iteration, spec.epoch) == \
+        ('ship_it', '1.0', '5', '2')
+    assert spec.after_install == 'echo after'
+    assert spec.before_install is None
+    assert spec.depends == ['python >= 2.7']
+    assert (spec.user, spec.group) == ('deploy', 'ship_it')
+
+
+def test_build_package(tmpdir):
+    tmpdir.join('build', 'ship_it', 'bin', 'python').write('python',
+                                                          ensure=True)
+    manifest = Manifest(str(tmpdir.join('manifest.yaml')),
+                        manifest_contents=dict(name='ship_it', version='1.0'))
+    _, flags = manifest.get_args_and_flags()
+
+    built = native.build_package(manifest, flags + [('architecture', 'noarch')],
+                                 output_dir=str(tmpdir))
+
+    assert built == [str(tmpdir.join('ship_it-1.0-1.noarch.rpm'))]
+    assert [p.basename for p in tmpdir.listdir(lambda p: p.isfile())] == \
+        ['ship_it-1.0-1.noarch.rpm']
+
+
+@pytest.mark.parametrize('pkg_type, iteration, expected', [
+    ('rpm', None, 'ship_it-1.0-1.x86_64.rpm'),
+    ('rpm', '2', 'ship_it-1.0-2.x86_64.rpm'),
+    ('deb', None, 'ship-it_1.0_amd64.deb'),
+    ('deb', '2', 'ship-it_1.0-2_amd64.deb'),
+])
+def test_package_filename(pkg_type, iteration, expected):
+    spec = PackageSpec('ship_it', '1.0', iteration, architecture='x86_64')
+    assert native.get_package_filename(spec, pkg_type) == expected
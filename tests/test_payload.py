@@ -0,0 +1,42 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import hashlib
+
+from ship_it.manifest import Manifest
+from ship_it.payload import get_payload_entries, hash_entries
+
+
+def test_get_payload_entries(tmpdir):
+    venv = tmpdir.join('build', 'ship_it')
+    venv.join('bin', 'python').write('python', ensure=True)
+    venv.join('bin', 'python3').mksymlinkto('python')
+    venv.join('lib', 'thing.pyc').write('compiled', ensure=True)
+    tmpdir.join('settings.cfg').write('[settings]')
+    tmpdir.join('content', 'index.html').write('<html>', ensure=True)
+    manifest = Manifest(str(tmpdir.join('manifest.yaml')),
+                        manifest_contents=dict(
+        name='ship_it',
+        exclude_compiled='true',
+        config_files={'/etc/ship_it/settings.cfg': 'settings.cfg'},
+        extra_files={'share': 'content/'},
+    ))
+
+    entries = get_payload_entries(manifest)
+
+    assert [(entry.path, entry.config) for entry in entries] == [
+        ('/etc/ship_it/settings.cfg', True),
+        ('/opt/ship_it', False),
+        ('/opt/ship_it/bin', False),
+        ('/opt/ship_it/bin/python', False),
+        ('/opt/ship_it/bin/python3', False),
+        ('/opt/ship_it/content', False),
+        ('/opt/ship_it/content/index.html', False),
+        ('/opt/ship_it/lib', False),
+    ]
+    assert entries[4].link_target == 'python'
+    assert entries[3].size == len('python')
+
+    assert hash_entries(entries)[:4] == [
+        hashlib.sha256(b'[settings]').hexdigest(), '', '',
+        hashlib.sha256(b'python').hexdigest()]
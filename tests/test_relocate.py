@@ -0,0 +1,88 @@
+# coding=utf-8
+from __future__ import unicode_literals
+import os
+import stat
+
+import pytest
+
+from ship_it.relocate import relocate_virtualenv
+
+
+@pytest.fixture
+def venv(tmpdir):
+    venv = tmpdir.join('build', 'venv')
+    bin_dir = venv.join('bin').ensure(dir=True)
+    prefix = str(venv)
+
+    bin_dir.join('pip').write('#!{}/bin/python\nimport pip\n'.format(prefix))
+    os.chmod(str(bin_dir.join('pip')), 0o755)
+    for name in ('activate', 'activate.csh', 'activate.fish', 'activate.ps1'):
+        bin_dir.join(name).write('VIRTUAL_ENV="{}"\n'.format(prefix))
+    bin_dir.join('python').write(b'\x7fELF\0' + prefix.encode('utf-8'),
+                                 mode='wb')
+    bin_dir.join('python3').mksymlinkto('python')
+    bin_dir.join('other').mksymlinkto(prefix + '/bin/python')
+
+    site = venv.join('lib', 'python3', 'site-packages').ensure(dir=True)
+    site.join('local.pth').write('{}/src\n'.format(prefix))
+    site.join('thing.dist-info', 'RECORD').write(
+        '{}/bin/thing,,\nthing/__init__.py,,\n'.format(prefix), ensure=True)
+    site.join('thing', 'data.txt').write(prefix, ensure=True)
+    return venv
+
+
+def test_relocate(venv):
+    prefix = str(venv)
+    changed = relocate_virtualenv(prefix, '/opt/venv')
+
+    # pip, 4 activate scripts, the .pth, the RECORD and one symlink
+    assert changed == 8
+    assert venv.join('bin', 'pip').read() == '#!/opt/venv/bin/python\nimport pip\n'
+    assert stat.S_IMODE(venv.join('bin', 'pip').stat().mode) == 0o755
+    for name in ('activate', 'activate.csh', 'activate.fish', 'activate.ps1'):
+        assert venv.join('bin', name).read() == 'VIRTUAL_ENV="/opt/venv"\n'
+    assert venv.join('lib', 'python3', 'site-packages',
+                     'local.pth').read() == '/opt/venv/src\n'
+    assert venv.join('lib', 'python3', 'site-packages', 'thing.dist-info',
+                     'RECORD').read().startswith('/opt/venv/bin/thing,,')
+
+    # binaries, relative links and files we don't know about are left alone
+    assert prefix.encode('utf-8') in venv.join('bin', 'python').read('rb')
+    assert venv.join('bin', 'python3').readlink() == 'python'
+    assert venv.join('bin', 'other').readlink() == '/opt/venv/bin/python'
+    assert venv.join('lib', 'python3', 'site-packages', 'thing',
+                     'data.txt').read() == prefix
+    assert not [name for name in venv.join('bin').listdir()
+                if name.basename.endswith('.tmp')]
+
+
+def test_relocate_breaks_hardlinks(venv, tmpdir):
+    original = tmpdir.join('original_activate')
+    os.link(str(venv.join('bin', 'activate')), str(original))
+    relocate_virtualenv(str(venv), '/opt/venv')
+    assert original.read() == 'VIRTUAL_ENV="{}"\n'.format(venv)
+
+
+def test_relocate_from_another_prefix(venv):
+    relocate_virtualenv(str(venv), '/opt/first')
+    relocate_virtualenv(str(venv), '/opt/second', source_prefix='/opt/first')
+    assert venv.join('bin', 'pip').read().startswith('#!/opt/second/bin/python')
+
+
+def test_relocate_only_whole_paths(venv):
+    prefix = str(venv)
+    venv.join('bin', 'tool').write(
+        "#!{0}/bin/python\n"
+        "OLD = '{0}-old/lib'\n"
+        "OTHER = '/other{0}/lib'\n"
+        "HERE = '{0}'\n"
+        "THERE = {0}".format(prefix))
+
+    relocate_virtualenv(prefix, '/opt/venv')
+
+    assert venv.join('bin', 'tool').read() == (
+        "#!/opt/venv/bin/python\n"
+        "OLD = '{0}-old/lib'\n"
+        "OTHER = '/other{0}/lib'\n"
+        "HERE = '/opt/venv'\n"
+        "THERE = /opt/venv".format(prefix))
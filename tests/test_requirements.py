@@ -0,0 +1,51 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import pytest
+
+from ship_it.requirements import (normalize_name, read_requirement_lines,
+                                  parse_pinned, parse_freeze)
+
+
+@pytest.mark.parametrize('name,expected', [
+    ('six', 'six'),
+    ('PyYAML', 'pyyaml'),
+    ('ship_it', 'ship-it'),
+    ('zope.interface', 'zope-interface'),
+])
+def test_normalize_name(name, expected):
+    assert normalize_name(name) == expected
+
+
+def test_read_requirement_lines(tmpdir):
+    req = tmpdir.join('requirements.txt')
+    req.write('# leading comment\n'
+              '\n'
+              'six==1.7.3  # trailing comment\n'
+              'git+https://example.com/repo.git#egg=repo\n'
+              'PyYaml==3.11 \\\n'
+              '    --hash=sha256:abc\n')
+    assert read_requirement_lines(str(req)) == [
+        'six==1.7.3',
+        'git+https://example.com/repo.git#egg=repo',
+        'PyYaml==3.11      --hash=sha256:abc',
+    ]
+
+
+def test_parse_pinned():
+    pinned, other = parse_pinned(['six==1.7.3', 'Py_Yaml == 3.11', '.',
+                                  'click>=6', 'invoke==0.13.0; python_version<"3"'])
+    assert pinned == {'six': ('six', '1.7.3'),
+                      'py-yaml': ('Py_Yaml', '3.11')}
+    assert other == ['.', 'click>=6', 'invoke==0.13.0; python_version<"3"']
+
+
+def test_parse_pinned_ignores_hashes():
+    pinned, other = parse_pinned(['six==1.7.3     --hash=sha256:abc'])
+    assert pinned == {'six': ('six', '1.7.3')} and other == []
+
+
+def test_parse_freeze():
+    assert parse_freeze('six==1.7.3\n'
+                        '-e git+https://example.com/repo.git#egg=repo\n'
+                        'PyYAML==3.11\n') == {'six': '1.7.3', 'pyyaml': '3.11'}
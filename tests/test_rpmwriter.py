@@ -0,0 +1,232 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import gzip
+import hashlib
+import io
+import lzma
+import os
+import stat
+import struct
+
+import pytest
+
+from ship_it import rpmwriter
+from ship_it.native import PackageSpec
+from ship_it.payload import PayloadEntry
+
+
+def _read_header(fobj):
+    magic = fobj.read(8)
+    assert magic == rpmwriter.HEADER_MAGIC
+    count, store_size = struct.unpack('>ii', fobj.read(8))
+    index = [struct.unpack('>iiii', fobj.read(16)) for _ in range(count)]
+    store = fobj.read(store_size)
+
+    tag, tag_type, offset, size = index[0]
+    assert tag_type == rpmwriter.BIN and size == 16
+    trailer = struct.unpack('>iiii', store[offset:offset + 16])
+    assert trailer == (tag, rpmwriter.BIN, -16 * count, 16)
+
+    tags = {}
+    for tag, tag_type, offset, count in index[1:]:
+        if tag_type in (rpmwriter.STRING, rpmwriter.I18NSTRING):
+            value = store[offset:store.index(b'\0', offset)].decode('utf-8')
+        elif tag_type == rpmwriter.STRING_ARRAY:
+            value = store[offset:].split(b'\0')[:count]
+            value = [item.decode('utf-8') for item in value]
+        elif tag_type == rpmwriter.BIN:
+            value = store[offset:offset + count]
+        else:
+            struct_format = {rpmwriter.INT16: 'H', rpmwriter.INT32: 'I',
+                             rpmwriter.INT64: 'Q'}[tag_type]
+            assert offset % struct.calcsize(struct_format) == 0
+            value = list(struct.unpack_from(
+                '>{}{}'.format(count, struct_format), store, offset))
+        tags[tag] = value
+    return tags, magic + struct.pack('>ii', len(index), store_size) + \
+        b''.join(struct.pack('>iiii', *entry) for entry in index) + store
+
+
+def _read_cpio(data):
+    files = []
+    offset = 0
+    while True:
+        fields = [int(data[offset + 6 + 8 * i:offset + 14 + 8 * i], 16)
+                  for i in range(13)]
+        name_size, size = fields[11], fields[6]
+        offset += 110
+        name = data[offset:offset + name_size - 1].decode('utf-8')
+        offset += name_size + (-(110 + name_size) % 4)
+        if name == 'TRAILER!!!':
+            return files
+        files.append((name, fields[1], data[offset:offset + size]))
+        offset += size + (-size % 4)
+
+
+def read_rpm(rpm_path):
+    with open(rpm_path, 'rb') as fobj:
+        lead = fobj.read(96)
+        signature, _ = _read_header(fobj)
+        fobj.read(-fobj.tell() % 8)
+        signed_start = fobj.tell()
+        header, header_bytes = _read_header(fobj)
+        payload = fobj.read()
+        fobj.seek(signed_start)
+        signed = fobj.read()
+    return lead, signature, header, header_bytes, payload, signed
+
+
+@pytest.fixture
+def files(tmpdir):
+    tmpdir.join('venv', 'bin', 'python').write('python', ensure=True)
+    tmpdir.join('venv', 'bin', 'python3').mksymlinkto('python')
+    tmpdir.join('settings.cfg').write('[settings]')
+    tmpdir.join('before.sh').write('echo before')
+    return tmpdir
+
+
+def _entry(local, remote, config=False):
+    info = os.lstat(str(local))
+    link_target = os.readlink(str(local)) if local.islink() else None
+    size = info.st_size if stat.S_ISREG(info.st_mode) else 0
+    return PayloadEntry(remote, str(local), info.st_mode, size,
+                        int(info.st_mtime), link_target, config)
+
+
+def test_write_rpm(files):
+    venv = files.join('venv')
+    entries = [
+        _entry(files.join('settings.cfg'), '/etc/ship_it/settings.cfg',
+               config=True),
+        _entry(venv, '/opt/ship_it'),
+        _entry(venv.join('bin'), '/opt/ship_it/bin'),
+        _entry(venv.join('bin', 'python'), '/opt/ship_it/bin/python'),
+        _entry(venv.join('bin', 'python3'), '/opt/ship_it/bin/python3'),
+    ]
+    spec = PackageSpec('ship_it', '1.0', '2', epoch='3',
+                       before_install='echo before',
+                       depends=['python >= 2.7', 'libyaml'],
+                       user='ship_it', group='ship_it', architecture='x86_64')
+    rpm_path = str(files.join('ship_it.rpm'))
+
+    rpmwriter.write_rpm(rpm_path, spec, entries)
+
+    lead, signature, header, header_bytes, payload, signed = read_rpm(rpm_path)
+    assert lead[:4] == rpmwriter.LEAD_MAGIC
+    assert lead[10:23] == b'ship_it-1.0-2'
+
+    assert signature[rpmwriter.SIGTAG_SHA256] == \
+        hashlib.sha256(header_bytes).hexdigest()
+    assert signature[rpmwriter.SIGTAG_MD5] == hashlib.md5(signed).digest()
+    assert signature[rpmwriter.SIGTAG_SIZE] == [len(signed)]
+
+    assert header[rpmwriter.RPMTAG_NAME] == 'ship_it'
+    assert header[rpmwriter.RPMTAG_EPOCH] == [3]
+    assert header[rpmwriter.RPMTAG_PROVIDEVERSION] == ['3:1.0-2']
+    assert header[rpmwriter.RPMTAG_PREIN] == 'echo before'
+    requirements = list(zip(header[rpmwriter.RPMTAG_REQUIRENAME],
+                            header[rpmwriter.RPMTAG_REQUIREFLAGS],
+                            header[rpmwriter.RPMTAG_REQUIREVERSION]))
+    assert ('python', rpmwriter.RPMSENSE_GREATER | rpmwriter.RPMSENSE_EQUAL,
+            '2.7') in requirements
+    assert ('libyaml', 0, '') in requirements
+    assert header[rpmwriter.RPMTAG_DIRNAMES] == [
+        '/etc/ship_it/', '/opt/', '/opt/ship_it/', '/opt/ship_it/bin/']
+    assert header[rpmwriter.RPMTAG_BASENAMES] == [
+        'settings.cfg', 'ship_it', 'bin', 'python', 'python3']
+    assert header[rpmwriter.RPMTAG_FILEFLAGS][0] == (
+        rpmwriter.RPMFILE_CONFIG | rpmwriter.RPMFILE_NOREPLACE)
+    assert header[rpmwriter.RPMTAG_FILEDIGESTS][3] == \
+        hashlib.sha256(b'python').hexdigest()
+    assert header[rpmwriter.RPMTAG_FILELINKTOS][4] == 'python'
+    assert set(header[rpmwriter.RPMTAG_FILEUSERNAME]) == {'ship_it'}
+
+    archive = gzip.GzipFile(fileobj=io.BytesIO(payload)).read()
+    assert len(archive) == signature[rpmwriter.SIGTAG_PAYLOADSIZE][0]
+    assert [(name, data) for name, _, data in _read_cpio(archive)] == [
+        ('./etc/ship_it/settings.cfg', b'[settings]'),
+        ('./opt/ship_it', b''),
+        ('./opt/ship_it/bin', b''),
+        ('./opt/ship_it/bin/python', b'python'),
+        ('./opt/ship_it/bin/python3', b'python'),
+    ]
+
+
+def test_only_config_files_are_config(files):
+    files.join('conf.d', 'settings.cfg').write('[settings]', ensure=True)
+    files.join('conf.d', 'current.cfg').mksymlinkto('settings.cfg')
+    entries = [
+        _entry(files.join('conf.d'), '/etc/ship_it', config=True),
+        _entry(files.join('conf.d', 'current.cfg'),
+               '/etc/ship_it/current.cfg', config=True),
+        _entry(files.join('conf.d', 'settings.cfg'),
+               '/etc/ship_it/settings.cfg', config=True),
+    ]
+    rpm_path = str(files.join('ship_it.rpm'))
+
+    rpmwriter.write_rpm(rpm_path, PackageSpec('ship_it', '1.0'), entries)
+
+    _, _, header, _, _, _ = read_rpm(rpm_path)
+    assert header[rpmwriter.RPMTAG_FILEFLAGS] == [
+        0, 0, rpmwriter.RPMFILE_CONFIG | rpmwriter.RPMFILE_NOREPLACE]
+
+
+def test_xz_payload(files):
+    entries = [_entry(files.join('settings.cfg'), '/etc/settings.cfg')]
+    rpm_path = str(files.join('ship_it.rpm'))
+
+    rpmwriter.write_rpm(rpm_path, PackageSpec('ship_it', '1.0'), entries,
+                        compression='xz', level=3)
+
+    _, signature, header, _, payload, _ = read_rpm(rpm_path)
+    assert header[rpmwriter.RPMTAG_PAYLOADCOMPRESSOR] == 'xz'
+    assert header[rpmwriter.RPMTAG_PAYLOADFLAGS] == '3'
+    assert 'rpmlib(PayloadIsXz)' in header[rpmwriter.RPMTAG_REQUIRENAME]
+    archive = lzma.decompress(payload)
+    assert len(archive) == signature[rpmwriter.SIGTAG_PAYLOADSIZE][0]
+    assert _read_cpio(archive)[0][2] == b'[settings]'
+
+
+def test_hardlinks_are_stored_once(files):
+    venv = files.join('venv')
+    os.link(str(venv.join('bin', 'python')), str(venv.join('bin', 'python2')))
+    entries = [_entry(venv.join('bin', 'python'), '/opt/ship_it/bin/python'),
+               _entry(venv.join('bin', 'python2'),
+                      '/opt/ship_it/bin/python2'),
+               _entry(files.join('settings.cfg'), '/opt/ship_it/settings')]
+    rpm_path = str(files.join('ship_it.rpm'))
+
+    rpmwriter.write_rpm(rpm_path, PackageSpec('ship_it', '1.0'), entries)
+
+    _, signature, header, _, payload, _ = read_rpm(rpm_path)
+    assert header[rpmwriter.RPMTAG_FILEINODES] == [1, 1, 3]
+    assert header[rpmwriter.RPMTAG_FILESIZES] == [6, 6, 10]
+    assert 'rpmlib(PartialHardlinkSets)' in \
+        header[rpmwriter.RPMTAG_REQUIRENAME]
+    archive = gzip.GzipFile(fileobj=io.BytesIO(payload)).read()
+    assert len(archive) == signature[rpmwriter.SIGTAG_PAYLOADSIZE][0]
+    # only the last link has the data
+    assert [data for _, _, data in _read_cpio(archive)] == [
+        b'', b'python', b'[settings]']
+
+
+def test_file_changed_while_packaging(files):
+    entry = _entry(files.join('settings.cfg'), '/etc/settings.cfg')
+    files.join('settings.cfg').write('[settings] and more')
+    with pytest.raises(RuntimeError):
+        rpmwriter.write_archive(io.BytesIO(), [entry])
+
+
+@pytest.mark.parametrize('dependency, expected', [
+    ('python', ('python', 0, '')),
+    ('python < 3', ('python', rpmwriter.RPMSENSE_LESS, '3')),
+    ('python = 2.7', ('python', rpmwriter.RPMSENSE_EQUAL, '2.7')),
+])
+def test_parse_dependency(dependency, expected):
+    assert rpmwriter.parse_dependency(dependency) == expected
+
+
+def test_parse_bad_dependency():
+    with pytest.raises(ValueError):
+        rpmwriter.parse_dependency('python ~> 2.7')
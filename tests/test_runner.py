@@ -0,0 +1,69 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import pytest
+
+from ship_it.runner import CommandRunner, CommandError
+from ship_it.timing import Recorder
+
+
+@pytest.fixture
+def command_runner(tmpdir):
+    return CommandRunner(log_dir=str(tmpdir.join('logs')), tail_lines=3)
+
+
+def test_output_is_logged_per_stage(command_runner, tmpdir, monkeypatch):
+    recorder = Recorder()
+    monkeypatch.setattr('ship_it.runner.recorder', recorder)
+    with recorder.stage('fpm rpm'):
+        result = command_runner.run('for i in 1 2 3 4 5; do echo $i; done; '
+                                    'echo oops >&2')
+
+    log = tmpdir.join('logs', 'fpm-rpm.log')
+    assert result.log_path == str(log)
+    assert log.read() == ('$ for i in 1 2 3 4 5; do echo $i; done; '
+                          'echo oops >&2\n1\n2\n3\n4\n5\noops\n')
+    # only the end of the output is kept in memory
+    assert result.tail == ['4\n', '5\n', 'oops\n']
+    assert result.stdout == '4\n5\noops\n'
+    assert result.exited == 0
+
+
+def test_logs_append(command_runner, tmpdir):
+    command_runner.run('echo one')
+    command_runner.run('echo two')
+    assert tmpdir.join('logs', 'commands.log').read() == \
+        '$ echo one\none\n$ echo two\ntwo\n'
+
+
+def test_failures_raise(command_runner, tmpdir):
+    with pytest.raises(CommandError) as excinfo:
+        command_runner.run('seq 10; exit 3')
+
+    result = excinfo.value.result
+    assert result.exited == 3
+    assert result.tail == ['8\n', '9\n', '10\n']
+    message = str(excinfo.value)
+    assert 'status 3: seq 10; exit 3' in message
+    assert '8\n9\n10' in message and '\n7\n' not in message
+    assert str(tmpdir.join('logs', 'commands.log')) in message
+
+
+def test_hidden_output_is_captured(command_runner, tmpdir):
+    result = command_runner.run('seq 1000; echo warning >&2', hide=True)
+    assert result.stdout.splitlines() == [str(i) for i in range(1, 1001)]
+    assert result.tail == ['warning\n']
+    assert tmpdir.join('logs', 'commands.log').read().endswith('\nwarning\n')
+
+
+def test_echoed_without_a_log_dir(capsys):
+    command_runner = CommandRunner()
+    assert command_runner.run('echo hello').log_path is None
+    assert capsys.readouterr().out == 'hello\n'
+
+
+def test_logging_to(command_runner, tmpdir):
+    with command_runner.logging_to(str(tmpdir.join('other'))):
+        command_runner.run('true')
+    assert tmpdir.join('other', 'commands.log').check()
+    assert command_runner.log_dir == str(tmpdir.join('logs'))
@@ -0,0 +1,109 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import mock
+import pytest
+from click.testing import CliRunner
+
+from ship_it import scripts
+
+
+@pytest.fixture
+def cli():
+    return CliRunner()
+
+
+@pytest.mark.parametrize('args', [
+    ['manifest.yaml'],
+    ['build', 'manifest.yaml'],
+])
+def test_build_is_the_default_command(cli, args):
+    with mock.patch('ship_it.scripts.fpm') as mock_fpm:
+        result = cli.invoke(scripts.main, args + ['--cache-dir', '/cache'])
+
+    assert result.exit_code == 0, result.output
+    mock_fpm.assert_called_once_with('manifest.yaml', None, None,
+                                     cache_dir='/cache', wheelhouse=None,
+                                     skip_unchanged=False, isolated=False)
+
+
+def test_isolated_build(cli):
+    with mock.patch('ship_it.scripts.fpm') as mock_fpm:
+        result = cli.invoke(scripts.main, ['--isolated', 'manifest.yaml'])
+
+    assert result.exit_code == 0, result.output
+    assert mock_fpm.call_args[1]['isolated'] is True
+
+
+def test_build_with_daemon(cli):
+    response = {'ok': False, 'output': '',
+                'results': [{'manifest': '/a/manifest.yaml', 'ok': True,
+                             'artifacts': ['/a/a.rpm']},
+                            {'manifest': '/b/manifest.yaml', 'ok': False,
+                             'error': 'ValueError: nope',
+                             'traceback': 'Traceback: nope\n'}],
+                'timings': []}
+    with mock.patch('ship_it.daemon.build', return_value=response) as build:
+        result = cli.invoke(scripts.main, ['--daemon', '--socket', '/s.sock',
+                                           'a', 'b'])
+
+    assert result.exit_code == 1
+    assert build.call_args[0] == (('a', 'b'), '/s.sock')
+    assert 'created /a/a.rpm' in result.output
+
+
+def test_daemon_not_running(cli, tmpdir):
+    result = cli.invoke(scripts.main, [
+        'build', '--daemon', '--socket', str(tmpdir.join('nothing.sock')),
+        'manifest.yaml'])
+    assert result.exit_code == 1
+    assert 'ship_it serve' in result.output
+
+
+def test_lock(cli, tmpdir):
+    tmpdir.join('manifest.yaml').write('name: ship_it\n')
+    tmpdir.join('requirements.txt').write('six\n')
+    with mock.patch('ship_it.lock.write_lock_file',
+                    side_effect=lambda req, lock_file, **_: lock_file) as write:
+        result = cli.invoke(scripts.main, ['lock', '--find-links', '/wheels',
+                                           str(tmpdir.join('manifest.yaml'))])
+
+    assert result.exit_code == 0, result.output
+    write.assert_called_once_with(str(tmpdir.join('requirements.txt')),
+                                  str(tmpdir.join('requirements.lock')),
+                                  extra_args=['--find-links', '/wheels'],
+                                  projects=[])
+    assert 'wrote {}'.format(tmpdir.join('requirements.lock')) in result.output
+
+
+def test_lock_pip_method_locks_setup_py(cli, tmpdir):
+    tmpdir.join('manifest.yaml').write('name: ship_it\nmethod: pip\n')
+    tmpdir.join('requirements.txt').write('six\n')
+    with mock.patch('ship_it.lock.write_lock_file') as write:
+        result = cli.invoke(scripts.main, ['lock',
+                                           str(tmpdir.join('manifest.yaml'))])
+
+    assert result.exit_code == 0, result.output
+    assert write.call_args[1]['projects'] == [str(tmpdir)]
+
+
+def test_analyze(cli, tmpdir):
+    tmpdir.join('manifest.yaml').write('name: ship_it\nmax_files: "1"\n')
+    venv = tmpdir.join('build', 'ship_it')
+    venv.join('bin', 'python').write('python', ensure=True)
+    venv.join('bin', 'pip').write('pip')
+
+    result = cli.invoke(scripts.main, ['analyze',
+                                       str(tmpdir.join('manifest.yaml'))])
+
+    assert result.exit_code == 1
+    assert 'ship_it: 9B in 2 files' in result.output
+    assert 'over its file budget' in result.output
+
+
+def test_analyze_needs_a_build(cli, tmpdir):
+    tmpdir.join('manifest.yaml').write('name: ship_it\n')
+    result = cli.invoke(scripts.main, ['analyze',
+                                       str(tmpdir.join('manifest.yaml'))])
+    assert result.exit_code == 2
+    assert 'has not been built' in result.output
@@ -0,0 +1,106 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import os
+
+import pytest
+
+from ship_it import slim
+from ship_it.manifest import Manifest
+
+
+@pytest.fixture
+def venv(tmpdir):
+    site_packages = tmpdir.join('venv', 'lib', 'python3.6', 'site-packages')
+    package = site_packages.join('package')
+    package.join('__init__.py').write('x = 1\n', ensure=True)
+    package.join('tests', 'test_it.py').write('assert True\n', ensure=True)
+    package.join('test_more.py').write('assert 1\n')
+    package.join('__pycache__', 'test_more.cpython-36.pyc').write(
+        'compiled', ensure=True)
+    package.join('module.h').write('int x;\n')
+    package.join('README.rst').write('docs\n')
+    site_packages.join('package-1.0.dist-info', 'RECORD').write(
+        'package/__init__.py\n', ensure=True)
+    tmpdir.join('venv', 'include', 'python3.6', 'Python.h').write(
+        'headers\n', ensure=True)
+    return tmpdir.join('venv')
+
+
+def _files(root):
+    return sorted(os.path.relpath(os.path.join(dirpath, filename), str(root))
+                  for dirpath, _, filenames in os.walk(str(root))
+                  for filename in filenames)
+
+
+def test_prune_tree(venv):
+    report = slim.prune_tree(str(venv), slim.PROFILES['tests'] +
+                             slim.PROFILES['headers'])
+
+    assert _files(venv) == [
+        'lib/python3.6/site-packages/package-1.0.dist-info/RECORD',
+        'lib/python3.6/site-packages/package/README.rst',
+        'lib/python3.6/site-packages/package/__init__.py',
+    ]
+    assert report.removed_files == 4
+    assert report.removed_bytes == sum(len(content) for content in [
+        'assert True\n', 'assert 1\n', 'compiled', 'int x;\n', 'headers\n'])
+
+
+@pytest.mark.parametrize('name', ['test', 'tests', 'doc', 'examples', 'man',
+                                  'include'])
+def test_prune_keeps_packages(venv, name):
+    package = venv.join('lib', 'python3.6', 'site-packages', 'package', 'sub',
+                        name)
+    package.join('__init__.py').write('x = 1\n', ensure=True)
+    package.join('NOTES.md').write('notes\n')
+    patterns = [pattern for profile in ('tests', 'docs', 'headers')
+                for pattern in slim.PROFILES[profile]]
+
+    slim.prune_tree(str(venv), patterns, keep_packages=True)
+
+    assert package.join('__init__.py').read() == 'x = 1\n'
+    assert not package.join('NOTES.md').exists()
+    assert not venv.join('lib', 'python3.6', 'site-packages', 'package',
+                         'tests').exists()
+    assert not venv.join('include').exists()
+
+
+def test_prune_metadata(venv):
+    slim.prune_tree(str(venv), slim.PROFILES['metadata'])
+    assert not venv.join('lib', 'python3.6', 'site-packages',
+                         'package-1.0.dist-info', 'RECORD').exists()
+
+
+def test_slim_patterns_include_excludes(tmpdir):
+    manifest = Manifest(str(tmpdir.join('manifest.yaml')),
+                        manifest_contents=dict(name='ship_it', slim='docs',
+                                               exclude=['*.txt']))
+    assert slim.get_slim_patterns(manifest) == \
+        list(slim.PROFILES['docs']) + ['*.txt']
+
+
+def test_hardlink_duplicates(tmpdir):
+    content = 'x' * 1000
+    tmpdir.join('a', 'one.py').write(content, ensure=True)
+    tmpdir.join('b', 'one.py').write(content, ensure=True)
+    tmpdir.join('c', 'one.py').write(content, ensure=True)
+    tmpdir.join('executable').write(content)
+    tmpdir.join('executable').chmod(0o755)
+    tmpdir.join('small').write('y')
+    tmpdir.join('also_small').write('y')
+    tmpdir.join('different').write('z' * 1000)
+
+    report = slim.hardlink_duplicates(str(tmpdir), workers=2)
+
+    inode = tmpdir.join('a', 'one.py').stat().ino
+    assert tmpdir.join('b', 'one.py').stat().ino == inode
+    assert tmpdir.join('c', 'one.py').stat().ino == inode
+    assert tmpdir.join('c', 'one.py').read() == content
+    for name in ('executable', 'small', 'different'):
+        assert tmpdir.join(name).stat().nlink == 1
+    assert (report.linked_files, report.linked_bytes) == (2, 2000)
+    assert 'saving 2.0KiB' in str(report)
+
+    # already linked files are left alone
+    assert slim.hardlink_duplicates(str(tmpdir)).linked_files == 0
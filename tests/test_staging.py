@@ -0,0 +1,45 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import pytest
+
+from ship_it.manifest import Manifest
+from ship_it.staging import assemble_staging_root
+
+
+@pytest.fixture
+def project(tmpdir):
+    tmpdir.join('build', 'ship_it', 'bin', 'python').write('python',
+                                                          ensure=True)
+    tmpdir.join('build', 'ship_it', 'lib', 'thing.py').write('thing',
+                                                            ensure=True)
+    tmpdir.join('settings.cfg').write('[settings]')
+    tmpdir.join('scripts', 'tool.sh').write('#!/bin/sh', ensure=True)
+    tmpdir.join('content', 'index.html').write('<html>', ensure=True)
+    return tmpdir
+
+
+def test_assemble(project):
+    manifest = Manifest(str(project.join('manifest.yaml')),
+                        manifest_contents=dict(
+        name='ship_it',
+        config_files={'/etc/ship_it/settings.cfg': 'settings.cfg'},
+        extra_files={'bin/tool.sh': 'scripts/tool.sh',
+                     'share': 'content/'},
+    ))
+    root = project.join('stage')
+    root.join('stale').write('stale', ensure=True)
+
+    assemble_staging_root(manifest, str(root))
+
+    assert sorted(str(p.relto(root)) for p in root.visit()
+                  if p.isfile()) == [
+        'etc/ship_it/settings.cfg',
+        'opt/ship_it/bin/python',
+        'opt/ship_it/bin/tool.sh',
+        'opt/ship_it/content/index.html',
+        'opt/ship_it/lib/thing.py',
+    ]
+    # linked, not copied
+    assert root.join('opt', 'ship_it', 'lib', 'thing.py').stat().ino == \
+        project.join('build', 'ship_it', 'lib', 'thing.py').stat().ino
@@ -0,0 +1,83 @@
+# coding=utf-8
+from __future__ import unicode_literals
+import os
+import time
+
+import mock
+import pytest
+
+from ship_it import VirtualEnvPackager
+from ship_it.template import (VirtualEnvTemplates, TEMPLATE_MARKER,
+                              get_template_key)
+
+
+def _fake_create_virtualenv(virtualenv_path, upgrade_pip=False,
+                            upgrade_wheel=False):
+    os.makedirs(os.path.join(virtualenv_path, 'bin'))
+    with open(os.path.join(virtualenv_path, 'bin', 'pip'), 'w') as pip:
+        pip.write('#!{}/bin/python\n'.format(virtualenv_path))
+    with open(os.path.join(virtualenv_path, 'pyvenv.cfg'), 'w') as cfg:
+        cfg.write('upgraded = {} {}\n'.format(upgrade_pip, upgrade_wheel))
+    os.symlink('/usr/bin/python3', os.path.join(virtualenv_path, 'bin',
+                                                'python'))
+
+
+@pytest.yield_fixture
+def mock_create():
+    with mock.patch('ship_it.template.create_virtualenv',
+                    side_effect=_fake_create_virtualenv) as mocked:
+        yield mocked
+
+
+@pytest.fixture
+def templates(tmpdir):
+    return VirtualEnvTemplates(str(tmpdir.join('templates')))
+
+
+def test_templates_are_built_once(templates, mock_create, tmpdir):
+    first = templates.get(upgrade_pip=True)
+    assert templates.get(upgrade_pip=True) == first
+    assert mock_create.call_count == 1
+    assert os.path.basename(first) == get_template_key(upgrade_pip=True)
+    with open(os.path.join(first, 'bin', 'pip')) as pip:
+        assert pip.read() == '#!{}/bin/python\n'.format(first)
+    # nothing left over from building it
+    assert [str(entry) for entry in tmpdir.join('templates').listdir()] == [
+        first]
+
+    assert templates.get(upgrade_pip=False) != first
+    assert mock_create.call_count == 2
+
+
+def test_stale_templates_are_rebuilt(templates, mock_create):
+    template = templates.get()
+    marker = os.path.join(template, TEMPLATE_MARKER)
+    old = time.time() - templates.max_age - 1
+    os.utime(marker, (old, old))
+
+    assert templates.get() == template
+    assert mock_create.call_count == 2
+    assert templates.is_fresh(template)
+
+
+def test_clone(templates, mock_create, tmpdir):
+    venv = tmpdir.join('build', 'ship_it')
+    venv.join('leftover').write('', ensure=True)
+    templates.clone(str(venv), upgrade_wheel=True)
+
+    assert venv.join('bin', 'pip').read() == '#!{}/bin/python\n'.format(venv)
+    assert venv.join('pyvenv.cfg').read() == 'upgraded = False True\n'
+    assert venv.join('bin', 'python').readlink() == '/usr/bin/python3'
+    assert not venv.join('leftover').check()
+    assert not venv.join(TEMPLATE_MARKER).check()
+    # the template is untouched
+    template = templates.get(upgrade_wheel=True)
+    with open(os.path.join(template, 'bin', 'pip')) as pip:
+        assert pip.read() == '#!{}/bin/python\n'.format(template)
+
+
+def test_packager_clones_the_template(mock_local):
+    template = mock.Mock()
+    VirtualEnvPackager('/build/ship_it', upgrade_pip=True, template=template)
+    template.clone.assert_called_once_with('/build/ship_it', True, False)
+    assert not mock_local.called
@@ -0,0 +1,86 @@
+# coding=utf-8
+from __future__ import unicode_literals
+import json
+import threading
+
+import mock
+import pytest
+
+import ship_it
+from ship_it.timing import Recorder, recorder, timed
+
+
+@pytest.fixture
+def fresh():
+    return Recorder()
+
+
+def test_stages_nest(fresh):
+    with fresh.stage('outer'):
+        assert fresh.current_stage() == 'outer'
+        with fresh.stage('inner', target='rpm'):
+            assert fresh.current_stage() == 'inner'
+        assert fresh.current_stage() == 'outer'
+    assert fresh.current_stage() is None
+
+    inner, outer = fresh.events
+    assert (inner['name'], outer['name']) == ('inner', 'outer')
+    assert inner['args'] == {'target': 'rpm'}
+    assert outer['ts'] <= inner['ts']
+    assert inner['ts'] + inner['dur'] <= outer['ts'] + outer['dur']
+    assert all(event['ph'] == 'X' for event in fresh.events)
+
+
+def test_failures_are_still_recorded(fresh):
+    with pytest.raises(ValueError):
+        with fresh.stage('broken'):
+            raise ValueError
+    assert [event['name'] for event in fresh.events] == ['broken']
+
+
+def test_stages_are_per_thread(fresh):
+    seen = []
+    with fresh.stage('main'):
+        thread = threading.Thread(
+            target=lambda: seen.append(fresh.current_stage()))
+        thread.start()
+        thread.join()
+    assert seen == [None]
+
+
+def test_summary_and_files(tmpdir, fresh):
+    for _ in range(2):
+        with fresh.stage('repeated'):
+            pass
+    summary = fresh.summary()
+    assert summary['stages'][0]['name'] == 'repeated'
+    assert summary['stages'][0]['count'] == 2
+
+    fresh.write_trace(str(tmpdir.join('trace.json')))
+    fresh.write_summary(str(tmpdir.join('summary.json')))
+    trace = json.loads(tmpdir.join('trace.json').read())
+    assert len(trace['traceEvents']) == 2
+    assert json.loads(tmpdir.join('summary.json').read()) == summary
+
+
+def test_timed():
+    recorder.reset()
+
+    @timed('decorated')
+    def func(value):
+        return value * 2
+
+    assert func(2) == 4
+    assert [event['name'] for event in recorder.events] == ['decorated']
+
+
+@mock.patch('ship_it.VirtualEnvPackager.patch_virtualenv')
+@mock.patch('ship_it._package_virtualenv_with_manifest')
+@mock.patch('ship_it.validate_path')
+@mock.patch('ship_it.cli.invoke_fpm')
+def test_build_stages(mock_invoke, mock_val, mock_pack, mock_patch, manifest):
+    recorder.reset()
+    with mock.patch('ship_it.get_manifest_from_path', return_value=manifest):
+        ship_it.fpm(manifest.path)
+    assert [event['name'] for event in recorder.events] == [
+        'load manifest', 'virtualenv', 'fpm rpm', 'build']
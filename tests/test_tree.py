@@ -0,0 +1,88 @@
+# coding=utf-8
+from __future__ import unicode_literals
+import os
+import stat
+
+import mock
+import pytest
+
+from ship_it import tree
+from ship_it.tree import clone_file, copy_tree, is_excluded
+
+
+@pytest.fixture
+def package(tmpdir):
+    pkg = tmpdir.join('pkg')
+    pkg.join('__init__.py').write('x = 1\n', ensure=True)
+    pkg.join('__init__.pyc').write('junk')
+    pkg.join('__pycache__', '__init__.cpython-36.pyc').write('junk',
+                                                              ensure=True)
+    pkg.join('sub', 'module.py').write('y = 2\n', ensure=True)
+    pkg.join('sub', 'debug.log').write('noise')
+    pkg.join('assets', 'logo.png').write(b'\x89PNG', mode='wb', ensure=True)
+    pkg.join('bin', 'run').write('#!/bin/sh\n', ensure=True)
+    os.chmod(str(pkg.join('bin', 'run')), 0o755)
+    pkg.join('link').mksymlinkto('sub/module.py')
+    return pkg
+
+
+def _files(root):
+    return sorted(str(p.relto(root)) for p in root.visit())
+
+
+@pytest.mark.parametrize('relative_path,patterns,expected', [
+    ('a/b.pyc', ['*.py[co]'], True),
+    ('a/__pycache__', ['__pycache__'], True),
+    ('docs/index.rst', ['docs/*'], True),
+    ('a/docs/index.rst', ['**/docs/*'], True),
+    ('a/b.py', ['*.py[co]', 'docs/*'], False),
+])
+def test_is_excluded(relative_path, patterns, expected):
+    assert is_excluded(relative_path, patterns) is expected
+
+
+def test_copy_tree(tmpdir, package):
+    before = _files(package)
+    dst = tmpdir.join('venv', 'pkg')
+    copied = copy_tree(str(package), str(dst),
+                       exclude=tree.COMPILED_PATTERNS + ('*.log',))
+
+    assert copied == 4
+    assert _files(dst) == ['__init__.py', 'assets', 'assets/logo.png', 'bin',
+                           'bin/run', 'link', 'sub', 'sub/module.py']
+    assert dst.join('assets', 'logo.png').read('rb') == b'\x89PNG'
+    assert stat.S_IMODE(dst.join('bin', 'run').stat().mode) == 0o755
+    assert dst.join('link').readlink() == 'sub/module.py'
+    # the source is never touched
+    assert _files(package) == before
+
+
+def test_copies_are_independent(tmpdir, package):
+    dst = tmpdir.join('copy')
+    copy_tree(str(package), str(dst))
+    dst.join('sub', 'module.py').write('changed')
+    assert package.join('sub', 'module.py').read() == 'y = 2\n'
+
+
+def test_hardlinks_when_asked(tmpdir, package):
+    dst = tmpdir.join('copy')
+    copy_tree(str(package), str(dst), link=True)
+    assert dst.join('sub', 'module.py').stat().ino == \
+        package.join('sub', 'module.py').stat().ino
+
+
+@mock.patch('ship_it.tree._reflink', side_effect=OSError(95, 'no'))
+@mock.patch('ship_it.tree._copy_file_range', side_effect=OSError(38, 'no'))
+def test_clone_file_falls_back_to_copying(mock_range, mock_reflink, tmpdir,
+                                          package):
+    dst = tmpdir.join('module.py')
+    assert clone_file(str(package.join('sub', 'module.py')), str(dst)) == \
+        'copy'
+    assert dst.read() == 'y = 2\n'
+
+
+@mock.patch('ship_it.tree._reflink', side_effect=OSError(5, 'I/O error'))
+def test_clone_file_raises_real_errors(mock_reflink, tmpdir, package):
+    with pytest.raises(OSError):
+        clone_file(str(package.join('sub', 'module.py')),
+                   str(tmpdir.join('module.py')))
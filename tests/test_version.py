@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import mock
+import pytest
+
+from ship_it import version, get_version_from_setup_py
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    version._cache.clear()
+    yield
+    version._cache.clear()
+
+
+@pytest.fixture
+def project(tmpdir):
+    return tmpdir.mkdir('project')
+
+
+def _setup_py(project, body):
+    setup_py = project.join('setup.py')
+    setup_py.write('from setuptools import setup\n' + body)
+    return str(setup_py)
+
+
+@pytest.mark.parametrize('body', [
+    "setup(name='thing', version='1.2.3')\n",
+    "VERSION = '1.2.3'\nsetup(name='thing', version=VERSION)\n",
+    "import setuptools\nsetuptools.setup(version='1.2.3')\n",
+])
+def test_version_in_setup_py(project, body):
+    assert version.read_version(_setup_py(project, body)) == '1.2.3'
+
+
+@pytest.mark.parametrize('body', [
+    "from thing import __version__\nsetup(version=__version__)\n",
+    "from thing import __version__ as v\nsetup(version=v)\n",
+    "import thing\nsetup(version=thing.__version__)\n",
+])
+@pytest.mark.parametrize('module', ['thing/__init__.py', 'src/thing/__init__.py',
+                                    'thing.py'])
+def test_version_from_package(project, body, module):
+    project.join(module).write("__version__ = '2.0'\n", ensure=True)
+    assert version.read_version(_setup_py(project, body)) == '2.0'
+
+
+def test_version_in_setup_cfg(project):
+    project.join('setup.cfg').write('[metadata]\nversion = 3.1\n')
+    assert version.read_version(_setup_py(project, 'setup()\n')) == '3.1'
+
+
+def test_version_attr_in_setup_cfg(project):
+    project.join('setup.cfg').write(
+        '[metadata]\nversion = attr: thing.__version__\n')
+    project.join('thing', '__init__.py').write("__version__ = '3.2'\n",
+                                               ensure=True)
+    assert version.read_version(_setup_py(project, 'setup()\n')) == '3.2'
+
+
+def test_version_file_in_setup_cfg(project):
+    project.join('setup.cfg').write('[metadata]\nversion = file: VERSION\n')
+    project.join('VERSION').write('3.3\n')
+    assert version.read_version(_setup_py(project, 'setup()\n')) == '3.3'
+
+
+@pytest.mark.skipif(version.tomllib is None, reason='needs a toml parser')
+def test_version_in_pyproject(project):
+    project.join('pyproject.toml').write('[project]\nversion = "4.0"\n')
+    assert version.read_version(_setup_py(project, 'setup()\n')) == '4.0'
+
+
+@pytest.mark.parametrize('body, files', [
+    ("setup(version=get_version())\n", {}),
+    ("setup(version=get_version())\n",
+     {'setup.cfg': '[metadata]\nversion = 0.9\n'}),
+    ("setup(**kwargs)\n", {'setup.cfg': '[metadata]\nversion = 1.0\n'}),
+    ("V = '1'\nV = '2'\nsetup(version=V)\n", {}),
+    ("from thing import __version__\nsetup(version=__version__)\n",
+     {'thing/__init__.py': "__version__ = compute()\n"}),
+    ("setup()\n", {'pyproject.toml':
+                   '[project]\nversion = "1"\ndynamic = ["version"]\n'}),
+    ("setup()\n", {}),
+])
+def test_ambiguous_versions_are_not_guessed(project, body, files):
+    for name, content in files.items():
+        project.join(name).write(content, ensure=True)
+    assert version.read_version(_setup_py(project, body)) is None
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('1.0', '1.0'),
+    ('2!1.0rc1.post2.dev3+local.7', '2!1.0rc1.post2.dev3+local.7'),
+    ('1.0-beta', None),
+    ('v1.0', None),
+    ('01.0', None),
+    ('1.0.RC1', None),
+])
+def test_only_normalized_versions_are_read(project, value, expected):
+    setup_py = _setup_py(project, "setup(version={!r})\n".format(value))
+    assert version.read_version(setup_py) == expected
+
+
+def test_versions_are_cached_until_a_source_changes(project):
+    module = project.join('thing', '__init__.py')
+    module.write("__version__ = '1.0'\n", ensure=True)
+    setup_py = _setup_py(project, "import thing\nsetup(version=thing.__version__)\n")
+
+    assert version.read_version(setup_py) == '1.0'
+    with mock.patch('ship_it.version.get_static_version') as mocked_static:
+        assert version.read_version(setup_py) == '1.0'
+    assert not mocked_static.called
+
+    module.write("__version__ = '1.1'\n")
+    assert version.read_version(setup_py) == '1.1'
+
+    project.join('setup.cfg').write('[metadata]\nname = thing\n')
+    assert version.get_cached_version(setup_py) is None
+
+
+def test_static_version_does_not_run_setup_py(project):
+    setup_py = _setup_py(project, "setup(version='1.2.3')\n")
+    with mock.patch('subprocess.check_output') as mocked_check:
+        assert get_version_from_setup_py(setup_py) == '1.2.3'
+    assert not mocked_check.called
+
+
+def test_ambiguous_version_runs_setup_py(project):
+    setup_py = _setup_py(project, "setup(version=get_version())\n")
+    with mock.patch('subprocess.check_output', return_value=b'5.0\n') as \
+            mocked_check:
+        assert get_version_from_setup_py(setup_py) == '5.0'
+    assert mocked_check.call_args[0][0][1:] == [setup_py, '--version']
@@ -7,6 +7,7 @@ import mock
 import pytest
 from tempfile import mkdtemp
 
+from ship_it import runner
 from ship_it.virtualenv import VirtualEnvPackager
 
 @pytest.fixture(autouse=True)
@@ -32,27 +33,25 @@ class TestPackage(object):
         monkeypatch.setattr('ship_it.virtualenv.path.isfile', always_true)
         monkeypatch.setattr('ship_it.virtualenv.path.isabs', always_true)
 
-    @pytest.mark.parametrize('venv,req,pkg_dir,expected', [
-        ('/local/venv/path', '/local/requirements.txt', '/local/pkg', [
-            '/local/venv/path/bin/pip install -r /local/requirements.txt',
-            'find /local/pkg -type f -name "*.py[co]" -delete;'
-            'find /local/pkg -type d -name "__pycache__" -delete',
-            'cp -r /local/pkg /local/venv/path',
-        ]),
+    @pytest.mark.parametrize('venv,req,pkg_dir', [
+        ('/local/venv/path', '/local/requirements.txt', '/local/pkg'),
         # we normalize the package directory to ignore any trailing slashes
-        ('/local/venv/path', '/local/requirements.txt', '/local/pkg/', [
-            '/local/venv/path/bin/pip install -r /local/requirements.txt',
-            'find /local/pkg/ -type f -name "*.py[co]" -delete;'
-            'find /local/pkg/ -type d -name "__pycache__" -delete',
-            'cp -r /local/pkg /local/venv/path',
-        ]),
+        ('/local/venv/path', '/local/requirements.txt', '/local/pkg/'),
     ])
-    def test_copy_package(self, mock_local, venv, pkg_dir, req, expected):
+    @mock.patch('ship_it.virtualenv.copy_tree')
+    def test_copy_package(self, mock_copy_tree, mock_local, venv, pkg_dir,
+                          req):
 
         assert not mock_local.called
-        VirtualEnvPackager(venv).copy_package(req, pkg_dir)
+        VirtualEnvPackager(venv).copy_package(req, pkg_dir, exclude=['*.log'])
 
-        assert mock_local.mock_calls == [mock.call(exp) for exp in expected]
+        assert mock_local.mock_calls == [
+            mock.call('/local/venv/path/bin/pip install -r '
+                      '/local/requirements.txt'),
+        ]
+        mock_copy_tree.assert_called_once_with(
+            '/local/pkg', '/local/venv/path/pkg',
+            exclude=('*.py[co]', '__pycache__', '*.log'))
 
     @pytest.mark.parametrize('venv,setup,expected', [
         ('/local/venv/path', '/local/setup.py',
@@ -136,39 +135,20 @@ class TestPatchVirtualEnv(object):
     def do_not_build(self, mock_build_venv):
         yield
 
-    def test_with_no_spaces(self, monkeypatch, mock_local):
-        monkeypatch.setattr('sys.executable', '/some/python.py')
-
-        local_venv = '/local/venv'
-        remote_venv = '/remote/venv'
-        pkger = VirtualEnvPackager(local_venv)
-        mock_local.reset_mock()
-        assert not mock_local.called
-        pkger.patch_virtualenv(remote_venv)
-        assert mock_local.mock_calls == [
-            mock.call('prelink -u /local/venv/bin/python'),
-            mock.call('/some/python.py -m virtualenv '
-                      '--relocatable /local/venv'),
-            mock.call('sed -i "s:/local/venv:/remote/venv:" '
-                      '/local/venv/bin/activate'),
-        ]
-
-    def test_with_spaces(self, monkeypatch, mock_local):
-        monkeypatch.setattr('sys.executable', '/some/python.py')
-
-        local_venv = '/local path/venv'
-        remote_venv = '/remote path/venv'
+    @pytest.mark.parametrize('local_venv,remote_venv,prelink', [
+        ('/local/venv', '/remote/venv', 'prelink -u /local/venv/bin/python'),
+        ('/local path/venv', '/remote path/venv',
+         "prelink -u '/local path/venv/bin/python'"),
+    ])
+    @mock.patch('ship_it.virtualenv.relocate_virtualenv')
+    def test_patch(self, mock_relocate, mock_local, local_venv, remote_venv,
+                   prelink):
         pkger = VirtualEnvPackager(local_venv)
         mock_local.reset_mock()
         assert not mock_local.called
         pkger.patch_virtualenv(remote_venv)
-        assert mock_local.mock_calls == [
-            mock.call("prelink -u '/local path/venv/bin/python'"),
-            mock.call("/some/python.py -m virtualenv --relocatable "
-                      "'/local path/venv'"),
-            mock.call('sed -i "s:/local path/venv:/remote path/venv:" '
-                      "'/local path/venv/bin/activate'"),
-        ]
+        assert mock_local.mock_calls == [mock.call(prelink)]
+        mock_relocate.assert_called_once_with(local_venv, remote_venv)
 
 
 @mock.patch('ship_it.virtualenv.logger')
@@ -193,7 +173,9 @@ def test_handle_prelink_issue(mock_logger, mock_local, mock_build_venv):
     ('/some/fake/absolute/path/to/directory', False),
     ('/some/fake/absolute/path/to/requirements.txt', False)
 ])
-def test_handle_odd_reqfile_paths(req_file_path, valid, mock_build_venv):
+@mock.patch('ship_it.virtualenv.copy_tree')
+def test_handle_odd_reqfile_paths(mock_copy_tree, req_file_path, valid,
+                                  mock_build_venv):
 
     if not valid:
         with pytest.raises(AssertionError):
@@ -217,3 +199,165 @@ def test_handle_odd_setup_paths(setup_path, valid, mock_build_venv):
             pkger.install_package(setup_path)
     else:
         pkger.install_package(setup_path)
+
+
+class TestIncremental(object):
+
+    @pytest.fixture
+    def venv(self, tmpdir):
+        tmpdir.join('venv', 'bin').ensure(dir=True).join('python').write('')
+        return str(tmpdir.join('venv'))
+
+    @pytest.fixture
+    def requirements(self, tmpdir):
+        req = tmpdir.join('requirements.txt')
+        req.write('six==1.8.0\n'
+                  '# a comment\n'
+                  'PyYaml==3.11\n')
+        return str(req)
+
+    def test_fresh_build_when_missing(self, tmpdir, mock_local):
+        pkger = VirtualEnvPackager(str(tmpdir.join('venv')), incremental=True)
+        assert not pkger.reused
+        assert mock_local.mock_calls == [
+            mock.call('/path/to/python.py -m virtualenv {}'.format(
+                tmpdir.join('venv')))
+        ]
+
+    def test_reuses_existing(self, venv, mock_local):
+        pkger = VirtualEnvPackager(venv, upgrade_pip=True, incremental=True)
+        assert pkger.reused
+        assert not mock_local.called
+
+    def test_fresh_build_records_requirements(self, venv, requirements,
+                                              mock_local):
+        pkger = VirtualEnvPackager(venv, incremental=True, build=False)
+        pkger.install_requirements(requirements)
+        with open(pkger.requirements_state_path) as fobj:
+            assert 'six==1.8.0' in fobj.read()
+
+    def test_only_installs_the_delta(self, tmpdir, venv, requirements,
+                                     mock_local):
+        tmpdir.join('venv.requirements.txt').write('six==1.7.3\n'
+                                                   'PyYaml==3.11\n'
+                                                   'click==6.6\n')
+        mock_local.return_value.stdout = ('six==1.7.3\n'
+                                          'PyYAML==3.11\n'
+                                          'click==6.6\n'
+                                          'pip==9.0.1\n'
+                                          'ship-it==0.1.0\n')
+        pkger = VirtualEnvPackager(venv, incremental=True)
+        pkger.install_requirements(requirements)
+
+        python = '{}/bin/python'.format(venv)
+        assert mock_local.mock_calls == [
+            mock.call('{} -m pip freeze'.format(python), hide=True),
+            mock.call('{} -m pip uninstall -y click'.format(python)),
+            mock.call('{} -m pip install six==1.8.0'.format(python)),
+        ]
+        with open(pkger.requirements_state_path) as fobj:
+            assert fobj.read() == open(requirements).read()
+
+    def test_unpinned_requirements_go_to_pip(self, tmpdir, venv, mock_local):
+        req = tmpdir.join('requirements.txt')
+        req.write('six==1.8.0\n.\n')
+        mock_local.return_value.stdout = 'six==1.8.0\n'
+        pkger = VirtualEnvPackager(venv, incremental=True)
+        pkger.install_requirements(str(req))
+
+        python = '{}/bin/python'.format(venv)
+        assert mock_local.mock_calls == [
+            mock.call('{} -m pip freeze'.format(python), hide=True),
+            mock.call('{} -m pip install -r {}'.format(python, req)),
+        ]
+
+
+class TestLockFile(object):
+
+    @pytest.fixture
+    def lock_file(self, tmpdir):
+        lock = tmpdir.join('requirements.lock')
+        lock.write('# generated by ship_it lock\n'
+                   'six==1.8.0 \\\n'
+                   '    --hash=sha256:abc\n'
+                   '.\n')
+        return str(lock)
+
+    @pytest.mark.parametrize('require_hashes, expected', [
+        (False, 'install --no-deps -r'),
+        (True, 'install --no-deps --require-hashes -r'),
+    ])
+    def test_installs_without_resolving(self, tmpdir, lock_file, mock_local,
+                                        require_hashes, expected):
+        tmpdir.join('requirements.txt').write('six\n.\n')
+        venv = str(tmpdir.join('venv'))
+        pkger = VirtualEnvPackager(venv, build=False, lock_file=lock_file,
+                                   require_hashes=require_hashes)
+        remote_file = '{}.lock.txt'.format(venv)
+        written = []
+        mock_local.side_effect = lambda command: written.append(
+            open(remote_file).read() if remote_file in command else None)
+
+        pkger.pip_install_package(str(tmpdir.join('requirements.txt')))
+
+        pip = '{}/bin/pip'.format(venv)
+        assert mock_local.mock_calls == [
+            mock.call('{} {} {}'.format(pip, expected, remote_file)),
+            mock.call('{} install --no-deps .'.format(pip)),
+            # setup.py's dependencies are still resolved
+            mock.call('{} install .'.format(pip)),
+        ]
+        assert written[0] == 'six==1.8.0      --hash=sha256:abc\n'
+        assert not os.path.exists(remote_file)
+
+    def test_incremental_sync(self, tmpdir, lock_file, mock_local):
+        tmpdir.join('venv', 'bin').ensure(dir=True).join('python').write('')
+        venv = str(tmpdir.join('venv'))
+        mock_local.return_value.stdout = 'six==1.7.3\n'
+        pkger = VirtualEnvPackager(venv, incremental=True, lock_file=lock_file)
+        pkger.install_requirements(str(tmpdir.join('requirements.lock')))
+
+        python = '{}/bin/python'.format(venv)
+        assert mock_local.mock_calls == [
+            mock.call('{} -m pip freeze'.format(python), hide=True),
+            mock.call('{} -m pip install --no-deps six==1.8.0'.format(python)),
+            mock.call('{} -m pip install --no-deps .'.format(python)),
+        ]
+
+
+@pytest.mark.parametrize('levels,mode,expected', [
+    ((0,), 'checked-hash',
+     '/local/venv/bin/python -m compileall -q -f -j 0 --invalidation-mode '
+     'checked-hash -o 0 -s /local/venv -p /opt/venv /local/venv'),
+    ((0, 2), 'unchecked-hash',
+     '/local/venv/bin/python -m compileall -q -f -j 0 --invalidation-mode '
+     'unchecked-hash -o 0 -o 2 -s /local/venv -p /opt/venv /local/venv'),
+])
+def test_precompile(mock_local, mock_build_venv, levels, mode, expected):
+    VirtualEnvPackager('/local/venv').precompile('/opt/venv', levels, mode)
+    mock_local.assert_called_once_with(expected, hide=True)
+
+
+def _compile_failure(*file_paths):
+    stdout = ''.join("*** Error compiling '{}'...\n  File \"{}\", line 1\n"
+                     "SyntaxError: invalid syntax\n\n".format(file_path,
+                                                              file_path)
+                     for file_path in file_paths)
+    return runner.CommandError(runner.CommandResult(
+        'compileall', 1, stdout, [], '/logs/precompile.log'))
+
+
+def test_precompile_tolerates_dependencies(mock_local, mock_build_venv):
+    mock_local.side_effect = _compile_failure(
+        '/local/venv/lib/python3.11/site-packages/dep/tests/py2.py')
+    VirtualEnvPackager('/local/venv').precompile('/opt/venv')
+
+
+def test_precompile_fails_for_everything_else(mock_local, mock_build_venv):
+    mock_local.side_effect = _compile_failure(
+        '/local/venv/lib/python3.11/site-packages/dep/tests/py2.py',
+        '/local/venv/ship_it/broken.py')
+    with pytest.raises(runner.CommandError) as excinfo:
+        VirtualEnvPackager('/local/venv').precompile('/opt/venv')
+    assert "Error compiling '/local/venv/ship_it/broken.py'" in \
+        str(excinfo.value)
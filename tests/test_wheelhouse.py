@@ -0,0 +1,75 @@
+# coding=utf-8
+from __future__ import unicode_literals
+import sys
+
+import mock
+import pytest
+
+from ship_it.requirements import split_local
+from ship_it.virtualenv import VirtualEnvPackager
+from ship_it.wheelhouse import Wheelhouse, get_abi_tag
+
+
+def test_abi_tag_names_the_interpreter():
+    tag = get_abi_tag()
+    assert '{}{}'.format(*sys.version_info[:2]) in tag
+    assert '/' not in tag and ' ' not in tag
+
+
+def test_split_local(tmpdir):
+    tmpdir.join('vendor', 'pkg').ensure(dir=True)
+    remote, local = split_local(['six==1.7.3',
+                                 '.',
+                                 '-e .',
+                                 'vendor/pkg',
+                                 'file:///tmp/thing.tar.gz',
+                                 '-r other.txt',
+                                 '--index-url https://example.com/simple'],
+                                str(tmpdir))
+    assert remote == ['six==1.7.3',
+                      '-r {}'.format(tmpdir.join('other.txt')),
+                      '--index-url https://example.com/simple']
+    assert local == ['.', '-e .', 'vendor/pkg', 'file:///tmp/thing.tar.gz']
+
+
+class TestInstalling(object):
+
+    @pytest.fixture
+    def wheelhouse(self, tmpdir):
+        return Wheelhouse(str(tmpdir.join('wheels')))
+
+    @pytest.fixture
+    def packager(self, tmpdir, wheelhouse):
+        return VirtualEnvPackager(str(tmpdir.join('venv')), build=False,
+                                  wheelhouse=wheelhouse)
+
+    def test_builds_then_installs_without_index(self, tmpdir, wheelhouse,
+                                                packager, mock_local):
+        req = tmpdir.join('requirements.txt')
+        req.write('six==1.7.3\n.\n')
+        packager.install_requirements(str(req))
+
+        pip = tmpdir.join('venv', 'bin', 'pip')
+        remote_file = '{}.wheelhouse.txt'.format(tmpdir.join('venv'))
+        assert mock_local.mock_calls == [
+            mock.call('{} wheel --wheel-dir {house} --find-links {house} '
+                      '-r {req}'.format(pip, house=wheelhouse.path,
+                                        req=remote_file)),
+            mock.call('{} install --no-index --find-links {house} '
+                      '-r {req}'.format(pip, house=wheelhouse.path,
+                                        req=remote_file)),
+            mock.call('{} install --find-links {house} .'.format(
+                pip, house=wheelhouse.path)),
+        ]
+        assert tmpdir.join('wheels').listdir() == [tmpdir.join('wheels',
+                                                               get_abi_tag())]
+        assert not tmpdir.join(remote_file).exists()
+
+    def test_pip_install_package_uses_wheelhouse(self, tmpdir, wheelhouse,
+                                                 packager, mock_local):
+        with mock.patch('ship_it.virtualenv.VirtualEnvPackager.'
+                        'install_requirements'):
+            packager.pip_install_package('/local/reqs.txt')
+        mock_local.assert_called_once_with(
+            '{} install --find-links {} .'.format(
+                tmpdir.join('venv', 'bin', 'pip'), wheelhouse.path))
@@ -0,0 +1,82 @@
+# coding=utf-8
+from __future__ import unicode_literals
+import os
+
+import py
+import pytest
+
+from ship_it.manifest import Manifest
+from ship_it.workspace import BuildWorkspace, FileLock, clean_work_dirs
+
+
+@pytest.fixture
+def project_manifest(tmpdir):
+    return Manifest(str(tmpdir.join('manifest.yaml')),
+                    manifest_contents={'name': 'ship_it'})
+
+
+def test_file_lock(tmpdir):
+    lock_path = str(tmpdir.join('a.lock'))
+    first = FileLock(lock_path)
+    second = FileLock(lock_path)
+    assert first.acquire(blocking=False)
+    assert not second.acquire(blocking=False)
+    first.release()
+    assert second.acquire(blocking=False)
+    second.release(remove=True)
+    assert not os.path.exists(lock_path)
+
+
+def test_shared_build_holds_the_lock(project_manifest, tmpdir):
+    with BuildWorkspace(project_manifest) as workspace:
+        assert project_manifest.build_dir == str(tmpdir.join('build'))
+        assert not FileLock(workspace.lock.path).acquire(blocking=False)
+        workspace.promote()
+    assert FileLock(workspace.lock.path).acquire(blocking=False)
+
+
+def test_isolated_builds(project_manifest, tmpdir):
+    other_manifest = Manifest(project_manifest.path,
+                              manifest_contents={'name': 'ship_it'})
+    tmpdir.join('build', 'ship_it', 'old').write('old', ensure=True)
+
+    with BuildWorkspace(project_manifest, isolated=True) as first, \
+            BuildWorkspace(other_manifest, isolated=True):
+        build_dir = project_manifest.build_dir
+        assert build_dir != other_manifest.build_dir
+        assert build_dir.startswith(str(tmpdir.join('build', '.work')))
+        assert project_manifest.local_virtualenv_path == os.path.join(
+            build_dir, 'ship_it')
+        assert project_manifest.local_log_path == str(tmpdir.join(
+            'build', 'ship_it-logs', project_manifest.build_id))
+        # neither can be cleaned up while it's running
+        clean_work_dirs(first.work_root)
+        assert os.path.isdir(build_dir)
+        assert os.path.isdir(other_manifest.build_dir)
+
+        py.path.local(project_manifest.local_virtualenv_path).join(
+            'new').write('new', ensure=True)
+        first.promote()
+        # the lock is only held while promoting
+        lock = FileLock(first.lock.path)
+        assert lock.acquire(blocking=False)
+        lock.release()
+
+    assert tmpdir.join('build', 'ship_it', 'new').read() == 'new'
+    assert not tmpdir.join('build', 'ship_it', 'old').check()
+    assert tmpdir.join('build', '.work').listdir() == []
+    assert project_manifest.build_dir == str(tmpdir.join('build'))
+
+
+def test_leftovers_are_cleaned_up(tmpdir):
+    work_root = tmpdir.join('build', '.work')
+    work_root.join('dead', 'ship_it', 'bin', 'python').ensure()
+    work_root.join('dead.lock').ensure()
+    work_root.join('orphan', 'file').ensure()
+    work_root.join('alive', 'ship_it').ensure(dir=True)
+    alive = FileLock(str(work_root.join('alive.lock')))
+    alive.acquire()
+
+    clean_work_dirs(str(work_root))
+    assert sorted(entry.basename for entry in work_root.listdir()) == [
+        'alive', 'alive.lock']